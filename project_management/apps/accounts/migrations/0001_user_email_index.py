@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:49
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        # auth_user.username is already indexed (unique); the member search
+        # also does prefix lookups on email
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS "accounts_user_email_idx" ON "auth_user" ("email");',
+            reverse_sql='DROP INDEX IF EXISTS "accounts_user_email_idx";',
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_user_email_index'),
+    ]
+
+    operations = [
+        # The member search matches prefixes in any case, as ranges of
+        # lower(username) and lower(email); a plain email index can't serve
+        # those
+        migrations.RunSQL(
+            'DROP INDEX IF EXISTS "accounts_user_email_idx";',
+            reverse_sql='CREATE INDEX IF NOT EXISTS "accounts_user_email_idx" ON "auth_user" ("email");',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS "accounts_user_username_lower_idx" ON "auth_user" (LOWER("username"));',
+            reverse_sql='DROP INDEX IF EXISTS "accounts_user_username_lower_idx";',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS "accounts_user_email_lower_idx" ON "auth_user" (LOWER("email"));',
+            reverse_sql='DROP INDEX IF EXISTS "accounts_user_email_lower_idx";',
+        ),
+    ]
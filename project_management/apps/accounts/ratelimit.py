@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.shortcuts import render
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger('apps.accounts.ratelimit')
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    "5/m" -> (5, 60): a bucket of 5 tokens that refills completely in a
+    minute.
+    """
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class BaseStore:
+    """
+    Where token buckets and the allowed/throttled counters are kept.
+    """
+
+    def consume(self, key, capacity, period):
+        """
+        Take a token from the bucket at key. Returns 0 if there was one,
+        otherwise the seconds until there will be.
+        """
+        raise NotImplementedError
+
+    def incr(self, name):
+        raise NotImplementedError
+
+    def counters(self):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+
+def _take(bucket, capacity, period, now):
+    # (new bucket, wait) for one request against bucket = (tokens, stamp)
+    tokens, stamp = bucket or (capacity, now)
+    tokens = min(capacity, tokens + (now - stamp) * capacity / period)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) * period / capacity
+
+
+class LocMemStore(BaseStore):
+    """
+    Buckets in process memory: each worker limits on its own, so the
+    effective limit is multiplied by the number of workers. At most
+    RATELIMIT_LOCMEM_MAX_KEYS buckets are kept; the least recently used
+    go first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._counters = Counter()
+
+    def consume(self, key, capacity, period):
+        with self._lock:
+            self._buckets[key], wait = _take(self._buckets.get(key), capacity, period, time.monotonic())
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > settings.RATELIMIT_LOCMEM_MAX_KEYS:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._counters.clear()
+
+
+class CacheStore(BaseStore):
+    """
+    Buckets in the RATELIMIT_CACHE cache, shared by every worker using it.
+    Reading and writing a bucket aren't atomic, so concurrent requests may
+    occasionally both get the last token; the limit still holds within a
+    request or two.
+    """
+
+    prefix = 'ratelimit'
+
+    @property
+    def cache(self):
+        return caches[settings.RATELIMIT_CACHE]
+
+    def consume(self, key, capacity, period):
+        key = f'{self.prefix}:{key}'
+        bucket, wait = _take(self.cache.get(key), capacity, period, time.time())
+        # A bucket left alone for a period is full again, the same as none
+        self.cache.set(key, bucket, period)
+        return wait
+
+    def incr(self, name):
+        key = self._counter_key(name)
+        if not self.cache.add(key, 1, None):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Evicted in between
+                self.cache.add(key, 1, None)
+
+    def counters(self):
+        names = [
+            f'{scope}.{kind}.{outcome}'
+            for scope, limits in settings.RATELIMIT_RATES.items()
+            for kind in limits
+            for outcome in ('allowed', 'throttled')
+        ]
+        found = self.cache.get_many([self._counter_key(name) for name in names])
+        return {name: found[self._counter_key(name)] for name in names if self._counter_key(name) in found}
+
+    def reset(self):
+        # Buckets expire on their own; only the counters are cleared
+        self.cache.delete_many([self._counter_key(name) for name in self.counters()])
+
+    def _counter_key(self, name):
+        return f'{self.prefix}:count:{name}'
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = import_string(settings.RATELIMIT_STORE)()
+    return _store
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting in ('RATELIMIT_STORE', 'RATELIMIT_CACHE', 'RATELIMIT_RATES'):
+        _store = None
+
+
+def client_ip(request):
+    # REMOTE_ADDR only: X-Forwarded-For is set by the client unless a
+    # trusted proxy rewrites it (configure the proxy to set REMOTE_ADDR)
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _key(scope, kind, value):
+    # Hashed so any username makes a short, cache-safe key
+    digest = hashlib.sha256(str(value).encode()).hexdigest()[:32]
+    return f'{scope}:{kind}:{digest}'
+
+
+def check(scope, request, username=None):
+    """
+    Count one attempt against the scope's buckets (per IP, and per
+    username when the scope has a username rate and one was given).
+    Returns 0 if the attempt may go ahead, otherwise the seconds to wait.
+    """
+    if not settings.RATELIMIT_ENABLED:
+        return 0
+    store = get_store()
+    values = {'ip': client_ip(request), 'username': (username or '').strip().lower()}
+    for kind, rate in settings.RATELIMIT_RATES.get(scope, {}).items():
+        if not values[kind]:
+            continue
+        capacity, period = parse_rate(rate)
+        wait = store.consume(_key(scope, kind, values[kind]), capacity, period)
+        if wait:
+            store.incr(f'{scope}.{kind}.throttled')
+            logger.warning("Rate limit %s.%s hit from %s", scope, kind, values['ip'])
+            return wait
+        store.incr(f'{scope}.{kind}.allowed')
+    return 0
+
+
+def ratelimit(scope, template):
+    """
+    Decorator for the HTMX views: a POST over the scope's limits gets the
+    form partial (template) back with a 429 before the view runs, so no
+    password is hashed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method == 'POST':
+                wait = check(scope, request, request.POST.get('username'))
+                if wait:
+                    response = render(request, template, {
+                        'error': f'Too many attempts. Try again in {int(wait) + 1} seconds.',
+                        'username': request.POST.get('username'),
+                    }, status=429)
+                    response['Retry-After'] = str(int(wait) + 1)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ScopedRateThrottle(BaseThrottle):
+    """
+    DRF throttle over the same buckets as the ratelimit decorator. DRF
+    checks throttles before calling the handler and answers 429 with a
+    Retry-After header.
+    """
+
+    scope = None
+
+    def allow_request(self, request, view):
+        if request.method != 'POST':
+            return True
+        # The body may be any JSON (a list, a number): then there is no
+        # username and only the IP buckets count the attempt
+        data = request.data if isinstance(request.data, Mapping) else {}
+        username = data.get('username')
+        self._wait = check(self.scope, request, username if isinstance(username, str) else None)
+        return not self._wait
+
+    def wait(self):
+        return self._wait
+
+
+class LoginRateThrottle(ScopedRateThrottle):
+    scope = 'login'
+
+
+class SignupRateThrottle(ScopedRateThrottle):
+    scope = 'signup'
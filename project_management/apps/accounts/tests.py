@@ -1,6 +1,11 @@
-from django.test import TestCase, Client
+from unittest import mock
+
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .ratelimit import get_store
 
 
 class SignupTest(TestCase):
@@ -83,3 +88,80 @@ class LoginTest(TestCase):
         self.assertIn(b'Invalid credentials.', response.content)
 
 
+
+@override_settings(RATELIMIT_RATES={'login': {'ip': '3/m', 'username': '2/m'}, 'signup': {'ip': '1/h'}})
+class RateLimitTest(TestCase):
+    def setUp(self):
+        get_store().reset()
+        self.user = User.objects.create_user(username='testuser', password='secret123')
+
+    def _login(self, username='testuser', ip='10.0.0.1', password='wrong'):
+        return self.client.post(reverse('login_htmx'), data={'username': username, 'password': password},
+                                REMOTE_ADDR=ip)
+
+    def test_username_limit_applies_across_ips(self):
+        self.assertEqual(self._login(ip='10.0.0.1').status_code, 401)
+        self.assertEqual(self._login(ip='10.0.0.2').status_code, 401)
+        with mock.patch('apps.accounts.views.authenticate') as authenticate:
+            response = self._login(ip='10.0.0.3', password='secret123')
+        # Throttled before authenticate() could hash anything
+        authenticate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(b'Too many attempts', response.content)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_ip_limit_applies_across_usernames(self):
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(self._login(username=name).status_code, 401)
+        self.assertEqual(self._login(username='d').status_code, 429)
+        self.assertEqual(self._login(username='d', ip='10.0.0.9').status_code, 401)
+
+    def test_bucket_refills(self):
+        with mock.patch('apps.accounts.ratelimit.time.monotonic', return_value=1000.0):
+            self._login()
+            self._login()
+            self.assertEqual(self._login().status_code, 429)
+        # 2/m: one token back after 30 seconds
+        with mock.patch('apps.accounts.ratelimit.time.monotonic', return_value=1031.0):
+            self.assertEqual(self._login(password='secret123').status_code, 200)
+
+    def test_drf_signup_throttled(self):
+        data = {'username': 'new', 'password': 'pw123456', 'password_confirm': 'pw123456'}
+        self.assertEqual(self.client.post(reverse('signup'), data).status_code, 201)
+        response = self.client.post(reverse('signup'), dict(data, username='newer'))
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(User.objects.filter(username='newer').exists())
+
+    def test_drf_non_object_body_is_throttled_not_crashing(self):
+        for i, body in enumerate(('["new"]', '42', '{"username": ["new"]}')):
+            response = self.client.post(reverse('signup'), body, content_type='application/json',
+                                        REMOTE_ADDR=f'10.0.1.{i}')
+            self.assertEqual(response.status_code, 400)
+        # Still counted against the IP bucket
+        response = self.client.post(reverse('signup'), '[]', content_type='application/json', REMOTE_ADDR='10.0.1.0')
+        self.assertEqual(response.status_code, 429)
+
+    def test_counters(self):
+        self._login()
+        self._login()
+        self._login()
+        staff = User.objects.create_user(username='staff', password='staffpass', is_staff=True)
+        self.client.force_login(staff)
+        counters = self.client.get(reverse('ratelimit_stats')).json()
+        self.assertEqual(counters['login.ip.allowed'], 3)
+        self.assertEqual(counters['login.username.allowed'], 2)
+        self.assertEqual(counters['login.username.throttled'], 1)
+
+    @override_settings(RATELIMIT_STORE='apps.accounts.ratelimit.CacheStore')
+    def test_cache_store(self):
+        cache.clear()
+        self._login()
+        self._login()
+        self.assertEqual(self._login().status_code, 429)
+        self.assertEqual(get_store().counters()['login.username.throttled'], 1)
+
+    @override_settings(RATELIMIT_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(5):
+            self.assertEqual(self._login().status_code, 401)
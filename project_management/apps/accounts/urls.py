@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import signup_htmx, login_htmx,SignupView,user_logout,logout_htmx
+from .views import signup_htmx, login_htmx,SignupView,user_logout,logout_htmx,ratelimit_stats
 
 urlpatterns = [
     path('createUser/', SignupView.as_view(), name='signup'),
@@ -7,6 +7,7 @@ urlpatterns = [
     path('login/', login_htmx, name='login_htmx'),
     path('logout/', logout_htmx, name='logout_htmx'),
 path('logout/', user_logout, name='logout'),
+    path('ratelimit/', ratelimit_stats, name='ratelimit_stats'),
 
     # You can add paths for login/logout if not using DRF’s token or session endpoints
 ]
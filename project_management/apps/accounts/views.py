@@ -6,6 +6,14 @@ from django.contrib.auth import login, authenticate,logout
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import ensure_csrf_cookie
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+import logging
+from collections.abc import Mapping
+
+from .ratelimit import LoginRateThrottle, SignupRateThrottle, get_store, ratelimit
+
+logger = logging.getLogger(__name__)
 '''
 class SignupView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -14,8 +22,11 @@ class SignupView(generics.CreateAPIView):
 '''
 class SignupView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [SignupRateThrottle]
 
     def post(self, request):
+        if not isinstance(request.data, Mapping):
+            return Response({"detail": "Expected a JSON object."}, status=status.HTTP_400_BAD_REQUEST)
         username = request.data.get('username')
         email = request.data.get('email', '')
         password = request.data.get('password')
@@ -62,8 +73,11 @@ class SignupView(APIView):
 
 class LoginView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginRateThrottle]
 
     def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, Mapping):
+            return Response({"detail": "Expected a JSON object."}, status=status.HTTP_400_BAD_REQUEST)
         username = request.data.get('username')
         password = request.data.get('password')
 
@@ -93,6 +107,7 @@ class LogoutView(APIView):
 #htmx views
 
 #@ensure_csrf_cookie
+@ratelimit('signup', 'accounts/partials/_signup_form.html')
 def signup_htmx(request):
     try:
         if request.method == 'POST':
@@ -125,16 +140,12 @@ def signup_htmx(request):
 
             # Create user
             user = User.objects.create_user(username=username, email=email, password=password)
-            print('userf',user)
             # Auto-login
             user = authenticate(username=username, password=password)
-            print('userx',user)
 
             if user is not None:
                 login(request, user)
 
-            print('here')
-
             # Return a success partial
             return render(request, 'accounts/partials/_signup_success.html', {
                 'username': username
@@ -144,10 +155,11 @@ def signup_htmx(request):
         return render(request, 'accounts/signup.html')
 
     except Exception as e:  # Corrected exception handling
-        print('Errorxxx:', e)
+        logger.exception('Signup failed: %s', e)
 
 
 @ensure_csrf_cookie
+@ratelimit('login', 'accounts/partials/_login_form.html')
 def login_htmx(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -158,7 +170,6 @@ def login_htmx(request):
             }, status=400)
 
         user = authenticate(username=username, password=password)
-        print('user',user)
 
         if user is not None:
             login(request, user)
@@ -188,3 +199,8 @@ def user_logout(request):
     logout(request)
     return redirect('login')  # or wherever you want to redirect
 
+
+@staff_member_required
+def ratelimit_stats(request):
+    """Allowed/throttled attempts per scope and key type, for monitoring."""
+    return JsonResponse(get_store().counters())
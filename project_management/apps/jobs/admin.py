@@ -0,0 +1,17 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'created_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at', 'locked_at', 'last_error')
+    actions = ['retry']
+
+    @admin.action(description="Retry selected jobs now")
+    def retry(self, request, queryset):
+        updated = queryset.update(status=Job.QUEUED, attempts=0, run_at=timezone.now(), locked_at=None)
+        self.message_user(request, f"{updated} job(s) queued.")
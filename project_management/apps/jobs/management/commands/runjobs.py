@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.jobs.queue import run_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs. Polls the job table until interrupted; "
+        "start as many workers as needed, they never run the same job twice."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due, then exit.")
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Seconds to wait when the queue is empty (default: JOBS_POLL_INTERVAL).",
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] if options['interval'] is not None else settings.JOBS_POLL_INTERVAL
+        if options['once']:
+            succeeded, failed = run_pending()
+            self.stdout.write(f"Ran {succeeded + failed} job(s), {failed} failed.")
+            return
+
+        try:
+            while True:
+                close_old_connections()
+                succeeded, failed = run_pending(settings.JOBS_BATCH_SIZE)
+                if succeeded or failed:
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"Ran {succeeded + failed} job(s), {failed} failed.")
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
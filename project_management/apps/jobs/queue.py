@@ -0,0 +1,132 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('apps.jobs')
+
+_handlers = {}
+
+
+class UnknownJob(LookupError):
+    pass
+
+
+def register(name):
+    """
+    Decorator registering a function as the handler of jobs called name.
+    Handlers get the job's payload as keyword arguments; they may run more
+    than once (after a crash or a retry), so keep them idempotent.
+    """
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def get_handler(name):
+    try:
+        return _handlers[name]
+    except KeyError:
+        raise UnknownJob(f"No handler registered for job {name!r}.") from None
+
+
+def enqueue(name, **payload):
+    """
+    Queue a call of the handler registered as name. The row is inserted in
+    the caller's transaction, so the job only becomes visible to workers if
+    the write that caused it commits. With JOBS_EAGER the handler runs right
+    away, in process, and its exceptions propagate (for tests and setups
+    without a worker). Payload values must be JSON serializable.
+    """
+    handler = get_handler(name)
+    if settings.JOBS_EAGER:
+        handler(**payload)
+        return None
+    return Job.objects.create(name=name, payload=payload, max_attempts=settings.JOBS_MAX_ATTEMPTS)
+
+
+def retry_delay(attempts):
+    """
+    Seconds before another try of a job that failed `attempts` times.
+    """
+    return settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def claim(limit):
+    """
+    Mark up to `limit` due jobs as running and return them, oldest first.
+    Jobs left running longer than JOBS_LOCK_TIMEOUT (their worker died) are
+    claimed again. Each claim is a conditional UPDATE, so concurrent
+    workers never run the same job.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    due = (
+        Job.objects
+        .filter(Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=stale))
+        .order_by('run_at', 'id')[:limit]
+    )
+    claimed = []
+    for job in due:
+        won = Job.objects.filter(pk=job.pk, status=job.status, locked_at=job.locked_at).update(
+            status=Job.RUNNING, locked_at=now, attempts=job.attempts + 1,
+        )
+        if won:
+            job.status, job.locked_at, job.attempts = Job.RUNNING, now, job.attempts + 1
+            claimed.append(job)
+    return claimed
+
+
+def run(job):
+    """
+    Run one claimed job. Its database writes and the removal of its row
+    commit together; on failure it's queued again with a growing delay,
+    or marked failed after max_attempts.
+    """
+    try:
+        with transaction.atomic():
+            get_handler(job.name)(**job.payload)
+            job.delete()
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            logger.warning("Job %s #%d failed (attempt %d/%d), retrying",
+                           job.name, job.pk, job.attempts, job.max_attempts)
+        else:
+            job.status = Job.FAILED
+            logger.error("Job %s #%d failed for good after %d attempts", job.name, job.pk, job.attempts)
+        job.locked_at = None
+        job.last_error = error
+        job.save(update_fields=['status', 'run_at', 'locked_at', 'last_error'])
+        return False
+    return True
+
+
+def run_pending(limit=None):
+    """
+    Claim and run due jobs until none are left (or `limit` have run).
+    Returns (succeeded, failed).
+    """
+    succeeded = failed = 0
+    while limit is None or succeeded + failed < limit:
+        batch = settings.JOBS_BATCH_SIZE
+        if limit is not None:
+            batch = min(batch, limit - succeeded - failed)
+        jobs = claim(batch)
+        if not jobs:
+            break
+        for job in jobs:
+            if run(job):
+                succeeded += 1
+            else:
+                failed += 1
+    return succeeded, failed
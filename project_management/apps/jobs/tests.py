@@ -0,0 +1,118 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.projects.fragments import feed_version
+from apps.projects.models import ActivityEntry, Project, ProjectMembership
+from .models import Job
+from .queue import claim, enqueue, register, run_pending
+
+calls = []
+
+
+@register('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@register('tests.fail')
+def fail():
+    raise RuntimeError("boom")
+
+
+@override_settings(JOBS_EAGER=False, JOBS_RETRY_DELAY=10, JOBS_MAX_ATTEMPTS=2)
+class JobQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueued_job_runs_once_and_is_removed(self):
+        enqueue('tests.record', value=1)
+        self.assertEqual(calls, [])
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(run_pending(), (0, 0))
+
+    def test_failures_are_retried_with_backoff_then_kept(self):
+        job = enqueue('tests.fail')
+        with self.assertLogs('apps.jobs', 'WARNING'):
+            self.assertEqual(run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('apps.jobs', 'ERROR'):
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(run_pending(), (0, 0))
+
+    def test_jobs_are_claimed_once_and_lost_ones_reclaimed(self):
+        enqueue('tests.record', value=1)
+        [job] = claim(10)
+        self.assertEqual(claim(10), [])
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        [again] = claim(10)
+        self.assertEqual((again.pk, again.attempts), (job.pk, 2))
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_mode_runs_inline(self):
+        self.assertIsNone(enqueue('tests.record', value=2))
+        self.assertEqual(calls, [2])
+        self.assertFalse(Job.objects.exists())
+
+    def test_runjobs_command(self):
+        enqueue('tests.record', value=3)
+        out = StringIO()
+        call_command('runjobs', once=True, stdout=out)
+        self.assertEqual(calls, [3])
+        self.assertIn('Ran 1 job(s), 0 failed.', out.getvalue())
+
+
+@override_settings(JOBS_EAGER=False)
+class ProjectJobsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.editor = User.objects.create_user(username='editor', password='editorpass')
+        self.project = Project.objects.create(name='Queued', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        ProjectMembership.objects.create(user=self.editor, project=self.project, role='editor')
+        run_pending()
+        self.client.login(username='editor', password='editorpass')
+
+    def test_comment_activity_is_deferred_to_a_job(self):
+        version = feed_version(self.project.pk)
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('project_comment_add', args=[self.project.pk]), data={'text': 'later'})
+
+        # Project lists live in the web process's cache: fresh at once,
+        # through the project's version, without looking up the members.
+        # Activity entries come from the job
+        self.assertNotEqual(feed_version(self.project.pk), version)
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "projects_projectmembership"' in q['sql']
+                          and 'SELECT "projects_projectmembership"."user_id"' in q['sql']])
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['projects.comment_created'])
+        self.assertFalse(ActivityEntry.objects.filter(user=self.owner, verb=ActivityEntry.COMMENT).exists())
+        run_pending()
+        self.assertTrue(ActivityEntry.objects.filter(user=self.owner, verb=ActivityEntry.COMMENT).exists())
+
+    def test_member_add_queues_fan_out(self):
+        reader = User.objects.create_user(username='reader', password='readerpass')
+        self.client.login(username='owner', password='ownerpass')
+        self.client.post(
+            reverse('project_add_member', args=[self.project.pk]), data={'user_id': reader.pk, 'role': 'reader'}
+        )
+        [job] = Job.objects.all()
+        self.assertEqual((job.name, job.payload['project_id']), ('projects.members_added', self.project.pk))
@@ -0,0 +1,141 @@
+from datetime import timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from apps.jobs.queue import enqueue
+
+from .models import ActivityEntry, ProjectMembership
+from .pagination import keyset_page, akeyset_page
+from .sharding import projects_in_bulk
+
+_TRIM_KEY = 'projects:activity_trim'
+
+
+def fan_out(project_id, verb, actor_id=None, text='', created_at=None):
+    """
+    Write one ActivityEntry per member of the project except the actor.
+    Members are streamed and inserted ACTIVITY_FANOUT_BATCH_SIZE at a time,
+    so large projects never hold every recipient in memory. Returns the
+    number of entries written. Runs in a job, not in the request.
+    """
+    if created_at is None:
+        created_at = timezone.now()
+    text = Truncator(text).chars(ActivityEntry._meta.get_field('text').max_length)
+    recipients = (
+        ProjectMembership.objects.filter(project_id=project_id)
+        .exclude(user_id=actor_id)
+        .values_list('user_id', flat=True)
+        .iterator(chunk_size=settings.ACTIVITY_FANOUT_BATCH_SIZE)
+    )
+    written = 0
+    while batch := list(islice(recipients, settings.ACTIVITY_FANOUT_BATCH_SIZE)):
+        ActivityEntry.objects.bulk_create([
+            ActivityEntry(user_id=user_id, project_id=project_id, actor_id=actor_id,
+                          verb=verb, text=text, created_at=created_at)
+            for user_id in batch
+        ])
+        written += len(batch)
+    schedule_trim()
+    return written
+
+
+def usernames_text(user_ids):
+    """
+    "alice", "alice and bob" or "alice and 3 others".
+    """
+    names = list(User.objects.filter(pk__in=user_ids[:2]).order_by('username').values_list('username', flat=True))
+    if len(user_ids) == 1 or not names:
+        return ''.join(names[:1])
+    if len(user_ids) == 2:
+        return ' and '.join(names)
+    return f"{names[0]} and {len(user_ids) - 1} others"
+
+
+def activity_page(user, cursor=None, limit=None):
+    """
+    (entries, next_cursor) of a user's feed, newest first, in one query.
+    """
+    if limit is None:
+        limit = settings.ACTIVITY_PAGE_SIZE
+    entries, next_cursor = keyset_page(_feed(user), cursor, limit)
+    if settings.PROJECT_SHARDS:
+        entries = _with_projects(entries)
+    return entries, next_cursor
+
+
+async def aactivity_page(user, cursor=None, limit=None):
+    if limit is None:
+        limit = settings.ACTIVITY_PAGE_SIZE
+    entries, next_cursor = await akeyset_page(_feed(user), cursor, limit)
+    if settings.PROJECT_SHARDS:
+        entries = await sync_to_async(_with_projects)(entries)
+    return entries, next_cursor
+
+
+def _feed(user):
+    if settings.PROJECT_SHARDS:
+        # The projects are on the shards (see _with_projects)
+        return ActivityEntry.objects.filter(user=user).select_related('actor')
+    # Deleted projects' entries are purged with them, and hidden until then
+    return (
+        ActivityEntry.objects.filter(user=user, project__deleted_at__isnull=True)
+        .select_related('project', 'actor')
+    )
+
+
+def _with_projects(entries):
+    # Attach the projects, from each shard holding some; entries of
+    # projects deleted since are left out
+    projects = projects_in_bulk({entry.project_id for entry in entries})
+    for entry in entries:
+        if entry.project_id in projects:
+            entry.project = projects[entry.project_id]
+    return [entry for entry in entries if entry.project_id in projects]
+
+
+def schedule_trim():
+    """
+    Queue a trim_activity job, at most once per ACTIVITY_TRIM_INTERVAL.
+    """
+    if cache.add(_TRIM_KEY, 1, settings.ACTIVITY_TRIM_INTERVAL):
+        enqueue('projects.trim_activity')
+
+
+def _delete_in_batches(queryset):
+    # Short DELETEs by primary key instead of one statement holding the
+    # write lock for the whole table
+    deleted = 0
+    while pks := list(queryset.values_list('pk', flat=True)[:settings.ACTIVITY_FANOUT_BATCH_SIZE]):
+        deleted += ActivityEntry.objects.filter(pk__in=pks).delete()[0]
+    return deleted
+
+
+def trim_activity():
+    """
+    Delete entries older than ACTIVITY_RETENTION_DAYS and, for each user,
+    everything past their newest ACTIVITY_FEED_MAX_ENTRIES. Returns the
+    number of entries deleted.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.ACTIVITY_RETENTION_DAYS)
+    deleted = _delete_in_batches(ActivityEntry.objects.filter(created_at__lt=cutoff))
+
+    keep = settings.ACTIVITY_FEED_MAX_ENTRIES
+    crowded = (
+        ActivityEntry.objects.values('user_id')
+        .annotate(entries=Count('id')).filter(entries__gt=keep)
+        .values_list('user_id', flat=True)
+    )
+    for user_id in list(crowded):
+        feed = ActivityEntry.objects.filter(user_id=user_id)
+        created_at, pk = feed.order_by('-created_at', '-id').values_list('created_at', 'id')[keep - 1]
+        deleted += _delete_in_batches(
+            feed.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        )
+    return deleted
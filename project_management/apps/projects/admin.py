@@ -1,10 +1,94 @@
 # apps/projects/admin.py
-from django.contrib import admin
-from .models import Project, ProjectMembership, Comment
+import os
+import uuid
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from apps.jobs.queue import enqueue
+
+from .imports import FORMATS, ImportFormatError, detect_format
+from .models import Project, ProjectMembership, Comment, ArchivedComment, ActivityEntry, ImportRun, ProjectDeletion
 
 admin.site.register(Project)
 admin.site.register(ProjectMembership)
 admin.site.register(Comment)
-from django.contrib import admin
+admin.site.register(ArchivedComment)
+admin.site.register(ActivityEntry)
+
+
+class ImportUploadForm(forms.Form):
+    file = forms.FileField(help_text=f"{', '.join(sorted(FORMATS))} file, see `manage.py import_projects --help`.")
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        try:
+            detect_format(upload.name)
+        except ImportFormatError as e:
+            raise forms.ValidationError(str(e))
+        return upload
+
+
+@admin.register(ImportRun)
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = ('source', 'status', 'rows_done', 'projects', 'members', 'comments', 'errors', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = [field.name for field in ImportRun._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_upload_permission(self, request):
+        # Imports create projects, memberships and comments
+        return request.user.has_perm('projects.add_project') and self.has_change_permission(request)
+
+    def get_urls(self):
+        return [
+            path('upload/', self.admin_site.admin_view(self.upload_view), name='projects_importrun_upload'),
+        ] + super().get_urls()
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {**(extra_context or {}), 'has_upload_permission': self.has_upload_permission(request)}
+        return super().changelist_view(request, extra_context)
+
+    def upload_view(self, request):
+        """
+        Store the upload and queue its import; the worker runs it in
+        batches and the run shows up in this list.
+        """
+        if not self.has_upload_permission(request):
+            raise PermissionDenied
+        form = ImportUploadForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            os.makedirs(settings.IMPORT_UPLOAD_DIR, exist_ok=True)
+            stored = os.path.join(settings.IMPORT_UPLOAD_DIR, f"{uuid.uuid4().hex}-{os.path.basename(upload.name)}")
+            with open(stored, 'wb') as f:
+                for chunk in upload.chunks():
+                    f.write(chunk)
+            enqueue('projects.import_file', path=stored, source=upload.name)
+            self.message_user(request, f"{upload.name} is queued for import.", messages.SUCCESS)
+            return redirect('admin:projects_importrun_changelist')
+
+        return TemplateResponse(request, 'admin/projects/importrun/upload.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'form': form,
+            'title': 'Upload an import file',
+        })
+
+
+@admin.register(ProjectDeletion)
+class ProjectDeletionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'project_id', 'status', 'comments_deleted', 'comments', 'members_deleted', 'members',
+                    'activity_deleted', 'deleted_by', 'created_at', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = [field.name for field in ProjectDeletion._meta.fields]
 
-# Register your models here.
+    def has_add_permission(self, request):
+        return False
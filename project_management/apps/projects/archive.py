@@ -0,0 +1,71 @@
+"""
+Old comments in a cold table: comments older than
+COMMENT_ARCHIVE_AFTER_DAYS move from Comment to ArchivedComment, so the
+live table and its indexes only hold the recent ones that feeds and
+activity read. Feeds page into the archive past the end of the live
+table (apps.projects.pagination), with the same cursors.
+
+Rows are moved with raw statements: no signals, so the project counters
+and the search index (keyed by the comment id, which is kept) stay as
+they are.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.utils import timezone
+
+from apps.jobs.queue import enqueue
+
+from .models import ArchivedComment, Comment
+
+_SCHEDULE_KEY = 'projects:comment_archive'
+
+
+def archive_rows(comments):
+    """
+    Move saved Comment rows to the archive, in the caller's transaction.
+    """
+    using = router.db_for_write(Comment)
+    ArchivedComment.objects.using(using).bulk_create([
+        ArchivedComment(id=c.pk, project_id=c.project_id, user_id=c.user_id, text=c.text, created_at=c.created_at)
+        for c in comments
+    ])
+    Comment.objects.using(using).filter(pk__in=[c.pk for c in comments])._raw_delete(using)
+
+
+def archive_comments(days=None, batch_size=None, max_batches=None):
+    """
+    Move the comments older than `days` (COMMENT_ARCHIVE_AFTER_DAYS) of
+    the selected database to the archive, batch_size per transaction and
+    at most max_batches batches. Returns the number of comments moved.
+    """
+    if days is None:
+        days = settings.COMMENT_ARCHIVE_AFTER_DAYS
+    batch_size = batch_size or settings.COMMENT_ARCHIVE_BATCH_SIZE
+    using = router.db_for_write(Comment)
+    # A range scan of the created_at index: imported comments keep their
+    # original times but get new ids, so ids don't follow age
+    old = (
+        Comment.objects.using(using).filter(created_at__lt=timezone.now() - timedelta(days=days))
+        .order_by('created_at', 'id')
+    )
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = list(old[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic(using=using):
+            archive_rows(batch)
+        archived += len(batch)
+        batches += 1
+    return archived
+
+
+def schedule_archive():
+    """
+    Queue an archive_comments job, at most once per COMMENT_ARCHIVE_INTERVAL.
+    """
+    if cache.add(_SCHEDULE_KEY, 1, settings.COMMENT_ARCHIVE_INTERVAL):
+        enqueue('projects.archive_comments')
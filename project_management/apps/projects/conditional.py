@@ -0,0 +1,135 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .fragments import afeed_version, feed_version
+from .models import Project
+from .roles import role_for, arole_for
+from .sharding import fan_out
+
+
+def _etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(p) for p in parts).encode()).hexdigest())
+
+
+_STATE_FIELDS = ('owner_id', 'updated_at', 'last_activity_at', 'comment_count', 'member_count')
+
+
+def project_state(request, pk):
+    """
+    The validators of one project, from a single row. Memoized on the
+    request since etag and last-modified both need it.
+    None if the project doesn't exist or the user can't see it.
+    """
+    states = request.__dict__.setdefault('_project_states', {})
+    if pk not in states:
+        state = Project.objects.filter(pk=pk).values(*_STATE_FIELDS).first()
+        if state is not None:
+            state['user_id'] = request.user.pk
+            state['role'] = role_for(request.user, Project(pk=pk, owner_id=state['owner_id']))
+            if state['role'] is None:
+                state = None
+            else:
+                state['feed_version'] = feed_version(pk)
+        states[pk] = state
+    return states[pk]
+
+
+async def aproject_state(request, pk):
+    """
+    Async project_state(), filling the same memo.
+    """
+    states = request.__dict__.setdefault('_project_states', {})
+    if pk not in states:
+        state = await Project.objects.filter(pk=pk).values(*_STATE_FIELDS).afirst()
+        if state is not None:
+            user = await request.auser()
+            state['user_id'] = user.pk
+            state['role'] = await arole_for(user, Project(pk=pk, owner_id=state['owner_id']))
+            if state['role'] is None:
+                state = None
+            else:
+                state['feed_version'] = await afeed_version(pk)
+        states[pk] = state
+    return states[pk]
+
+
+def project_etag(request, pk, **kwargs):
+    state = project_state(request, pk)
+    if state is None:
+        return None
+    # The rendered output depends on who is looking, not just on the data.
+    # The feed version catches comment edits and role changes, which the
+    # row's own columns don't show
+    return _etag(pk, state['updated_at'].isoformat(), state['last_activity_at'].isoformat(), state['comment_count'],
+                 state['member_count'], state['feed_version'], state['user_id'], state['role'])
+
+
+def project_last_modified(request, pk, **kwargs):
+    state = project_state(request, pk)
+    if state is None:
+        return None
+    return max(state['updated_at'], state['last_activity_at'])
+
+
+def async_project_condition(view):
+    """
+    @condition(project_etag, project_last_modified) for async views.
+    @condition calls the validator functions synchronously, so the state
+    they read is loaded with the async ORM first.
+    """
+    conditional = condition(etag_func=project_etag, last_modified_func=project_last_modified)(view)
+
+    @wraps(view)
+    async def inner(request, pk, *args, **kwargs):
+        await aproject_state(request, pk)
+        return await conditional(request, pk, *args, **kwargs)
+    return inner
+
+
+def project_list_validators(request, queryset):
+    """
+    (etag, last_modified) for a list of projects, in one aggregate query
+    over the projects' own counters (per shard, when sharded).
+    """
+    states = [state for state in fan_out(lambda: queryset.order_by().aggregate(
+        count=Count('pk'),
+        updated=Max('updated_at'),
+        comment_count=Sum('comment_count'),
+        latest_activity=Max('last_activity_at'),
+        member_count=Sum('member_count'),
+    )) if state['count']]
+    if not states:
+        return _etag('empty', request.user.pk), None
+    state = {
+        'count': sum(state['count'] for state in states),
+        'updated': max(state['updated'] for state in states),
+        'comment_count': sum(state['comment_count'] for state in states),
+        'latest_activity': max(state['latest_activity'] for state in states),
+        'member_count': sum(state['member_count'] for state in states),
+    }
+    etag = _etag(state['count'], state['updated'].isoformat(), state['latest_activity'].isoformat(),
+                 state['comment_count'], state['member_count'], request.user.pk)
+    return etag, max(state['updated'], state['latest_activity'])
+
+
+def conditional_response(request, etag, last_modified, get_response):
+    """
+    A 304 (or 412) if the client's copy is current, else get_response()
+    with ETag/Last-Modified set. For views that can't use @condition,
+    such as DRF viewset actions.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = get_response()
+        if response.status_code == 200:
+            if etag:
+                response['ETag'] = etag
+            if timestamp:
+                response['Last-Modified'] = http_date(timestamp)
+    return response
@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Project, ProjectMembership, Comment, ArchivedComment
+
+
+def _adjust(project_id, field, delta, at=None):
+    changes = {field: Greatest(F(field) + delta, 0)}
+    if at is not None:
+        changes['last_activity_at'] = Greatest(F('last_activity_at'), at)
+    # A single UPDATE, so concurrent writers can't lose each other's counts
+    Project.objects.filter(pk=project_id).update(**changes)
+
+
+def record_comments(project_id, delta, at=None):
+    """
+    Add delta (negative on delete) to the project's comment_count; `at`
+    also moves last_activity_at forward.
+    """
+    _adjust(project_id, 'comment_count', delta, at)
+
+
+def record_members(project_id, delta, at=None):
+    _adjust(project_id, 'member_count', delta, at)
+
+
+def record_inserted(memberships=(), comments=()):
+    """
+    Count rows just inserted with bulk_create (which sends no signals) in
+    their projects' counters: one UPDATE per project, adding the new rows
+    only, so repeated batches don't recount what is already there.
+    """
+    deltas = defaultdict(lambda: {'member_count': 0, 'comment_count': 0, 'at': None})
+    for membership in memberships:
+        deltas[membership.project_id]['member_count'] += 1
+    for comment in comments:
+        delta = deltas[comment.project_id]
+        delta['comment_count'] += 1
+        delta['at'] = comment.created_at if delta['at'] is None else max(delta['at'], comment.created_at)
+    for project_id, delta in deltas.items():
+        at = delta.pop('at')
+        changes = {field: F(field) + n for field, n in delta.items() if n}
+        if at is not None:
+            changes['last_activity_at'] = Greatest(F('last_activity_at'), at)
+        Project.objects.filter(pk=project_id).update(**changes)
+
+
+def activity_expressions():
+    """
+    The counters recomputed from the Comment (live and archived) and
+    ProjectMembership rows, as correlated subqueries for Project
+    querysets. Activity falls back to the project's creation when it has
+    no comments.
+    """
+    comments = Comment.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    archived = ArchivedComment.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    members = ProjectMembership.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    return {
+        'comment_count': (
+            Coalesce(Subquery(comments.annotate(n=Count('pk')).values('n')), 0)
+            + Coalesce(Subquery(archived.annotate(n=Count('pk')).values('n')), 0)
+        ),
+        'member_count': Coalesce(Subquery(members.annotate(n=Count('pk')).values('n')), 0),
+        # Archived comments are older than the live ones
+        'last_activity_at': Coalesce(
+            Subquery(comments.annotate(m=Max('created_at')).values('m')),
+            Subquery(archived.annotate(m=Max('created_at')).values('m')),
+            F('created_at'),
+        ),
+    }
+
+
+def rebuild_counters(queryset=None):
+    """
+    Recompute the counters of the given projects (all by default) in a
+    single UPDATE. Returns the number of projects updated.
+    """
+    if queryset is None:
+        queryset = Project.objects.all()
+    return queryset.update(**activity_expressions())
@@ -0,0 +1,132 @@
+"""
+Deleting projects without making the request wait for (or the database
+stay locked over) every row of a big project: the request only tombstones
+the project, which hides it from Project.objects at once, and jobs purge
+its rows in short batches.
+"""
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from apps.jobs.queue import enqueue
+from project_management.db import atomic
+
+from .fragments import bump_project_list, bump_feed_version
+from .models import (
+    ActivityEntry,
+    ArchivedComment,
+    Comment,
+    ImportedProject,
+    Project,
+    ProjectDeletion,
+    ProjectMembership,
+    ProjectPlacement,
+)
+from .search import get_search_backend
+
+
+def delete_batch(model, project_id, batch_size):
+    """
+    Delete up to batch_size of the project's rows of model with a single
+    DELETE by primary key: nothing is loaded and no signals are sent.
+    Deleted comments also leave the search index. Returns the number of
+    rows deleted.
+    """
+    using = router.db_for_write(model)
+    ids = list(model.objects.using(using).filter(project_id=project_id).values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    with transaction.atomic(using=using):
+        deleted = model.objects.using(using).filter(pk__in=ids)._raw_delete(using)
+        if model in (Comment, ArchivedComment):
+            get_search_backend().remove_comments(ids)
+    return deleted
+
+
+def delete_project_row(project_id):
+    """
+    The project row itself and its search entry, once its comments and
+    memberships are gone.
+    """
+    using = router.db_for_write(Project)
+    with transaction.atomic(using=using):
+        deleted = Project.all_objects.using(using).filter(pk=project_id)._raw_delete(using)
+        get_search_backend().remove_project(project_id)
+    return deleted
+
+
+def delete_project_rows(project_id, batch_size):
+    """
+    Delete a project with its comments (archived ones too) and memberships
+    from the selected database, batch_size rows per transaction. Returns
+    the number of rows deleted.
+    """
+    deleted = 0
+    for model in (Comment, ArchivedComment, ProjectMembership):
+        while batch := delete_batch(model, project_id, batch_size):
+            deleted += batch
+    return deleted + delete_project_row(project_id)
+
+
+def tombstone_project(project, deleted_by=None):
+    """
+    Delete a project: mark it deleted and queue the job that purges it.
+    Returns its ProjectDeletion, or None if it was already deleted.
+    """
+    with atomic():
+        if not Project.objects.filter(pk=project.pk).update(deleted_at=timezone.now()):
+            return None
+        # The counters on the instance may be stale
+        comments, members = Project.all_objects.filter(pk=project.pk).values_list(
+            'comment_count', 'member_count',
+        ).get()
+        deletion = ProjectDeletion.objects.create(
+            project_id=project.pk, name=project.name, deleted_by=deleted_by, comments=comments, members=members,
+        )
+        enqueue('projects.purge_project', project_id=project.pk)
+    bump_project_list([project.owner_id])
+    bump_feed_version(project.pk)
+    return deletion
+
+
+_PURGE_STEPS = (
+    (Comment, 'comments_deleted'),
+    (ArchivedComment, 'comments_deleted'),
+    (ProjectMembership, 'members_deleted'),
+    (ActivityEntry, 'activity_deleted'),
+)
+
+
+def purge_project(project_id, max_batches=None, batch_size=None, progress=None):
+    """
+    Delete a tombstoned project's comments, memberships and activity
+    entries, PROJECT_PURGE_BATCH_SIZE rows at a time, and then the project
+    itself, counting progress in its ProjectDeletion after every batch.
+    With max_batches, stop after that many batches; the deletion is then
+    still RUNNING. progress, if given, is called with the ProjectDeletion
+    after each batch. Call with the project's shard selected.
+    """
+    batch_size = batch_size or settings.PROJECT_PURGE_BATCH_SIZE
+    deletion = ProjectDeletion.objects.get(project_id=project_id)
+    batches = 0
+    for model, field in _PURGE_STEPS:
+        while True:
+            if max_batches is not None and batches >= max_batches:
+                return deletion
+            deleted = delete_batch(model, project_id, batch_size)
+            if not deleted:
+                break
+            batches += 1
+            setattr(deletion, field, getattr(deletion, field) + deleted)
+            deletion.save(update_fields=[field, 'updated_at'])
+            if progress:
+                progress(deletion)
+
+    with atomic():
+        ImportedProject.objects.filter(project_id=project_id).delete()
+        delete_project_row(project_id)
+        ProjectPlacement.objects.filter(pk=project_id).delete()
+        deletion.status = ProjectDeletion.DONE
+        deletion.save(update_fields=['status', 'updated_at'])
+    bump_feed_version(project_id)
+    return deletion
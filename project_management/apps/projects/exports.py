@@ -0,0 +1,138 @@
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import ProjectMembership, Comment, ArchivedComment
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+}
+
+COLUMNS = ('type', 'id', 'user_id', 'username', 'role', 'text', 'created_at')
+
+
+def _rows(model, project):
+    # Streams are read after ProjectShardMiddleware has returned: sharded,
+    # name the project's database
+    return model.objects.using(project._state.db) if settings.PROJECT_SHARDS else model.objects.all()
+
+
+def _memberships(project):
+    # Tuples over the same user join select_related would do: building a
+    # model instance per row is most of the cost of a large export
+    return (
+        _rows(ProjectMembership, project).filter(project=project)
+        .order_by('id').values_list('id', 'user_id', 'user__username', 'role')
+    )
+
+
+def _comments(model, project):
+    return (
+        _rows(model, project).filter(project=project)
+        .order_by('id').values_list('id', 'user_id', 'user__username', 'text', 'created_at')
+    )
+
+
+def _querysets(project):
+    # Archived comments first: they are the older ones
+    return (
+        (_memberships(project), _membership_row),
+        (_comments(ArchivedComment, project), _comment_row),
+        (_comments(Comment, project), _comment_row),
+    )
+
+
+def _membership_row(membership):
+    pk, user_id, username, role = membership
+    return {
+        'type': 'membership', 'id': pk, 'user_id': user_id,
+        'username': username, 'role': role, 'text': '', 'created_at': '',
+    }
+
+
+def _comment_row(comment):
+    pk, user_id, username, text, created_at = comment
+    return {
+        'type': 'comment', 'id': pk, 'user_id': user_id,
+        'username': username, 'role': '', 'text': text,
+        'created_at': created_at.isoformat(),
+    }
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line back
+    def write(self, value):
+        return value
+
+
+class _Encoder:
+    """
+    Formats rows as CSV or JSON lines and groups them into chunks of
+    EXPORT_CHUNK_SIZE rows, so the server isn't asked to flush every line.
+    """
+
+    def __init__(self, export_format):
+        self.format = export_format
+        self.writer = csv.writer(_Echo())
+        self.lines = []
+
+    def header(self):
+        return self.writer.writerow(COLUMNS) if self.format == 'csv' else ''
+
+    def add(self, row):
+        if self.format == 'csv':
+            self.lines.append(self.writer.writerow([row[column] for column in COLUMNS]))
+        else:
+            self.lines.append(json.dumps(row, ensure_ascii=False) + '\n')
+        if len(self.lines) >= settings.EXPORT_CHUNK_SIZE:
+            return self.flush()
+        return None
+
+    def flush(self):
+        chunk, self.lines = ''.join(self.lines), []
+        return chunk
+
+
+def export_stream(project, export_format):
+    """
+    A project's memberships, then its comments (archived ones first), as
+    CSV or JSON lines.
+    Rows are read with server-side chunked iterators, so memory use
+    doesn't grow with the size of the project and the first bytes go
+    out before the whole export is read.
+    """
+    encoder = _Encoder(export_format)
+    yield encoder.header()
+    for queryset, to_row in _querysets(project):
+        for obj in queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            if chunk := encoder.add(to_row(obj)):
+                yield chunk
+    yield encoder.flush()
+
+
+async def aexport_stream(project, export_format):
+    """
+    export_stream for the ASGI server, which would otherwise read a
+    synchronous iterator to the end before sending anything.
+    """
+    encoder = _Encoder(export_format)
+    yield encoder.header()
+    for queryset, to_row in _querysets(project):
+        async for obj in _aiterate(queryset):
+            if chunk := encoder.add(to_row(obj)):
+                yield chunk
+    yield encoder.flush()
+
+
+async def _aiterate(queryset):
+    # QuerySet.aiterator() runs values_list() queries on the event loop, so
+    # pull each chunk of the sync iterator in the (single) ORM thread
+    size = settings.EXPORT_CHUNK_SIZE
+    rows = queryset.iterator(chunk_size=size)
+    while chunk := await sync_to_async(list)(islice(rows, size)):
+        for row in chunk:
+            yield row
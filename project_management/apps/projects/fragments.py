@@ -0,0 +1,204 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from project_management.routers import primary_reads
+
+from .models import Project, ProjectMembership
+from .pagination import comment_page, acomment_page
+from .sharding import fan_out, visible_page
+
+
+def _feed_version_key(project_id):
+    return f"projects:feed_version:{project_id}"
+
+
+def _list_version_key(user_id):
+    return f"projects:list_version:{user_id}"
+
+
+def cached_fragment(key_parts, template_name, get_context):
+    """
+    Rendered HTML of template_name, cached under key_parts.
+    get_context is only called on a miss, so lazy querysets it returns
+    never hit the database when the fragment is cached.
+    Fragments must not contain per-session data such as CSRF tokens.
+    The rows are read from the primary: the keys come from versions its
+    writes bump, which a replica may not have caught up with.
+    """
+    key = _fragment_key(key_parts)
+    html = cache.get(key)
+    if html is None:
+        with primary_reads():
+            html = render_to_string(template_name, get_context())
+        cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+    return html
+
+
+async def acached_fragment(key_parts, template_name, aget_context):
+    """
+    Async cached_fragment(); aget_context is a coroutine function that
+    must return an already evaluated context, since templates can't run
+    queries from the event loop.
+    """
+    key = _fragment_key(key_parts)
+    html = await cache.aget(key)
+    if html is None:
+        with primary_reads():
+            context = await aget_context()
+        html = render_to_string(template_name, context)
+        await cache.aset(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+    return html
+
+
+def _fragment_key(key_parts):
+    return 'projects:fragment:' + ':'.join(str(part) for part in key_parts)
+
+
+def _version(key):
+    # Seeded from the clock: a version evicted from the cache comes back
+    # larger than any it had, never as one that old entries are keyed on
+    return cache.get_or_set(key, time.time_ns(), None)
+
+
+async def _aversion(key):
+    return await cache.aget_or_set(key, time.time_ns(), None)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def feed_version(project_id):
+    """
+    Version of what is shown of a project from its comments, members and
+    row: bumped by the Comment and ProjectMembership signals on every save
+    and delete, so cache hits don't need a query. Read by its comment feed
+    and by the project list of each of its members (projects_version()).
+    """
+    return _version(_feed_version_key(project_id))
+
+
+async def afeed_version(project_id):
+    return await _aversion(_feed_version_key(project_id))
+
+
+def bump_feed_version(project_id):
+    _bump(_feed_version_key(project_id))
+
+
+def project_list_version(user_id):
+    """
+    Version of which projects a user is a member of.
+    """
+    return _version(_list_version_key(user_id))
+
+
+async def aproject_list_version(user_id):
+    return await _aversion(_list_version_key(user_id))
+
+
+def bump_project_list(user_ids):
+    """
+    Invalidate the cached project list of each user, e.g. when they join
+    or leave a project. Changes to a project reach its members' lists
+    through its feed version instead, without a query for the members.
+    """
+    for user_id in set(user_ids):
+        _bump(_list_version_key(user_id))
+
+
+def _member_projects_key(user_id, list_version):
+    return f"projects:member_projects:{user_id}:{list_version}"
+
+
+def _member_project_ids(user_id):
+    # From the primary, like the fragments: cached under the list version
+    with primary_reads():
+        lists = fan_out(lambda: list(
+            ProjectMembership.objects.filter(user_id=user_id).values_list('project_id', flat=True)
+        ))
+    return sorted({project_id for project_ids in lists for project_id in project_ids})
+
+
+def projects_version(user_id, list_version):
+    """
+    The sum of the feed versions of the user's projects: versions only
+    grow, so it changes whenever one of them is bumped. The project ids
+    are cached per list version; a hit costs one cache read per project.
+    """
+    key = _member_projects_key(user_id, list_version)
+    project_ids = cache.get(key)
+    if project_ids is None:
+        project_ids = _member_project_ids(user_id)
+        cache.set(key, project_ids, settings.FRAGMENT_CACHE_TIMEOUT)
+    keys = [_feed_version_key(project_id) for project_id in project_ids]
+    versions = cache.get_many(keys)
+    return sum(versions.values()) + sum(_version(key) for key in keys if key not in versions)
+
+
+async def aprojects_version(user_id, list_version):
+    key = _member_projects_key(user_id, list_version)
+    project_ids = await cache.aget(key)
+    if project_ids is None:
+        project_ids = await sync_to_async(_member_project_ids)(user_id)
+        await cache.aset(key, project_ids, settings.FRAGMENT_CACHE_TIMEOUT)
+    keys = [_feed_version_key(project_id) for project_id in project_ids]
+    versions = await cache.aget_many(keys)
+    return sum(versions.values()) + sum([await _aversion(key) for key in keys if key not in versions])
+
+
+def comment_feed_html(project, role):
+    """
+    The newest window of a project's comment feed as <li> items.
+    Keyed on everything that changes its output: the project row, its
+    feed version and what the viewer is allowed to see.
+    """
+    def get_context():
+        comments, next_cursor = comment_page(project)
+        return {'project': project, 'comments': comments, 'next_cursor': next_cursor}
+
+    key_parts = ('comment_feed', project.pk, project.updated_at.timestamp(), feed_version(project.pk), role)
+    return cached_fragment(key_parts, 'projects/partials/_comment_items.html', get_context)
+
+
+async def acomment_feed_html(project, role):
+    async def aget_context():
+        comments, next_cursor = await acomment_page(project)
+        return {'project': project, 'comments': comments, 'next_cursor': next_cursor}
+
+    key_parts = ('comment_feed', project.pk, project.updated_at.timestamp(), await afeed_version(project.pk), role)
+    return await acached_fragment(key_parts, 'projects/partials/_comment_items.html', aget_context)
+
+
+def project_list_html(user, page=1):
+    """
+    One page of the projects visible to user.
+    """
+    def get_context():
+        projects, has_next = visible_page(user, page)
+        return {'projects': projects, 'page': page, 'has_next': has_next}
+
+    list_version = project_list_version(user.pk)
+    key_parts = ('project_list', user.pk, list_version, projects_version(user.pk, list_version), page)
+    return cached_fragment(key_parts, 'projects/partials/_project_list.html', get_context)
+
+
+async def aproject_list_html(user, page=1):
+    async def aget_context():
+        if settings.PROJECT_SHARDS:
+            # Asks every shard, in threads of its own
+            projects, has_next = await sync_to_async(visible_page)(user, page)
+        else:
+            projects, has_next = await Project.objects.visible_to(user).apage(page)
+        return {'projects': projects, 'page': page, 'has_next': has_next}
+
+    list_version = await aproject_list_version(user.pk)
+    key_parts = ('project_list', user.pk, list_version, await aprojects_version(user.pk, list_version), page)
+    return await acached_fragment(key_parts, 'projects/partials/_project_list.html', aget_context)
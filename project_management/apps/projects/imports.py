@@ -0,0 +1,354 @@
+import csv
+import hashlib
+import json
+import os
+from datetime import timezone as dt_timezone
+from collections import defaultdict
+from contextlib import ExitStack
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from project_management.routers import use_shard
+
+from .counters import record_inserted
+from .fragments import bump_project_list, bump_feed_version
+from .models import Project, ProjectMembership, Comment, ImportRun, ImportedProject, ProjectPlacement
+from .roles import invalidate_roles
+from .search import get_search_backend
+from .sharding import place_new_projects
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+# One row per line/record; `project` is the project's key in the old tool
+COLUMNS = ('type', 'project', 'name', 'description', 'username', 'role', 'text', 'created_at')
+
+MEMBER_ROLES = ('editor', 'reader')
+
+
+class ImportFormatError(ValueError):
+    """
+    The file as a whole can't be read (unknown format, missing columns).
+    Problems with single rows are reported and the rows skipped instead.
+    """
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path):
+    try:
+        return FORMATS[os.path.splitext(path)[1].lower()]
+    except KeyError:
+        raise ImportFormatError(f"Can't tell the format of {path}; use .csv or .jsonl.") from None
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_rows(f, import_format):
+    """
+    Yield each row of an open file as a dict, one at a time. Lines that
+    aren't JSON objects yield {'_invalid': reason} so they still count as
+    a row (resuming skips rows by count).
+    """
+    if import_format == 'csv':
+        reader = csv.DictReader(f)
+        if 'type' not in (reader.fieldnames or ()):
+            raise ImportFormatError(f"CSV header must include: {', '.join(COLUMNS)}.")
+        yield from reader
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield {'_invalid': f"invalid JSON ({e})"}
+            continue
+        yield row if isinstance(row, dict) else {'_invalid': "not a JSON object"}
+
+
+def _text(row, field):
+    value = row.get(field)
+    return '' if value is None else str(value).strip()
+
+
+def _required(row, field):
+    value = _text(row, field)
+    if not value:
+        raise RowError(f"{field} is required")
+    return value
+
+
+def _timestamp(row):
+    value = _text(row, 'created_at')
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise RowError(f"invalid created_at {value!r}")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+class Importer:
+    """
+    Loads projects, memberships and comments from CSV or JSON lines with
+    bulk_create, IMPORT_BATCH_SIZE rows per transaction. Each transaction
+    also advances the ImportRun checkpoint, so an interrupted import picks
+    up after the last committed batch when run on the same file again.
+
+    Usernames and project keys are resolved with one query per batch for
+    the names not seen before; results (including misses) are cached for
+    the rest of the import.
+
+    With sharding, new projects are placed like any other and each batch
+    writes to the shards of its projects, in a transaction on each that
+    commits before the checkpoint's: an import interrupted in between
+    repeats that batch's rows on the shards that had committed.
+    """
+
+    def __init__(self, batch_size=None, progress=None):
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        # Called with the ImportRun after each committed batch
+        self.progress = progress
+        self.user_ids = {}
+        self.project_ids = {}
+        # With sharding, the shard of each project in project_ids
+        self.project_shards = {}
+        # Rows handled by this importer, not counting earlier runs
+        self.rows_imported = 0
+
+    def run(self, path, source=None, import_format=None, max_batches=None):
+        """
+        Import the file, or continue an earlier run of it. With max_batches,
+        stop after that many batches; the run is then still RUNNING.
+        """
+        import_format = import_format or detect_format(path)
+        run, _ = ImportRun.objects.get_or_create(
+            checksum=file_checksum(path), defaults={'source': source or os.path.basename(path)},
+        )
+        if run.status == ImportRun.DONE:
+            return run
+
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = islice(read_rows(f, import_format), run.rows_done, None)
+            batches = 0
+            while batch := list(islice(rows, self.batch_size)):
+                self.import_batch(run, batch)
+                if self.progress:
+                    self.progress(run)
+                batches += 1
+                if batches == max_batches:
+                    return run
+
+        run.status = ImportRun.DONE
+        run.save(update_fields=['status', 'updated_at'])
+        return run
+
+    def import_batch(self, run, batch):
+        rows = list(enumerate(batch, run.rows_done + 1))
+        self._lookup_users({_text(row, 'username') for _, row in rows})
+        self._lookup_projects({_text(row, 'project') for _, row in rows})
+
+        errors = []
+        by_type = {'project': [], 'membership': [], 'comment': []}
+        for number, row in rows:
+            if '_invalid' in row:
+                errors.append((number, row['_invalid']))
+            elif _text(row, 'type') in by_type:
+                by_type[_text(row, 'type')].append((number, row))
+            else:
+                errors.append((number, f"unknown type {_text(row, 'type')!r}"))
+
+        projects, members, comments = [], [], []
+        with ExitStack() as transactions:
+            transactions.enter_context(transaction.atomic())
+            # Projects first: later rows of the batch may belong to them
+            new_projects = self._build_projects(by_type['project'], errors)
+            for shard, group in self._by_shard(new_projects, by_type['membership'], by_type['comment']).items():
+                with use_shard(shard):
+                    if shard is not None:
+                        transactions.enter_context(transaction.atomic(using=shard))
+                    shard_projects = self._create_projects(group['project'])
+                    shard_members = self._create_members(group['membership'], errors)
+                    shard_comments = self._create_comments(group['comment'], errors)
+
+                    record_inserted(shard_members, shard_comments)
+                    get_search_backend().index_projects(shard_projects)
+                    get_search_backend().index_comments(shard_comments)
+                projects += shard_projects
+                members += shard_members
+                comments += shard_comments
+
+            errors.sort()
+            kept = settings.IMPORT_ERRORS_KEPT - min(run.errors, settings.IMPORT_ERRORS_KEPT)
+            run.error_log += ''.join(f"row {number}: {message}\n" for number, message in errors[:kept])
+            run.rows_done += len(batch)
+            self.rows_imported += len(batch)
+            run.projects += len(projects)
+            run.members += len(members)
+            run.comments += len(comments)
+            run.errors += len(errors)
+            run.save()
+
+        # bulk_create sends no signals; invalidate what they would have
+        joined = {m.user_id for m in members} | {p.owner_id for p in projects}
+        for user_id in joined:
+            invalidate_roles(user_id)
+        bump_project_list(joined)
+        for project_id in {p.pk for p in projects} | {m.project_id for m in members} | {c.project_id for c in comments}:
+            bump_feed_version(project_id)
+
+    def _lookup_users(self, usernames):
+        missing = [name for name in usernames if name and name not in self.user_ids]
+        if missing:
+            found = dict(User.objects.filter(username__in=missing).values_list('username', 'pk'))
+            self.user_ids.update({name: found.get(name) for name in missing})
+
+    def _lookup_projects(self, keys):
+        missing = [key for key in keys if key and key not in self.project_ids]
+        if missing:
+            found = dict(ImportedProject.objects.filter(key__in=missing).values_list('key', 'project_id'))
+            if settings.PROJECT_SHARDS:
+                self.project_shards.update(
+                    ProjectPlacement.objects.filter(pk__in=found.values()).values_list('pk', 'shard')
+                )
+                # Without a placement the project was deleted
+                found = {key: pk for key, pk in found.items() if pk in self.project_shards}
+            self.project_ids.update({key: found.get(key) for key in missing})
+
+    def _user(self, row):
+        username = _required(row, 'username')
+        user_id = self.user_ids.get(username)
+        if user_id is None:
+            raise RowError(f"unknown user {username!r}")
+        return user_id
+
+    def _project(self, row):
+        key = _required(row, 'project')
+        project_id = self.project_ids.get(key)
+        if project_id is None:
+            raise RowError(f"unknown project {key!r}")
+        return project_id
+
+    def _build(self, rows, errors, build):
+        # (number, object, created_at) of each row build() accepts; the
+        # others are added to errors
+        built = []
+        for number, row in rows:
+            try:
+                created_at = _timestamp(row)
+                built.append((number, build(row), created_at))
+            except RowError as e:
+                errors.append((number, str(e)))
+        return built
+
+    def _build_projects(self, rows, errors):
+        """
+        [(key, project)] for the valid project rows; with sharding the
+        projects are placed and have their ids already.
+        """
+        keys = {}  # insertion ordered, like the projects
+
+        def build(row):
+            key = _required(row, 'project')
+            if key in keys or self.project_ids.get(key) is not None:
+                raise RowError(f"project {key!r} was already imported")
+            name = _required(row, 'name')
+            if len(name) > Project._meta.get_field('name').max_length:
+                raise RowError("name is too long")
+            project = Project(name=name, description=_text(row, 'description'), owner_id=self._user(row))
+            keys[key] = None
+            return project
+
+        projects = _stamped(self._build(rows, errors, build))
+        for project in projects:
+            # Every owner has an owner membership (see ProjectQuerySet.visible_to)
+            project.member_count = 1
+            # Until its comments (if any) move it forward
+            project.last_activity_at = project.created_at
+        if settings.PROJECT_SHARDS and projects:
+            for (key, project), (pk, shard) in zip(zip(keys, projects), place_new_projects(len(projects))):
+                project.pk = self.project_ids[key] = pk
+                self.project_shards[pk] = shard
+        return list(zip(keys, projects))
+
+    def _by_shard(self, projects, members, comments):
+        """
+        The batch's new projects and membership and comment rows grouped by
+        the shard of their project (all under None without sharding). Rows
+        of unknown projects go to the None group, to be reported.
+        """
+        groups = defaultdict(lambda: {'project': [], 'membership': [], 'comment': []})
+        for key, project in projects:
+            groups[self.project_shards.get(project.pk)]['project'].append((key, project))
+        for kind, rows in (('membership', members), ('comment', comments)):
+            for number, row in rows:
+                project_id = self.project_ids.get(_text(row, 'project'))
+                groups[self.project_shards.get(project_id)][kind].append((number, row))
+        return groups
+
+    def _create_projects(self, built):
+        keys = [key for key, _ in built]
+        projects = Project.objects.bulk_create([project for _, project in built])
+
+        ImportedProject.objects.bulk_create([ImportedProject(key=key, project=p) for key, p in zip(keys, projects)])
+        ProjectMembership.objects.bulk_create([
+            ProjectMembership(user_id=p.owner_id, project=p, role='owner') for p in projects
+        ])
+        self.project_ids.update({key: p.pk for key, p in zip(keys, projects)})
+        return projects
+
+    def _create_members(self, rows, errors):
+        candidates = [
+            (self.project_ids.get(_text(row, 'project')), self.user_ids.get(_text(row, 'username')))
+            for _, row in rows
+        ]
+        project_ids = {p for p, _ in candidates if p}
+        existing = set(ProjectMembership.objects.filter(
+            project_id__in=project_ids, user_id__in={u for _, u in candidates if u},
+        ).values_list('project_id', 'user_id')) if project_ids else set()
+
+        def build(row):
+            project_id, user_id = self._project(row), self._user(row)
+            role = _required(row, 'role')
+            if role not in MEMBER_ROLES:
+                raise RowError(f"role must be one of {', '.join(MEMBER_ROLES)}")
+            if (project_id, user_id) in existing:
+                raise RowError("already a member")
+            existing.add((project_id, user_id))
+            return ProjectMembership(project_id=project_id, user_id=user_id, role=role)
+
+        built = self._build(rows, errors, build)
+        return ProjectMembership.objects.bulk_create([membership for _, membership, _ in built])
+
+    def _create_comments(self, rows, errors):
+        def build(row):
+            return Comment(project_id=self._project(row), user_id=self._user(row), text=_required(row, 'text'))
+
+        built = self._build(rows, errors, build)
+        return Comment.objects.bulk_create(_stamped(built))
+
+
+def _stamped(built):
+    # The built objects, with the row's created_at where it had one
+    objs = []
+    for _, obj, created_at in built:
+        if created_at is not None:
+            obj.created_at = created_at
+        objs.append(obj)
+    return objs
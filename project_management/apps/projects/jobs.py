@@ -0,0 +1,94 @@
+import os
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.jobs.queue import enqueue, register
+
+from .activity import fan_out, trim_activity, usernames_text
+from .archive import archive_comments, schedule_archive
+from .deletion import purge_project
+from .imports import Importer
+from .models import ActivityEntry, Comment, ProjectDeletion
+from .sharding import fan_out as on_every_shard, project_shard
+
+
+@register('projects.comment_created')
+def comment_created(comment_id, project_id=None):
+    """
+    Add a new comment to the activity feeds of the project's other
+    members. Their project lists and live feeds were refreshed by the
+    web process when the comment was saved (apps.projects.signals).
+    """
+    with project_shard(project_id) as found:
+        comment = Comment.objects.filter(pk=comment_id).first() if found else None
+        if comment is None:
+            # Deleted before the job ran
+            return
+        fan_out(comment.project_id, ActivityEntry.COMMENT, comment.user_id, comment.text, comment.created_at)
+    schedule_archive()
+
+
+@register('projects.members_added')
+def members_added(project_id, user_ids):
+    """
+    The other members hear who joined.
+    """
+    with project_shard(project_id) as found:
+        if not found:
+            return
+        # A single new member is the actor and doesn't get the entry themselves
+        actor_id = user_ids[0] if len(user_ids) == 1 else None
+        fan_out(project_id, ActivityEntry.MEMBER, actor_id, usernames_text(user_ids))
+
+
+@register('projects.project_updated')
+def project_updated(project_id, actor_id=None):
+    with project_shard(project_id) as found:
+        if found:
+            fan_out(project_id, ActivityEntry.PROJECT, actor_id)
+
+
+@register('projects.purge_project')
+def purge(project_id):
+    """
+    Purge a deleted project a few batches at a time: each job is one
+    transaction, so it queues itself again until the project is gone.
+    """
+    with project_shard(project_id) as found:
+        if not found:
+            return
+        deletion = purge_project(project_id, max_batches=settings.PROJECT_PURGE_BATCHES_PER_JOB)
+    if deletion.status != ProjectDeletion.DONE:
+        enqueue('projects.purge_project', project_id=project_id)
+
+
+@register('projects.trim_activity')
+def trim():
+    trim_activity()
+
+
+@register('projects.archive_comments')
+def archive():
+    """
+    Move old comments to the archive a few batches per shard at a time,
+    queueing itself again while a shard had more.
+    """
+    limit = settings.COMMENT_ARCHIVE_BATCHES_PER_JOB
+    moved = on_every_shard(lambda: archive_comments(max_batches=limit))
+    if max(moved) >= limit * settings.COMMENT_ARCHIVE_BATCH_SIZE:
+        enqueue('projects.archive_comments')
+
+
+@register('projects.import_file')
+def import_file(path, source):
+    """
+    Import an uploaded file a few batches at a time: each job is one
+    transaction, so it queues itself again until the file is done.
+    """
+    run = Importer().run(path, source=source, max_batches=settings.IMPORT_BATCHES_PER_JOB)
+    if run.status == run.DONE:
+        transaction.on_commit(partial(os.remove, path))
+    else:
+        enqueue('projects.import_file', path=path, source=source)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.projects.archive import archive_comments
+from apps.projects.sharding import fan_out
+
+
+class Command(BaseCommand):
+    help = (
+        "Move comments older than COMMENT_ARCHIVE_AFTER_DAYS from the live "
+        "comment table to the archive now, instead of waiting for the "
+        "archive job. Feeds keep showing them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Archive comments older than this (default: COMMENT_ARCHIVE_AFTER_DAYS).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help="Comments moved per transaction (default: COMMENT_ARCHIVE_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        days = settings.COMMENT_ARCHIVE_AFTER_DAYS if options['days'] is None else options['days']
+        # On every shard, when sharded
+        archived = sum(fan_out(lambda: archive_comments(days, options['batch_size'])))
+        self.stdout.write(f"Archived {archived} comment(s) older than {days} day(s).")
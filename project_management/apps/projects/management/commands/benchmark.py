@@ -0,0 +1,161 @@
+import json
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.projects.management.dataset import (
+    PASSWORD, add_volume_arguments, latency_summary, seed, throwaway_database
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a database with users, projects, memberships and comments, then "
+        "measure latency percentiles, query counts and response sizes of the "
+        "main endpoints. Prints JSON; with --baseline, fails on regressions."
+    )
+
+    def add_arguments(self, parser):
+        add_volume_arguments(parser)
+        parser.add_argument('--iterations', type=int, default=30, help="Requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per endpoint.")
+        parser.add_argument('--cold', action='store_true', help="Clear the cache before every request.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument('--baseline', help="Earlier JSON report to compare against.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="Allowed p95 latency growth over the baseline (0.25 = 25%%)."
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1.")
+
+        with throwaway_database(options['in_place']):
+            report = self.run(options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline, report, options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions:\n  " + "\n  ".join(regressions))
+            self.stderr.write("No regressions against the baseline.")
+
+    def run(self, options):
+        cache.clear()
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        data = seed(rng, options)
+        seed_seconds = time.perf_counter() - started
+
+        with override_settings(ALLOWED_HOSTS=['testserver'], RATELIMIT_ENABLED=False):
+            results = {
+                name: self.measure(request, options)
+                for name, request in self.scenarios(data, options).items()
+            }
+
+        return {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'volumes': {k: options[k] for k in ('users', 'projects', 'members', 'comments')},
+                'iterations': options['iterations'],
+                'cold_cache': options['cold'],
+                'seed_seconds': round(seed_seconds, 2),
+            },
+            'results': results,
+        }
+
+    def scenarios(self, data, options):
+        owner, project = data['owner'], data['project']
+        scenarios = {
+            'project_index': ('get', reverse('home'), None, owner),
+            'login_htmx': ('post', reverse('login_htmx'), lambda i: {
+                'username': owner.username, 'password': PASSWORD
+            }, None),
+            'api_project_list': ('get', reverse('project-list'), None, owner),
+            'project_search': ('get', reverse('project_search'), lambda i: {'q': 'comment'}, owner),
+        }
+        if project is None:
+            return scenarios
+
+        candidates = iter(data['candidates'])
+        scenarios.update({
+            'project_detail_comments': ('get', reverse('project_detail_comments', args=[project.pk]), None, owner),
+            'project_comment_add': ('post', reverse('project_comment_add', args=[project.pk]), lambda i: {
+                'text': f"Benchmark comment {i}"
+            }, owner),
+            'project_add_member_form': ('get', reverse('project_add_member', args=[project.pk]), None, owner),
+            'project_add_member': ('post', reverse('project_add_member', args=[project.pk]), lambda i: {
+                'user_id': next(candidates).pk, 'role': 'reader'
+            }, owner),
+            'api_project_retrieve': ('get', reverse('project-detail', args=[project.pk]), None, owner),
+        })
+        if len(data['candidates']) < options['iterations'] + options['warmup']:
+            # Not enough non-members left to add one per request
+            del scenarios['project_add_member']
+        return scenarios
+
+    def measure(self, request, options):
+        method, url, make_data, user = request
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+
+        latencies, queries, sizes, statuses = [], [], [], set()
+        for i in range(options['warmup'] + options['iterations']):
+            if options['cold']:
+                cache.clear()
+            data = make_data(i) if make_data else None
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                elapsed = time.perf_counter() - start
+            if i < options['warmup']:
+                continue
+            latencies.append(elapsed)
+            queries.append(len(ctx))
+            sizes.append(len(response.content))
+            statuses.add(response.status_code)
+
+        return {
+            'url': url,
+            'method': method.upper(),
+            'status': sorted(statuses),
+            'latency_ms': latency_summary(latencies),
+            'queries': {'median': statistics.median(queries), 'max': max(queries)},
+            'response_bytes': {'mean': round(statistics.mean(sizes)), 'max': max(sizes)},
+        }
+
+    def compare(self, baseline, report, tolerance):
+        regressions = []
+        for name, result in report['results'].items():
+            before = baseline.get('results', {}).get(name)
+            if before is None:
+                continue
+            p95, old_p95 = result['latency_ms']['p95'], before['latency_ms']['p95']
+            if p95 > old_p95 * (1 + tolerance):
+                regressions.append(f"{name}: p95 {old_p95}ms -> {p95}ms")
+            if result['queries']['max'] > before['queries']['max']:
+                regressions.append(f"{name}: queries {before['queries']['max']} -> {result['queries']['max']}")
+        return regressions
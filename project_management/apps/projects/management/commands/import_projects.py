@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.projects.imports import FORMATS, Importer, ImportFormatError
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk load projects, memberships and comments from a CSV or JSON "
+        "lines file (one row per record, with a `type` of project, "
+        "membership or comment). Running it again on the same file resumes "
+        "after the last committed batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())), help="Default: from the extension.")
+        parser.add_argument('--batch-size', type=int, help="Rows per transaction (default: IMPORT_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(run):
+            rate = importer.rows_imported / (time.perf_counter() - started)
+            self.stdout.write(
+                f"{run.rows_done} rows: {run.projects} projects, {run.members} members, "
+                f"{run.comments} comments, {run.errors} errors ({rate:.0f} rows/s)"
+            )
+
+        importer = Importer(options['batch_size'], progress)
+        try:
+            run = importer.run(options['path'], import_format=options['format'])
+        except (OSError, ImportFormatError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"Import of {run.source} {run.status}: {run.rows_done} rows, {run.projects} projects, "
+            f"{run.members} members, {run.comments} comments, {run.errors} errors."
+        )
+        if run.error_log:
+            self.stderr.write(run.error_log.rstrip())
@@ -0,0 +1,223 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from apps.projects.management.dataset import add_volume_arguments, latency_summary, seed, throwaway_database
+
+STACKS = ('asgi', 'wsgi')
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the HTMX endpoints with many concurrent clients through the "
+        "real ASGI and WSGI handlers (in process, no network) and compare "
+        "throughput and tail latency. WSGI requests are served by a fixed "
+        "pool of worker threads, like a threaded WSGI server. Prints JSON."
+    )
+
+    def add_arguments(self, parser):
+        add_volume_arguments(parser, users=100, projects=20, members=10, comments=100)
+        parser.add_argument('--concurrency', type=int, default=50, help="Simultaneous clients.")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per stack.")
+        parser.add_argument('--wsgi-threads', type=int, default=8, help="Worker threads of the WSGI server.")
+        parser.add_argument('--stacks', nargs='+', choices=STACKS, default=list(STACKS))
+        parser.add_argument('--no-writes', action='store_true', help="Leave out the comment POSTs.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1.")
+
+        # Handler threads need their own connections to the same database,
+        # which an in-memory SQLite test database can't safely provide
+        test_name = None
+        if connection.vendor == 'sqlite' and not options['in_place']:
+            test_name = os.path.join(tempfile.mkdtemp(), 'loadtest.sqlite3')
+
+        with throwaway_database(options['in_place'], test_name):
+            report = self.run(options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        cache.clear()
+        data = seed(random.Random(options['seed']), options)
+        if data['project'] is None:
+            raise CommandError("--projects must be at least 1.")
+
+        client = Client()
+        client.force_login(data['owner'])
+        csrf_token = get_random_string(32)
+        cookie = f"sessionid={client.cookies['sessionid'].value}; csrftoken={csrf_token}"
+        requests = self.requests(data['project'], options)
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver'], RATELIMIT_ENABLED=False):
+            for stack in options['stacks']:
+                results[stack] = asyncio.run(self.drive(stack, requests, cookie, csrf_token, options))
+
+        return {
+            'meta': {
+                'database': connection.vendor,
+                'volumes': {k: options[k] for k in ('users', 'projects', 'members', 'comments')},
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'wsgi_threads': options['wsgi_threads'],
+            },
+            'results': results,
+        }
+
+    def requests(self, project, options):
+        """
+        The request mix, cycled through in order: (name, method, path, body).
+        """
+        mix = [
+            ('project_index', 'GET', reverse('home'), b''),
+            ('project_detail_comments', 'GET', reverse('project_detail_comments', args=[project.pk]), b''),
+            ('project_comments_partial', 'GET', reverse('project_comments_partial', args=[project.pk]), b''),
+        ]
+        if not options['no_writes']:
+            mix.append(('project_comment_add', 'POST', reverse('project_comment_add', args=[project.pk]),
+                        b'text=load+test+comment'))
+        return mix
+
+    async def drive(self, stack, requests, cookie, csrf_token, options):
+        headers = {'cookie': cookie, 'x-csrftoken': csrf_token, 'hx-request': 'true'}
+        if stack == 'asgi':
+            app = ASGIHandler()
+            pool = None
+
+            async def send(method, path, body):
+                return await call_asgi(app, method, path, body, headers)
+        else:
+            app = WSGIHandler()
+            pool = ThreadPoolExecutor(options['wsgi_threads'])
+            loop = asyncio.get_running_loop()
+
+            async def send(method, path, body):
+                return await loop.run_in_executor(pool, call_wsgi, app, method, path, body, headers)
+
+        latencies, by_endpoint, statuses = [], defaultdict(list), Counter()
+        counter = itertools.count()
+
+        async def client():
+            # Each client sends its next request as soon as the last one is answered
+            while (i := next(counter)) < options['requests']:
+                name, method, path, body = requests[i % len(requests)]
+                start = time.perf_counter()
+                status = await send(method, path, body)
+                elapsed = time.perf_counter() - start
+                latencies.append(elapsed)
+                by_endpoint[name].append(elapsed)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(client() for _ in range(options['concurrency'])))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'seconds': round(elapsed, 2),
+            'status': {str(status): n for status, n in sorted(statuses.items())},
+            'latency_ms': latency_summary(latencies),
+            'endpoints': {name: latency_summary(values) for name, values in by_endpoint.items()},
+        }
+
+
+def _form_headers(method, body):
+    if method == 'POST':
+        return {'content-type': 'application/x-www-form-urlencoded', 'content-length': str(len(body))}
+    return {}
+
+
+async def call_asgi(app, method, path, body, headers):
+    headers = {**headers, **_form_headers(method, body), 'host': 'testserver'}
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client never disconnects; the handler cancels this when done
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def call_wsgi(app, method, path, body, headers):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'testserver',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in {**headers, **_form_headers(method, body)}.items():
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f'HTTP_{key}'
+        environ[key] = value
+
+    status = []
+    result = app(environ, lambda s, h, exc_info=None: status.append(int(s.split()[0])))
+    try:
+        b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return status[0]
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from apps.projects.deletion import purge_project
+from apps.projects.models import ProjectDeletion
+from apps.projects.sharding import project_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Purge deleted projects now, in batches, instead of waiting for "
+        "their purge jobs (or after those failed), printing the progress."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help="Only these projects (default: all deleted).")
+        parser.add_argument(
+            '--batch-size', type=int, help="Rows deleted per statement (default: PROJECT_PURGE_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        deletions = ProjectDeletion.objects.filter(status=ProjectDeletion.RUNNING).order_by('pk')
+        if options['project_ids']:
+            deletions = deletions.filter(project_id__in=options['project_ids'])
+
+        def progress(deletion):
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f"  {deletion.comments_deleted}/{deletion.comments} comments, "
+                    f"{deletion.members_deleted}/{deletion.members} members, "
+                    f"{deletion.activity_deleted} activity entries"
+                )
+
+        purged = 0
+        for deletion in list(deletions):
+            with project_shard(deletion.project_id) as found:
+                if found:
+                    deletion = purge_project(deletion.project_id, batch_size=options['batch_size'], progress=progress)
+                else:
+                    # Sharded, and the purge had already removed its placement
+                    deletion.status = ProjectDeletion.DONE
+                    deletion.save(update_fields=['status', 'updated_at'])
+            purged += 1
+            self.stdout.write(
+                f"Purged {deletion.name} (#{deletion.project_id}): {deletion.comments_deleted} comments, "
+                f"{deletion.members_deleted} members, {deletion.activity_deleted} activity entries."
+            )
+        self.stdout.write(f"Purged {purged} project(s).")
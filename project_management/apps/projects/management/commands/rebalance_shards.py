@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.projects.rebalance import adopt_unplaced_projects, misplaced_projects, move_project, unplaced_projects
+from apps.projects.sharding import sync_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Put every project on the shard PROJECT_SHARDS assigns it to: copy "
+        "the users to every shard, place the projects created before "
+        "sharding was turned on, and move projects whose shard changed "
+        "(after adding or removing shards). Run it before serving requests "
+        "with a new PROJECT_SHARDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only count the projects that would move.")
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help="Rows copied or deleted per transaction (default: SHARD_MOVE_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.PROJECT_SHARDS:
+            raise CommandError("No shards configured (PROJECT_SHARDS, or SQLITE_SHARDS=N).")
+
+        if options['dry_run']:
+            unplaced = unplaced_projects().count()
+            moves = sum(1 for _ in misplaced_projects())
+            self.stdout.write(f"Would place {unplaced} project(s) and move {moves} placed project(s).")
+            return
+
+        self.stdout.write(f"Copied {sync_users()} user(s) to {len(settings.PROJECT_SHARDS)} shard(s).")
+        adopted = adopt_unplaced_projects()
+        if adopted:
+            self.stdout.write(f"Placed {adopted} project(s) from the default database.")
+
+        moved = rows = 0
+        # Listed first: moves change the placements being read
+        for project_id, source, target in list(misplaced_projects()):
+            rows += move_project(project_id, target, options['batch_size'])
+            moved += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Moved project {project_id} from {source} to {target}.")
+        self.stdout.write(f"Moved {moved} project(s) ({rows} rows).")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.projects.counters import rebuild_counters
+from apps.projects.models import Project
+from apps.projects.sharding import fan_out
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute each project's comment_count, member_count and "
+        "last_activity_at from the comment and membership rows, e.g. after "
+        "bulk loads that bypassed the signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help="Only these projects (default: all).")
+
+    def handle(self, *args, **options):
+        def rebuild():
+            queryset = Project.objects.all()
+            if options['project_ids']:
+                queryset = queryset.filter(pk__in=options['project_ids'])
+            return rebuild_counters(queryset)
+
+        # On every shard, when sharded
+        updated = sum(fan_out(rebuild))
+        self.stdout.write(f"Rebuilt counters of {updated} project(s).")
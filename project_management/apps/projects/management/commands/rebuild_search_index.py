@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.projects.search import get_search_backend
+from apps.projects.sharding import fan_out
+from project_management.db import atomic
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-index every project and comment in the configured search "
+        "backend (SEARCH_BACKEND), e.g. after bulk loads that bypassed the signals."
+    )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+
+        def rebuild():
+            with atomic():
+                backend.rebuild()
+
+        # Each shard indexes its own projects and comments
+        fan_out(rebuild)
+        self.stdout.write(f"Rebuilt the search index ({type(backend).__name__}).")
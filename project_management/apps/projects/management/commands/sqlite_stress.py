@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from apps.projects.management.commands.loadtest import call_wsgi
+from apps.projects.management.dataset import add_volume_arguments, latency_summary, seed, throwaway_database
+from apps.projects.models import Comment
+
+PROFILES = ('default', 'production')
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer a throwaway SQLite file with concurrent comment writers and "
+        "comment list readers through the WSGI handler, once with SQLite's "
+        "defaults and once with SQLITE_PRODUCTION_PROFILE (plus lock "
+        "retries), and compare throughput, latency and failed requests. "
+        "Prints JSON."
+    )
+
+    def add_arguments(self, parser):
+        add_volume_arguments(parser, users=20, projects=5, members=5, comments=50)
+        parser.add_argument('--writers', type=int, default=8, help="Threads posting comments.")
+        parser.add_argument('--readers', type=int, default=8, help="Threads reading the comment list.")
+        parser.add_argument('--requests', type=int, default=50, help="Requests per thread.")
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("sqlite_stress needs an SQLite default database.")
+        if options['writers'] < 1 or options['requests'] < 1:
+            raise CommandError("--writers and --requests must be at least 1.")
+
+        directory = tempfile.mkdtemp()
+        report = {
+            'meta': {
+                'writers': options['writers'],
+                'readers': options['readers'],
+                'requests_per_thread': options['requests'],
+            },
+            'results': {},
+        }
+        for profile in options['profiles']:
+            # A fresh file per profile: WAL mode sticks to the file
+            test_name = os.path.join(directory, f'stress_{profile}.sqlite3')
+            with database_profile(profile), throwaway_database(options['in_place'], test_name):
+                report['results'][profile] = self.run(profile, options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, profile, options):
+        cache.clear()
+        data = seed(random.Random(options['seed']), options)
+        if data['project'] is None:
+            raise CommandError("--projects must be at least 1.")
+        project = data['project']
+        before = Comment.objects.filter(project=project).count()
+
+        client = Client()
+        client.force_login(data['owner'])
+        csrf_token = get_random_string(32)
+        headers = {
+            'cookie': f"sessionid={client.cookies['sessionid'].value}; csrftoken={csrf_token}",
+            'x-csrftoken': csrf_token,
+            'hx-request': 'true',
+        }
+        write = ('POST', reverse('project_comment_add', args=[project.pk]), b'text=stress+test+comment')
+        read = ('GET', reverse('project_comments_partial', args=[project.pk]), b'')
+
+        app = WSGIHandler()
+        threads = [('write', write)] * options['writers'] + [('read', read)] * options['readers']
+        start = threading.Barrier(len(threads))
+        latencies = {'write': [], 'read': []}
+        statuses = {'write': Counter(), 'read': Counter()}
+
+        def worker(kind, request):
+            start.wait()
+            try:
+                for _ in range(options['requests']):
+                    began = time.perf_counter()
+                    status = call_wsgi(app, *request, headers)
+                    latencies[kind].append(time.perf_counter() - began)
+                    statuses[kind][status] += 1
+            finally:
+                # Only closes this thread's connections
+                connections.close_all()
+
+        overrides = {'ALLOWED_HOSTS': ['testserver'], 'RATELIMIT_ENABLED': False}
+        if profile == 'default':
+            overrides['SQLITE_LOCK_RETRIES'] = 0
+        with override_settings(**overrides), quiet_request_errors():
+            started = time.perf_counter()
+            pool = [threading.Thread(target=worker, args=thread) for thread in threads]
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        total = sum(len(values) for values in latencies.values())
+        return {
+            'journal_mode': connection.cursor().execute('PRAGMA journal_mode').fetchone()[0],
+            'throughput_rps': round(total / elapsed, 1),
+            'seconds': round(elapsed, 2),
+            'comments_written': Comment.objects.filter(project=project).count() - before,
+            'failed': sum(n for counts in statuses.values() for status, n in counts.items() if status >= 500),
+            **{
+                kind: {
+                    'status': {str(status): n for status, n in sorted(statuses[kind].items())},
+                    'latency_ms': latency_summary(latencies[kind]),
+                }
+                for kind in latencies if latencies[kind]
+            },
+        }
+
+
+@contextmanager
+def database_profile(profile):
+    """
+    Apply the profile to the default database's settings (every
+    connection opened meanwhile, in any thread, uses them).
+    """
+    settings_dict = connection.settings_dict
+    saved = {key: settings_dict.get(key) for key in settings.SQLITE_PRODUCTION_PROFILE}
+    connection.close()
+    if profile == 'production':
+        settings_dict.update(settings.SQLITE_PRODUCTION_PROFILE)
+    else:
+        settings_dict.update({'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}})
+    try:
+        yield
+    finally:
+        connection.close()
+        settings_dict.update(saved)
+
+
+@contextmanager
+def quiet_request_errors():
+    # Failed requests are counted in the report, not logged one by one
+    logger = logging.getLogger('django.request')
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
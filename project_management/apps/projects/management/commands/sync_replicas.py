@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database onto the SQLite replicas in "
+        "DATABASE_REPLICAS (SQLITE_REPLICAS=N), for trying out the replica "
+        "router locally. Other databases replicate by themselves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Keep copying, waiting this many seconds in between (simulated replication lag).",
+        )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        replicas = [alias for alias in settings.DATABASE_REPLICAS if connections[alias].vendor == 'sqlite']
+        if primary.vendor != 'sqlite' or not replicas:
+            raise CommandError("No SQLite replicas configured (set SQLITE_REPLICAS).")
+
+        try:
+            while True:
+                started = time.perf_counter()
+                primary.ensure_connection()
+                for alias in replicas:
+                    replica = connections[alias]
+                    replica.ensure_connection()
+                    # Online backup: a consistent snapshot, even while the
+                    # primary is being written
+                    primary.connection.backup(replica.connection)
+                if options['verbosity'] > 1 or options['interval'] is None:
+                    self.stdout.write(
+                        f"Copied to {', '.join(replicas)} in {time.perf_counter() - started:.2f}s."
+                    )
+                if options['interval'] is None:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,131 @@
+"""
+Synthetic data shared by the benchmark and loadtest commands.
+"""
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+
+from apps.projects.counters import rebuild_counters
+from apps.projects.models import Project, ProjectMembership, Comment
+from apps.projects.search import get_search_backend
+
+PASSWORD = 'benchmark-password'
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of an unsorted list.
+    """
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(latencies):
+    """
+    Percentiles of a list of latencies in seconds, in milliseconds.
+    """
+    summary = {'min': min(latencies)}
+    for pct in (50, 90, 95, 99):
+        summary[f'p{pct}'] = percentile(latencies, pct)
+    summary['max'] = max(latencies)
+    summary['mean'] = sum(latencies) / len(latencies)
+    return {name: round(value * 1000, 2) for name, value in summary.items()}
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def add_volume_arguments(parser, users=200, projects=50, members=20, comments=200):
+    parser.add_argument('--users', type=int, default=users)
+    parser.add_argument('--projects', type=int, default=projects)
+    parser.add_argument('--members', type=int, default=members, help="Members per project besides the owner.")
+    parser.add_argument('--comments', type=int, default=comments, help="Comments per project.")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for reproducible data.")
+    parser.add_argument(
+        '--in-place', action='store_true',
+        help="Seed the configured database instead of a throwaway test database."
+    )
+
+
+@contextmanager
+def throwaway_database(in_place=False, test_name=None):
+    """
+    Run the body against a freshly created test database, destroyed
+    afterwards; with in_place, against the configured database.
+    test_name overrides the test database name (e.g. a file path, when
+    several threads must share an SQLite database).
+    """
+    if in_place:
+        yield
+        return
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict['TEST'].get('NAME')
+    if test_name:
+        connection.settings_dict['TEST']['NAME'] = test_name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        connection.settings_dict['TEST']['NAME'] = old_test_name
+
+
+def seed(rng, options):
+    """
+    Users, projects, memberships and comments in bulk. Returns the owner
+    of every project, the first project and the users that aren't
+    members of it.
+    """
+    n_users = max(options['users'], 2)
+    password = make_password(PASSWORD)  # hash once, not per user
+    prefix = f"bench{time.time_ns()}_"
+    users = User.objects.bulk_create(
+        [User(username=f"{prefix}{i}", email=f"{prefix}{i}@example.com", password=password)
+         for i in range(n_users)],
+        batch_size=500,
+    )
+
+    # The first user owns every project so the index page shows them all
+    owner = users[0]
+    projects = Project.objects.bulk_create(
+        [Project(name=f"Project {i}", description=f"Benchmark project {i}", owner=owner)
+         for i in range(options['projects'])],
+        batch_size=500,
+    )
+
+    others = users[1:]
+    memberships, comments = [], []
+    members_of = {}
+    for project in projects:
+        memberships.append(ProjectMembership(user=owner, project=project, role='owner'))
+        members = rng.sample(others, min(options['members'], len(others)))
+        members_of[project.pk] = members
+        for user in members:
+            memberships.append(ProjectMembership(
+                user=user, project=project, role=rng.choice(['editor', 'reader'])
+            ))
+        authors = [owner] + members
+        for i in range(options['comments']):
+            comments.append(Comment(project=project, user=rng.choice(authors), text=f"Comment {i}"))
+
+    for batch in batched(memberships, 1000):
+        ProjectMembership.objects.bulk_create(batch)
+    for batch in batched(comments, 1000):
+        Comment.objects.bulk_create(batch)
+    # bulk_create skipped the signals that maintain the counters and index
+    rebuild_counters(Project.objects.filter(pk__in=[p.pk for p in projects]))
+    get_search_backend().rebuild()
+
+    # Users who aren't members of the first project, for add-member requests
+    busy = projects[0] if projects else None
+    joined = {u.pk for u in members_of.get(busy.pk, [])} if busy else set()
+    candidates = [u for u in others if u.pk not in joined]
+    return {'owner': owner, 'project': busy, 'candidates': candidates}
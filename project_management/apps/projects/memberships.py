@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from project_management.db import atomic
+
+from .models import ProjectMembership
+from .roles import invalidate_roles
+from .fragments import bump_feed_version, bump_project_list
+from .counters import record_members
+from apps.jobs.queue import enqueue
+
+ROLES = [role for role, _ in ProjectMembership.ROLE_CHOICES]
+# Role value that removes the user from the project
+REMOVE = 'none'
+
+
+class TooManyChanges(ValueError):
+    pass
+
+
+def _result(change, status, detail='', user_id=None):
+    return {
+        'user_id': user_id or change.get('user_id'),
+        'username': change.get('username'),
+        'role': change.get('role'),
+        'status': status,
+        'detail': detail,
+    }
+
+
+def apply_membership_changes(project, changes):
+    """
+    Add, update or remove many members of a project at once.
+
+    changes is a list of dicts with 'user_id' or 'username' and 'role'
+    (one of ROLE_CHOICES, or 'none' to remove). Users and existing
+    memberships are each resolved in one query and all writes happen in
+    one transaction. Returns one result per change, in order, with
+    status 'added', 'updated', 'removed', 'unchanged' or 'error'.
+    """
+    if len(changes) > settings.BULK_MEMBERSHIP_MAX:
+        raise TooManyChanges(f"At most {settings.BULK_MEMBERSHIP_MAX} changes per request.")
+
+    user_ids, usernames = set(), set()
+    for change in changes:
+        if change.get('user_id') is not None:
+            try:
+                change['user_id'] = int(change['user_id'])
+            except (TypeError, ValueError):
+                continue
+            user_ids.add(change['user_id'])
+        elif change.get('username'):
+            usernames.add(change['username'])
+
+    users = list(User.objects.filter(Q(pk__in=user_ids) | Q(username__in=usernames)).values_list('pk', 'username'))
+    known_ids = {pk for pk, _ in users}
+    ids_by_username = {username: pk for pk, username in users}
+
+    existing = {
+        m.user_id: m for m in
+        ProjectMembership.objects.filter(project=project, user_id__in=known_ids)
+    }
+
+    results = []
+    to_create, to_update, to_remove = [], [], []
+    seen = set()
+    for change in changes:
+        role = change.get('role')
+        if 'user_id' in change and change['user_id'] is not None:
+            user_id = change['user_id'] if change['user_id'] in known_ids else None
+        else:
+            user_id = ids_by_username.get(change.get('username'))
+
+        if role not in ROLES and role != REMOVE:
+            results.append(_result(change, 'error', f"Invalid role {role!r}.", user_id))
+        elif user_id is None:
+            results.append(_result(change, 'error', "Unknown user.", user_id))
+        elif user_id in seen:
+            results.append(_result(change, 'error', "User listed more than once.", user_id))
+        elif user_id == project.owner_id:
+            results.append(_result(change, 'error', "The project owner's role can't be changed.", user_id))
+        else:
+            membership = existing.get(user_id)
+            if role == REMOVE:
+                if membership:
+                    to_remove.append(membership.pk)
+                    results.append(_result(change, 'removed', user_id=user_id))
+                else:
+                    results.append(_result(change, 'unchanged', "Not a member.", user_id))
+            elif membership is None:
+                to_create.append(ProjectMembership(user_id=user_id, project=project, role=role))
+                results.append(_result(change, 'added', user_id=user_id))
+            elif membership.role != role:
+                membership.role = role
+                to_update.append(membership)
+                results.append(_result(change, 'updated', user_id=user_id))
+            else:
+                results.append(_result(change, 'unchanged', user_id=user_id))
+        if user_id is not None:
+            seen.add(user_id)
+
+    with atomic():
+        ProjectMembership.objects.bulk_create(to_create, batch_size=500)
+        if to_create:
+            record_members(project.pk, len(to_create), timezone.now())
+            enqueue('projects.members_added', project_id=project.pk, user_ids=[m.user_id for m in to_create])
+        ProjectMembership.objects.bulk_update(to_update, ['role'], batch_size=500)
+        if to_remove:
+            # Removal goes through delete() so the membership signals fire
+            ProjectMembership.objects.filter(pk__in=to_remove).delete()
+
+    # bulk_create/bulk_update don't send signals; invalidate by hand
+    changed = [m.user_id for m in to_create + to_update]
+    for user_id in changed:
+        invalidate_roles(user_id)
+    if changed:
+        # Also the member count shown in everyone's project list
+        bump_feed_version(project.pk)
+        bump_project_list(changed)
+
+    return results
+
+
+def _prefix_range(prefix):
+    # [start, end): every string starting with prefix, and nothing else
+    if not prefix:
+        return '', chr(0x10FFFF)
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def member_candidates(project, prefix, limit=None):
+    """
+    Up to `limit` users whose username or email starts with prefix (in
+    any case) and who aren't members of the project yet, in a single
+    query.
+    """
+    if limit is None:
+        limit = settings.USER_SEARCH_LIMIT
+    # Sharded, the project's shard has the memberships and copies of the users
+    users = User.objects.using(project._state.db) if settings.PROJECT_SHARDS else User.objects.all()
+    # Ranges of the lower(username) and lower(email) indexes (istartswith
+    # compiles to a LIKE, which scans the table)
+    start, end = _prefix_range(prefix.lower())
+    return (
+        users
+        .annotate(username_lower=Lower('username'), email_lower=Lower('email'))
+        .filter(
+            Q(username_lower__gte=start, username_lower__lt=end)
+            | Q(email_lower__gte=start, email_lower__lt=end)
+        )
+        .exclude(project_memberships__project=project)
+        .order_by('username')
+        .values('id', 'username', 'email')[:limit]
+    )
+
+
+def summarize(results):
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return summary
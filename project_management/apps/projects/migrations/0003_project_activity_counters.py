@@ -0,0 +1,52 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:57
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    Comment = apps.get_model('projects', 'Comment')
+    ProjectMembership = apps.get_model('projects', 'ProjectMembership')
+    db_alias = schema_editor.connection.alias
+    comments = Comment.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    members = ProjectMembership.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    Project.objects.using(db_alias).update(
+        comment_count=Coalesce(Subquery(comments.annotate(n=Count('pk')).values('n')), 0),
+        member_count=Coalesce(Subquery(members.annotate(n=Count('pk')).values('n')), 0),
+        last_activity_at=Coalesce(Subquery(comments.annotate(m=Max('created_at')).values('m')), F('created_at')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_comment_feed_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['-last_activity_at'], name='project_activity_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_owner_memberships(apps, schema_editor):
+    """
+    Projects are only listed through memberships, so every owner must have
+    an owner membership of their project.
+    """
+    Project = apps.get_model('projects', 'Project')
+    ProjectMembership = apps.get_model('projects', 'ProjectMembership')
+    db_alias = schema_editor.connection.alias
+
+    # An owner listed with a lesser role is promoted
+    ProjectMembership.objects.using(db_alias).filter(user_id=Subquery(
+        Project.objects.filter(pk=OuterRef('project_id')).values('owner_id')
+    )).exclude(role='owner').update(role='owner')
+
+    missing = Project.objects.using(db_alias).exclude(Exists(
+        ProjectMembership.objects.filter(project=OuterRef('pk'), user=OuterRef('owner'))
+    ))
+    rows = list(missing.values_list('pk', 'owner_id'))
+    ProjectMembership.objects.using(db_alias).bulk_create(
+        [ProjectMembership(project_id=pk, user_id=owner_id, role='owner') for pk, owner_id in rows],
+        batch_size=500,
+    )
+    members = ProjectMembership.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    Project.objects.using(db_alias).filter(pk__in=[pk for pk, _ in rows]).update(
+        member_count=Coalesce(Subquery(members.annotate(n=Count('pk')).values('n')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_project_activity_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='projectmembership',
+            index=models.Index(fields=['user', 'project', 'role'], name='membership_user_role_idx'),
+        ),
+        migrations.RunPython(backfill_owner_memberships, migrations.RunPython.noop),
+    ]
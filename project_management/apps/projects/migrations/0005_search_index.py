@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# scope holds a "p<project_id>" token so searches can be restricted to
+# the user's projects inside the MATCH itself
+SQLITE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS projects_project_fts USING fts5("
+    "name, description, scope, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS projects_comment_fts USING fts5("
+    "text, scope, project_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "INSERT INTO projects_project_fts (rowid, name, description, scope) "
+    "SELECT id, name, description, 'p' || id FROM projects_project",
+    "INSERT INTO projects_comment_fts (rowid, text, scope, project_id) "
+    "SELECT id, text, 'p' || project_id, project_id FROM projects_comment",
+]
+SQLITE_REVERSE = [
+    "DROP TABLE IF EXISTS projects_comment_fts",
+    "DROP TABLE IF EXISTS projects_project_fts",
+]
+
+POSTGRES = [
+    """
+    CREATE TABLE IF NOT EXISTS projects_search_document (
+        kind varchar(7) NOT NULL,
+        object_id bigint NOT NULL,
+        project_id bigint NOT NULL,
+        body text NOT NULL,
+        document tsvector NOT NULL,
+        PRIMARY KEY (kind, object_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS projects_search_document_gin ON projects_search_document USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS projects_search_document_project ON projects_search_document (project_id)",
+    """
+    INSERT INTO projects_search_document (kind, object_id, project_id, body, document)
+    SELECT 'project', id, id, name || E'\\n' || description,
+           setweight(to_tsvector('english', name), 'A') || setweight(to_tsvector('english', description), 'B')
+    FROM projects_project
+    """,
+    """
+    INSERT INTO projects_search_document (kind, object_id, project_id, body, document)
+    SELECT 'comment', id, project_id, text, setweight(to_tsvector('english', text), 'B')
+    FROM projects_comment
+    """,
+]
+POSTGRES_REVERSE = [
+    "DROP TABLE IF EXISTS projects_search_document",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for sql in statements.get(vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+    """
+    Storage of the full-text search backends (apps.projects.search):
+    FTS5 tables on SQLite, a GIN-indexed tsvector table on PostgreSQL.
+    """
+
+    dependencies = [
+        ('projects', '0004_membership_covering_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE, 'postgresql': POSTGRES}),
+            _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_import_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectPlacement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.CharField(blank=True, max_length=100)),
+                ('locked', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='activityentry',
+            name='project',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='projects.project'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_comment_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importedproject',
+            name='project',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='projects.project'),
+        ),
+    ]
@@ -1,15 +1,76 @@
 from django.db import models
 
 # Create your models here.
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+class ProjectQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Projects the user is a member of (any role), most recently active
+        first. Owners always have an owner membership, so this is a single
+        lookup on the (user, project, role) membership index; (user, project)
+        is unique, so the join needs no DISTINCT.
+        """
+        return self.filter(members__user=user).order_by('-last_activity_at', '-id')
+
+    def page(self, number=1, per_page=None):
+        """
+        (projects, has_next) for the 1-based page `number`, in one query.
+        """
+        if per_page is None:
+            per_page = settings.PROJECT_LIST_PAGE_SIZE
+        projects = list(self._page_slice(number, per_page))
+        return projects[:per_page], len(projects) > per_page
+
+    async def apage(self, number=1, per_page=None):
+        if per_page is None:
+            per_page = settings.PROJECT_LIST_PAGE_SIZE
+        projects = [project async for project in self._page_slice(number, per_page)]
+        return projects[:per_page], len(projects) > per_page
+
+    def _page_slice(self, number, per_page):
+        start = (max(number, 1) - 1) * per_page
+        # Fetch one extra row to know whether there is a next page
+        return self[start:start + per_page + 1]
+
+
+class ProjectManager(models.Manager.from_queryset(ProjectQuerySet)):
+    """
+    Leaves out tombstoned projects (deleted, waiting for the purge job, see
+    apps.projects.deletion), so no query through Project.objects sees them.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class Project(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_projects')
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so bulk imports keep the original times
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized activity, kept current by apps.projects.counters
+    # (rebuild with `manage.py rebuild_project_counters`)
+    comment_count = models.PositiveIntegerField(default=0)
+    member_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # Set when the project is deleted; its rows are purged in the background
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ProjectManager()
+    # Tombstoned projects included, for the purge and moves between shards
+    all_objects = ProjectQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # "Most active first" listings
+            models.Index(fields=['-last_activity_at'], name='project_activity_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -26,6 +87,11 @@ class ProjectMembership(models.Model):
 
     class Meta:
         unique_together = ('user', 'project')
+        indexes = [
+            # Covers "projects visible to user" and role lookups without
+            # touching the table
+            models.Index(fields=['user', 'project', 'role'], name='membership_user_role_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.project.name} ({self.role})"
@@ -34,7 +100,165 @@ class Comment(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     text = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so bulk imports keep the original times
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a project's feed (newest first)
+            models.Index(fields=['project', '-created_at', '-id'], name='comment_project_feed_idx'),
+            # Finding the comments old enough to archive (apps.projects.archive)
+            models.Index(fields=['created_at', 'id'], name='comment_created_at_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.project.name}"
+
+
+class ArchivedComment(models.Model):
+    """
+    A comment moved out of the live Comment table once it got older than
+    COMMENT_ARCHIVE_AFTER_DAYS (see apps.projects.archive). It keeps its
+    id, so feed cursors and the search index still point at it, and only
+    has the index its feed is paged by.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    # The feed index starts with the project
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='archived_comments', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    text = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', '-created_at', '-id'], name='archived_comment_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived comment {self.pk} on project {self.project_id}"
+
+
+class ActivityEntry(models.Model):
+    """
+    One event in a user's activity feed. Entries are written once per
+    recipient when the event happens (fan-out on write, see
+    apps.projects.activity), so reading a feed is a range scan of the
+    (user, created_at, id) index.
+    """
+    COMMENT = 'comment'
+    MEMBER = 'member'
+    PROJECT = 'project'
+    VERB_CHOICES = (
+        (COMMENT, 'New comment'),
+        (MEMBER, 'Member added'),
+        (PROJECT, 'Project updated'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity')
+    # No database constraint: with sharding the project lives in another
+    # database (entries of deleted projects are then skipped when read)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    verb = models.CharField(max_length=10, choices=VERB_CHOICES)
+    # Copied at write time: the comment excerpt or the added usernames
+    text = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # A user's feed, newest first (keyset pagination and trimming)
+            models.Index(fields=['user', '-created_at', '-id'], name='activity_user_feed_idx'),
+            # Age based trimming
+            models.Index(fields=['created_at'], name='activity_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.verb} on {self.project_id}"
+
+
+class ImportRun(models.Model):
+    """
+    Progress of one bulk import (apps.projects.imports), identified by the
+    checksum of its input so running the same file again resumes it.
+    rows_done moves forward in the same transaction as each batch's rows.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    )
+    checksum = models.CharField(max_length=64, unique=True)
+    source = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    rows_done = models.PositiveIntegerField(default=0)
+    projects = models.PositiveIntegerField(default=0)
+    members = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    # The first IMPORT_ERRORS_KEPT invalid rows, one per line
+    error_log = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.status}, {self.rows_done} rows)"
+
+
+class ImportedProject(models.Model):
+    """
+    The project created for each project key of the imported data, so
+    members and comments (in the same or a later file) can refer to it.
+    """
+    key = models.CharField(max_length=100, unique=True)
+    # No database constraint: with sharding the project lives in another
+    # database (purge_project deletes the row with the project)
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+
+    def __str__(self):
+        return f"{self.key} -> {self.project_id}"
+
+
+class ProjectPlacement(models.Model):
+    """
+    Which database holds a project and its memberships and comments, when
+    projects are sharded (PROJECT_SHARDS, see apps.projects.sharding).
+    Always kept in the default database; its id is the project's id, so
+    ids stay unique across shards.
+    """
+    shard = models.CharField(max_length=100, blank=True)
+    # Set while the project is being moved to another shard: it can be
+    # read (from the old shard) but not written
+    locked = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.pk} on {self.shard}"
+
+
+class ProjectDeletion(models.Model):
+    """
+    Progress of purging a deleted project (apps.projects.deletion): its
+    comments, memberships and activity are deleted in batches by jobs,
+    then the project row itself. Kept when done, as a record.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    )
+    # Not a foreign key: the project is gone at the end
+    project_id = models.BigIntegerField(unique=True)
+    name = models.CharField(max_length=100)
+    deleted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    # The project's counters when it was deleted, and the rows purged so far
+    comments = models.PositiveIntegerField(default=0)
+    members = models.PositiveIntegerField(default=0)
+    comments_deleted = models.PositiveIntegerField(default=0)
+    members_deleted = models.PositiveIntegerField(default=0)
+    activity_deleted = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.status}, {self.comments_deleted}/{self.comments} comments)"
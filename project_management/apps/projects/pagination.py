@@ -0,0 +1,101 @@
+import heapq
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db.models import Q
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj):
+    """
+    Cursor for the row *after* obj in a newest-first feed.
+    Format: "<created_at as microseconds since epoch>.<id>"
+    """
+    micros = (obj.created_at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}.{obj.pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        micros, pk = cursor.split('.', 1)
+        created_at = EPOCH + timedelta(microseconds=int(micros))
+        return created_at, int(pk)
+    except (AttributeError, ValueError, OverflowError, OSError):
+        raise InvalidCursor(cursor)
+
+
+def _keyset_query(queryset, cursor, limit):
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+    # Fetch one extra row to know whether there is an older page
+    return queryset[:limit + 1]
+
+
+def _keyset_result(items, limit):
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1])
+    return items, next_cursor
+
+
+def keyset_page(queryset, cursor=None, limit=None):
+    """
+    Return (items, next_cursor) for a queryset ordered newest first on
+    (created_at, id). Only rows strictly older than the cursor are returned,
+    so the query is a range scan on an index instead of an OFFSET.
+    """
+    if limit is None:
+        limit = settings.COMMENTS_PAGE_SIZE
+    return _keyset_result(list(_keyset_query(queryset, cursor, limit)), limit)
+
+
+async def akeyset_page(queryset, cursor=None, limit=None):
+    if limit is None:
+        limit = settings.COMMENTS_PAGE_SIZE
+    items = [item async for item in _keyset_query(queryset, cursor, limit)]
+    return _keyset_result(items, limit)
+
+
+def _feed_order(obj):
+    return obj.created_at, obj.pk
+
+
+def _with_archive(items, archived, limit):
+    # Both newest first; the page is the first rows of their merge
+    return list(heapq.merge(items, archived, key=_feed_order, reverse=True))[:limit + 1]
+
+
+def comment_page(project, cursor=None, limit=None):
+    """
+    One window of a project's comment feed, newest first. The archive
+    (apps.projects.archive) is only read once the live comments older
+    than the cursor don't fill the window.
+    """
+    if limit is None:
+        limit = settings.COMMENTS_PAGE_SIZE
+    items = list(_keyset_query(project.comments.select_related('user'), cursor, limit))
+    if len(items) <= limit:
+        archived = _keyset_query(project.archived_comments.select_related('user'), cursor, limit)
+        items = _with_archive(items, list(archived), limit)
+    return _keyset_result(items, limit)
+
+
+async def acomment_page(project, cursor=None, limit=None):
+    if limit is None:
+        limit = settings.COMMENTS_PAGE_SIZE
+    items = [item async for item in _keyset_query(project.comments.select_related('user'), cursor, limit)]
+    if len(items) <= limit:
+        archived = _keyset_query(project.archived_comments.select_related('user'), cursor, limit)
+        items = _with_archive(items, [item async for item in archived], limit)
+    return _keyset_result(items, limit)
@@ -1,5 +1,5 @@
 from rest_framework import permissions
-from .models import ProjectMembership
+from .roles import role_for, EDIT_ROLES
 
 
 class IsProjectOwnerOrReadOnly(permissions.BasePermission):
@@ -11,29 +11,22 @@ class IsProjectOwnerOrReadOnly(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # obj is a Project instance here
+        role = role_for(request.user, obj)
+
         if request.method in permissions.SAFE_METHODS:
             # GET, HEAD, OPTIONS are safe methods
             # We must ensure user has at least 'reader' role
-            return ProjectMembership.objects.filter(
-                user=request.user, project=obj
-            ).exists()
+            return role is not None
 
         # For non-safe methods (POST, PUT, PATCH, DELETE)
         # Only owners can update or delete the project
-        membership = ProjectMembership.objects.filter(
-            user=request.user, project=obj
-        ).first()
-
-        if not membership:
-            return False
-
-        if membership.role == 'owner':
+        if role == 'owner':
             return True
 
-        # If membership.role == 'editor', they can edit some fields but cannot delete the project.
+        # If role == 'editor', they can edit some fields but cannot delete the project.
         # You can refine logic here. For now, let's say only owners can delete,
         # but editors can update via PUT/PATCH.
-        if membership.role == 'editor' and request.method in ['PUT', 'PATCH']:
+        if role == 'editor' and request.method in ['PUT', 'PATCH']:
             return True
 
         return False
@@ -45,10 +38,5 @@ class CanCommentOnProject(permissions.BasePermission):
     """
     def has_object_permission(self, request, view, obj):
         # obj is a Project instance or maybe a Comment instance
-        membership = ProjectMembership.objects.filter(
-            user=request.user, project=obj.project if hasattr(obj, 'project') else obj
-        ).first()
-        if not membership:
-            return False
-
-        return membership.role in ['owner', 'editor']
+        project = obj.project if hasattr(obj, 'project') else obj
+        return role_for(request.user, project) in EDIT_ROLES
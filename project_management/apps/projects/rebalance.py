@@ -0,0 +1,122 @@
+"""
+Moving projects between shards (manage.py rebalance_shards).
+"""
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from project_management.routers import use_shard
+
+from .archive import archive_rows
+from .deletion import delete_project_rows
+from .fragments import bump_feed_version
+from .models import Project, ProjectMembership, Comment, ArchivedComment, ProjectPlacement
+from .search import get_search_backend
+from .sharding import shard_for
+
+
+def _copy_project(project_id, source, target, batch_size):
+    # Into the selected target: the project with its id, its memberships
+    # and comments with new ids (ids are per database), each batch in its
+    # own transaction. Archived comments get theirs from the live table
+    # on the way back into the archive
+    backend = get_search_backend()
+    project = Project.all_objects.using(source).get(pk=project_id)
+    Project.objects.bulk_create([project])
+    # bulk_create set updated_at to now (auto_now)
+    Project.all_objects.filter(pk=project_id).update(updated_at=project.updated_at)
+    backend.index_project(project)
+
+    copied = 1
+    for model in (ProjectMembership, Comment, ArchivedComment):
+        rows = model.objects.using(source).filter(project_id=project_id).order_by('pk').iterator(chunk_size=batch_size)
+        while batch := list(islice(rows, batch_size)):
+            with transaction.atomic(using=target):
+                if model is ProjectMembership:
+                    for obj in batch:
+                        obj.pk = None
+                    model.objects.bulk_create(batch)
+                else:
+                    comments = [
+                        Comment(project_id=c.project_id, user_id=c.user_id, text=c.text, created_at=c.created_at)
+                        for c in batch
+                    ]
+                    Comment.objects.bulk_create(comments)
+                    backend.index_comments(comments)
+                    if model is ArchivedComment:
+                        archive_rows(comments)
+            copied += len(batch)
+    return copied
+
+
+def move_project(project_id, target, batch_size=None):
+    """
+    Move a project with its memberships and comments to the shard target.
+    While it moves, its placement is locked: it is still read from the old
+    shard, but ProjectShardMiddleware turns writes away (writes already
+    under way get SHARD_MOVE_DRAIN_SECONDS to finish). Rows copied by an
+    interrupted move are cleared when it is run again. Returns the number
+    of rows copied.
+    """
+    batch_size = batch_size or settings.SHARD_MOVE_BATCH_SIZE
+    source = ProjectPlacement.objects.values_list('shard', flat=True).get(pk=project_id)
+    if source == target:
+        return 0
+
+    placement = ProjectPlacement.objects.filter(pk=project_id)
+    placement.update(locked=True)
+    try:
+        time.sleep(settings.SHARD_MOVE_DRAIN_SECONDS)
+        with use_shard(target):
+            delete_project_rows(project_id, batch_size)
+            copied = _copy_project(project_id, source, target, batch_size)
+        placement.update(shard=target, locked=False)
+    except BaseException:
+        placement.update(locked=False)
+        raise
+
+    with use_shard(source):
+        delete_project_rows(project_id, batch_size)
+    # Comment ids changed
+    bump_feed_version(project_id)
+    return copied
+
+
+def unplaced_projects():
+    """
+    Projects in the default database without a placement: created before
+    sharding was turned on.
+    """
+    return Project.all_objects.using(DEFAULT_DB_ALIAS).exclude(pk__in=ProjectPlacement.objects.values('pk'))
+
+
+def adopt_unplaced_projects():
+    """
+    Give every unplaced project a placement on the default database, from
+    where move_project() takes it to its shard. Returns the number adopted.
+    """
+    ids = list(unplaced_projects().values_list('pk', flat=True))
+    ProjectPlacement.objects.bulk_create(
+        [ProjectPlacement(pk=pk, shard=DEFAULT_DB_ALIAS) for pk in ids], batch_size=1000,
+    )
+    # New ids must come after the adopted ones
+    connection = connections[DEFAULT_DB_ALIAS]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [ProjectPlacement]):
+            cursor.execute(sql)
+    return len(ids)
+
+
+def misplaced_projects():
+    """
+    (project_id, shard, target) of every placed project not on the shard
+    PROJECT_SHARDS now assigns it to.
+    """
+    placements = ProjectPlacement.objects.order_by('pk').values_list('pk', 'shard').iterator()
+    for pk, shard in placements:
+        target = shard_for(pk)
+        if shard != target:
+            yield pk, shard, target
@@ -0,0 +1,138 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from project_management.routers import current_shard
+
+from .models import ProjectMembership
+
+EDIT_ROLES = ('owner', 'editor')
+
+
+def _version_key(user_id):
+    return f"projects:roles:version:{user_id}"
+
+
+def _new_version():
+    # From the clock: a version evicted from the cache comes back larger
+    # than any it had, never as one whose roles entry may still be cached
+    return time.time_ns()
+
+
+def _roles_key(user_id, version):
+    # With sharding, each shard holds the memberships of its own projects
+    shard = current_shard()
+    return f"projects:roles:{user_id}:{version}" + (f":{shard}" if shard else '')
+
+
+def invalidate_roles(user_id):
+    """
+    Bump the user's role-cache version so the next lookup misses.
+    Old entries are never read again and simply expire.
+    """
+    if not settings.ROLE_CACHE_TIMEOUT:
+        return
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), _new_version(), None)
+
+
+def load_roles(user_id):
+    """
+    {project_id: role} for every project the user is a member of.
+    One query, or none when the versioned cache is enabled and warm.
+    """
+    timeout = settings.ROLE_CACHE_TIMEOUT
+    if timeout:
+        version = cache.get_or_set(_version_key(user_id), _new_version, None)
+        roles = cache.get(_roles_key(user_id, version))
+        if roles is not None:
+            return roles
+
+    roles = dict(
+        ProjectMembership.objects.filter(user_id=user_id).values_list('project_id', 'role')
+    )
+    if timeout:
+        cache.set(_roles_key(user_id, version), roles, timeout)
+    return roles
+
+
+async def aload_roles(user_id):
+    """
+    Async load_roles() for the async views.
+    """
+    timeout = settings.ROLE_CACHE_TIMEOUT
+    if timeout:
+        version = await cache.aget_or_set(_version_key(user_id), _new_version, None)
+        roles = await cache.aget(_roles_key(user_id, version))
+        if roles is not None:
+            return roles
+
+    roles = {
+        project_id: role async for project_id, role in
+        ProjectMembership.objects.filter(user_id=user_id).values_list('project_id', 'role')
+    }
+    if timeout:
+        await cache.aset(_roles_key(user_id, version), roles, timeout)
+    return roles
+
+
+class RoleResolver:
+    """
+    Resolves a user's role on any project, loading their memberships once.
+    """
+
+    def __init__(self, user):
+        self.user_id = user.pk
+        # {shard: {project_id: role}}, None being the only key without sharding
+        self._roles = {}
+
+    @property
+    def roles(self):
+        shard = current_shard()
+        if shard not in self._roles:
+            self._roles[shard] = load_roles(self.user_id)
+        return self._roles[shard]
+
+    def role_for(self, project):
+        # The owner always has full rights, even without a membership row
+        if project.owner_id == self.user_id:
+            return 'owner'
+        return self.roles.get(project.pk)
+
+
+def get_resolver(user):
+    """
+    The resolver is stored on the user object, which lives exactly as long
+    as the request (DRF's request.user is the same object as Django's).
+    """
+    resolver = getattr(user, '_role_resolver', None)
+    if resolver is None:
+        resolver = RoleResolver(user)
+        user._role_resolver = resolver
+    return resolver
+
+
+def role_for(user, project):
+    """
+    'owner', 'editor', 'reader', or None if the user cannot see the project.
+    """
+    if not user.is_authenticated:
+        return None
+    return get_resolver(user).role_for(project)
+
+
+async def arole_for(user, project):
+    """
+    Async role_for(). Also primes the resolver, so later sync role_for()
+    calls on the same user don't query.
+    """
+    if not user.is_authenticated:
+        return None
+    resolver = get_resolver(user)
+    shard = current_shard()
+    if shard not in resolver._roles and project.owner_id != user.pk:
+        resolver._roles[shard] = await aload_roles(user.pk)
+    return resolver.role_for(project)
@@ -0,0 +1,361 @@
+import re
+from itertools import chain
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+from project_management.routers import current_shard
+
+from .sharding import fan_out, placed_rows
+
+# Highlight markers (char(2)/char(3) in SQL); the snippet is HTML-escaped
+# before they become <mark>
+START, STOP = '\x02', '\x03'
+
+# Projects a user is a member of, deleted ones (waiting for their purge) left out
+_VISIBLE = (
+    "SELECT m.project_id FROM projects_projectmembership m "
+    "JOIN projects_project p ON p.id = m.project_id WHERE m.user_id = %s AND p.deleted_at IS NULL"
+)
+
+
+def search_terms(query):
+    """
+    The words of a user's query. Everything else is dropped, so the
+    backends never see the search syntax characters of their engine.
+    """
+    return re.findall(r'\w+', query)[:10]
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet).replace(START, '<mark>').replace(STOP, '</mark>'))
+
+
+def _connection():
+    # The index of a project and its comments is kept in their database
+    return connections[current_shard() or DEFAULT_DB_ALIAS]
+
+
+class BaseSearchBackend:
+    """
+    Full-text index of project names/descriptions and comment texts.
+    The index_*/remove_* methods are called from the model signals, in the
+    same transaction as the write.
+    """
+
+    # Whether a higher score ranks better
+    higher_is_better = False
+
+    def index_project(self, project):
+        raise NotImplementedError
+
+    def index_comment(self, comment):
+        raise NotImplementedError
+
+    def index_projects(self, projects):
+        """
+        Index many new projects at once (bulk loads).
+        """
+        for project in projects:
+            self.index_project(project)
+
+    def index_comments(self, comments):
+        for comment in comments:
+            self.index_comment(comment)
+
+    def remove_project(self, project_id):
+        raise NotImplementedError
+
+    def remove_comment(self, comment_id):
+        raise NotImplementedError
+
+    def remove_comments(self, comment_ids):
+        for comment_id in comment_ids:
+            self.remove_comment(comment_id)
+
+    def rebuild(self):
+        """
+        Re-index every project and comment, archived ones too (of the
+        selected shard), e.g. after bulk loads.
+        """
+        raise NotImplementedError
+
+    def query(self, user_id, terms, limit, offset):
+        """
+        Rows of (kind, object_id, project_id, snippet, score), best first,
+        limited to the projects user_id is a member of.
+        """
+        raise NotImplementedError
+
+    def search(self, user, query, page=1, per_page=None):
+        """
+        (hits, has_next) for one page of results. Each hit is a dict with
+        kind ('project' or 'comment'), id, project_id and a highlighted
+        snippet.
+        """
+        if per_page is None:
+            per_page = settings.SEARCH_PAGE_SIZE
+        terms = search_terms(query)
+        if not terms:
+            return [], False
+        offset = (max(page, 1) - 1) * per_page
+        # Fetch one extra row to know whether there is a next page
+        if settings.PROJECT_SHARDS:
+            # Every shard ranks its own matches up to the end of the page.
+            # Scores depend on each shard's statistics, so the merge is an
+            # approximation of a single index's order
+            found = placed_rows(
+                fan_out(lambda: self.query(user.pk, terms, offset + per_page + 1, 0)), project_id=itemgetter(2),
+            )
+            rows = sorted(chain.from_iterable(found), key=itemgetter(4), reverse=self.higher_is_better)
+            rows = rows[offset:offset + per_page + 1]
+        else:
+            rows = self.query(user.pk, terms, per_page + 1, offset)
+        hits = [
+            {'kind': kind, 'id': object_id, 'project_id': project_id, 'snippet': highlight(snippet)}
+            for kind, object_id, project_id, snippet, _ in rows[:per_page]
+        ]
+        return hits, len(rows) > per_page
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 tables keyed by rowid = project/comment id, created by
+    migration 0005_search_index.
+
+    FTS5 can't use a B-tree index to filter on a column, so every row also
+    carries a "p<project_id>" token in its scope column and the visible
+    projects become part of the MATCH: the engine then only walks the
+    posting lists of those projects instead of ranking every match in the
+    table. Snippets are only built for the rows of the returned page.
+    """
+
+    def index_project(self, project):
+        self.index_projects([project])
+
+    def index_comment(self, comment):
+        self.index_comments([comment])
+
+    def index_projects(self, projects):
+        with _connection().cursor() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO projects_project_fts (rowid, name, description, scope) "
+                "VALUES (%s, %s, %s, %s)",
+                [(p.pk, p.name, p.description, f"p{p.pk}") for p in projects],
+            )
+
+    def index_comments(self, comments):
+        with _connection().cursor() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO projects_comment_fts (rowid, text, scope, project_id) "
+                "VALUES (%s, %s, %s, %s)",
+                [(c.pk, c.text, f"p{c.project_id}", c.project_id) for c in comments],
+            )
+
+    def remove_project(self, project_id):
+        with _connection().cursor() as cursor:
+            cursor.execute("DELETE FROM projects_project_fts WHERE rowid = %s", [project_id])
+
+    def remove_comment(self, comment_id):
+        self.remove_comments([comment_id])
+
+    def remove_comments(self, comment_ids):
+        if not comment_ids:
+            return
+        with _connection().cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM projects_comment_fts WHERE rowid IN ({', '.join(['%s'] * len(comment_ids))})",
+                list(comment_ids),
+            )
+
+    def rebuild(self):
+        with _connection().cursor() as cursor:
+            cursor.execute("DELETE FROM projects_project_fts")
+            cursor.execute(
+                "INSERT INTO projects_project_fts (rowid, name, description, scope) "
+                "SELECT id, name, description, 'p' || id FROM projects_project"
+            )
+            cursor.execute("DELETE FROM projects_comment_fts")
+            cursor.execute(
+                "INSERT INTO projects_comment_fts (rowid, text, scope, project_id) "
+                "SELECT id, text, 'p' || project_id, project_id FROM projects_comment "
+                "UNION ALL SELECT id, text, 'p' || project_id, project_id FROM projects_archivedcomment"
+            )
+
+    def query(self, user_id, terms, limit, offset):
+        with _connection().cursor() as cursor:
+            cursor.execute(_VISIBLE, [user_id])
+            visible = [project_id for project_id, in cursor.fetchall()]
+            if not visible:
+                return []
+
+            # Every term must match, as a prefix so results show while typing
+            words = ' '.join(f'"{term}"*' for term in terms)
+            scope = ' OR '.join(f"p{project_id}" for project_id in visible)
+            project_match = f"{{name description}}: ({words}) AND scope: ({scope})"
+            comment_match = f"text: ({words}) AND scope: ({scope})"
+
+            # Only the newest SEARCH_CANDIDATES matches of each table are
+            # ranked: FTS5 walks its posting lists in rowid order and stops,
+            # instead of scoring every row of a very common term
+            cursor.execute(
+                """
+                SELECT * FROM (
+                    SELECT 'project', rowid, rowid, bm25(projects_project_fts, 10.0, 1.0, 0.0) AS score
+                    FROM projects_project_fts WHERE projects_project_fts MATCH %s
+                    ORDER BY rowid DESC LIMIT %s
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 'comment', rowid, project_id, bm25(projects_comment_fts, 1.0, 0.0) AS score
+                    FROM projects_comment_fts WHERE projects_comment_fts MATCH %s
+                    ORDER BY rowid DESC LIMIT %s
+                )
+                ORDER BY score
+                LIMIT %s OFFSET %s
+                """,
+                [project_match, settings.SEARCH_CANDIDATES, comment_match, settings.SEARCH_CANDIDATES, limit, offset],
+            )
+            rows = cursor.fetchall()
+
+            snippets = {}
+            for kind, table, expression, match in (
+                # The project's name, then the best part of its description
+                ('project', 'projects_project_fts',
+                 "highlight(projects_project_fts, 0, char(2), char(3)) || CASE WHEN description != '' "
+                 "THEN ' — ' || snippet(projects_project_fts, 1, char(2), char(3), '…', 16) ELSE '' END",
+                 project_match),
+                ('comment', 'projects_comment_fts',
+                 "snippet(projects_comment_fts, 0, char(2), char(3), '…', 16)",
+                 comment_match),
+            ):
+                ids = [object_id for row_kind, object_id, _, _ in rows if row_kind == kind]
+                if not ids:
+                    continue
+                # FTS5 bounds its scan with a rowid range but not with IN; the
+                # candidates are the newest matches, so the range holds no
+                # more matches than were ranked
+                cursor.execute(
+                    f"SELECT rowid, {expression} FROM {table} "
+                    f"WHERE {table} MATCH %s AND rowid BETWEEN %s AND %s",
+                    [match, min(ids), max(ids)],
+                )
+                wanted = set(ids)
+                snippets.update({
+                    (kind, rowid): snippet for rowid, snippet in cursor.fetchall() if rowid in wanted
+                })
+
+        return [
+            (kind, object_id, project_id, snippets.get((kind, object_id), ''), score)
+            for kind, object_id, project_id, score in rows
+        ]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    One tsvector document per project/comment in projects_search_document
+    (GIN indexed), created by migration 0005_search_index. Project names
+    weigh more than descriptions and comments.
+    """
+
+    config = 'english'
+    higher_is_better = True
+
+    def _upsert(self, kind, object_id, project_id, body, document_sql, params):
+        with _connection().cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO projects_search_document (kind, object_id, project_id, body, document)
+                VALUES (%s, %s, %s, %s, {document_sql})
+                ON CONFLICT (kind, object_id)
+                DO UPDATE SET body = EXCLUDED.body, document = EXCLUDED.document
+                """,
+                [kind, object_id, project_id, body] + params,
+            )
+
+    def index_project(self, project):
+        self._upsert(
+            'project', project.pk, project.pk, f"{project.name}\n{project.description}",
+            "setweight(to_tsvector(%s::regconfig, %s), 'A') || setweight(to_tsvector(%s::regconfig, %s), 'B')",
+            [self.config, project.name, self.config, project.description],
+        )
+
+    def index_comment(self, comment):
+        self._upsert(
+            'comment', comment.pk, comment.project_id, comment.text,
+            "setweight(to_tsvector(%s::regconfig, %s), 'B')", [self.config, comment.text],
+        )
+
+    def _remove(self, kind, object_id):
+        with _connection().cursor() as cursor:
+            cursor.execute("DELETE FROM projects_search_document WHERE kind = %s AND object_id = %s", [kind, object_id])
+
+    def remove_project(self, project_id):
+        self._remove('project', project_id)
+
+    def remove_comment(self, comment_id):
+        self._remove('comment', comment_id)
+
+    def rebuild(self):
+        with _connection().cursor() as cursor:
+            cursor.execute("TRUNCATE projects_search_document")
+            cursor.execute(
+                """
+                INSERT INTO projects_search_document (kind, object_id, project_id, body, document)
+                SELECT 'project', id, id, name || E'\\n' || description,
+                       setweight(to_tsvector(%s::regconfig, name), 'A')
+                       || setweight(to_tsvector(%s::regconfig, description), 'B')
+                FROM projects_project
+                """,
+                [self.config, self.config],
+            )
+            cursor.execute(
+                """
+                INSERT INTO projects_search_document (kind, object_id, project_id, body, document)
+                SELECT 'comment', id, project_id, text, setweight(to_tsvector(%s::regconfig, text), 'B')
+                FROM projects_comment
+                UNION ALL
+                SELECT 'comment', id, project_id, text, setweight(to_tsvector(%s::regconfig, text), 'B')
+                FROM projects_archivedcomment
+                """,
+                [self.config, self.config],
+            )
+
+    def query(self, user_id, terms, limit, offset):
+        tsquery = ' & '.join(f"{term}:*" for term in terms)
+        sql = f"""
+            SELECT kind, object_id, project_id,
+                   ts_headline(%s::regconfig, body, q, %s),
+                   ts_rank(document, q) AS score
+            FROM projects_search_document, to_tsquery(%s::regconfig, %s) q
+            WHERE document @@ q AND project_id IN ({_VISIBLE})
+            ORDER BY score DESC
+            LIMIT %s OFFSET %s
+        """
+        options = f"StartSel={START}, StopSel={STOP}, MaxFragments=1, MaxWords=32"
+        with _connection().cursor() as cursor:
+            cursor.execute(sql, [self.config, options, self.config, tsquery, user_id, limit, offset])
+            return cursor.fetchall()
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'SEARCH_BACKEND':
+        _backend = None
@@ -25,9 +25,29 @@ class CommentSerializer(serializers.ModelSerializer):
 class ProjectSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
     members = ProjectMembershipSerializer(many=True, read_only=True)
-    comments = CommentSerializer(many=True, read_only=True)
+    comments = serializers.SerializerMethodField()
 
     class Meta:
         model = Project
         fields = ['id', 'name', 'description', 'owner', 'members', 'comments', 'created_at', 'updated_at']
         read_only_fields = ['id', 'owner', 'members', 'comments', 'created_at', 'updated_at']
+
+    def get_comments(self, project):
+        # Newest first, the archived (older) comments after the live ones
+        comments = [*project.comments.all(), *project.archived_comments.all()]
+        return CommentSerializer(comments, many=True, context=self.context).data
+
+class ProjectListSerializer(serializers.ModelSerializer):
+    """
+    Lightweight shape for list views: the project's member/comment counters
+    instead of the nested rows, and only the few most recent comments.
+    Expects the prefetch set up by ProjectViewSet.get_queryset.
+    """
+    owner = UserSerializer(read_only=True)
+    recent_comments = CommentSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Project
+        fields = ['id', 'name', 'description', 'owner', 'member_count', 'comment_count',
+                  'last_activity_at', 'recent_comments', 'created_at', 'updated_at']
+        read_only_fields = fields
@@ -0,0 +1,266 @@
+"""
+Projects spread over several databases (PROJECT_SHARDS). Each project
+lives with its memberships and comments on one shard, recorded in its
+ProjectPlacement row in the default database; users are copied to every
+shard so rows there can join them. Without shards everything here falls
+back to the single database.
+
+Requests about one project select its shard in ProjectShardMiddleware;
+project_shard() does the same in jobs. Lists that span projects (a
+user's project list, search, the API list) ask every shard in parallel
+with fan_out() and merge the answers. Moving projects between shards:
+apps.projects.rebalance.
+"""
+import heapq
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.http import Http404, HttpResponse
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from project_management.routers import use_shard
+
+from .models import Project, ProjectPlacement
+
+_UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping and Veach): the bucket in [0, buckets)
+    for an integer key. Going from n to n + 1 buckets moves about
+    1/(n + 1) of the keys, all of them into the new bucket.
+    """
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (2 ** 31 / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(project_id):
+    """
+    The shard a project belongs on with the current PROJECT_SHARDS.
+    """
+    return settings.PROJECT_SHARDS[jump_hash(project_id, len(settings.PROJECT_SHARDS))]
+
+
+@contextmanager
+def place_new_project():
+    """
+    For creating a project: yields the id to create it with, with the
+    shard it goes to selected. Without sharding, yields None (the database
+    assigns the id as usual).
+
+    Ids come from the placement table, so they are unique across shards.
+    A placement whose project never got created only wastes its id.
+    """
+    if not settings.PROJECT_SHARDS:
+        yield None
+        return
+    placement = ProjectPlacement.objects.create()
+    placement.shard = shard_for(placement.pk)
+    placement.save(update_fields=['shard'])
+    with use_shard(placement.shard):
+        yield placement.pk
+
+
+def place_new_projects(count):
+    """
+    For creating projects in bulk: [(id, shard)] for `count` new projects,
+    like place_new_project() for each (without selecting the shards).
+    """
+    placements = ProjectPlacement.objects.bulk_create([ProjectPlacement() for _ in range(count)])
+    for placement in placements:
+        placement.shard = shard_for(placement.pk)
+    ProjectPlacement.objects.bulk_update(placements, ['shard'])
+    return [(placement.pk, placement.shard) for placement in placements]
+
+
+@contextmanager
+def project_shard(project_id):
+    """
+    Select the shard of an existing project for the block, e.g. in a job.
+    Yields False if the project has no placement (it was deleted).
+    """
+    if not settings.PROJECT_SHARDS:
+        yield True
+        return
+    shard = ProjectPlacement.objects.filter(pk=project_id).values_list('shard', flat=True).first()
+    if shard is None:
+        yield False
+        return
+    with use_shard(shard):
+        yield True
+
+
+def fan_out(func, shards=None):
+    """
+    [func() on each shard], every call with its shard selected, run in
+    up to SHARD_FANOUT_THREADS threads at once. func must not share
+    querysets between calls (use .all() for a fresh one). Without
+    sharding, [func()].
+    """
+    if shards is None:
+        shards = settings.PROJECT_SHARDS
+    if not shards:
+        return [func()]
+
+    def run(alias):
+        try:
+            with use_shard(alias):
+                return func()
+        finally:
+            # The pool's threads go away with it: don't leave their
+            # connections open
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=min(len(shards), settings.SHARD_FANOUT_THREADS)) as pool:
+        return list(pool.map(run, shards))
+
+
+def placed_rows(lists, project_id=lambda row: row.pk):
+    """
+    fan_out()'s per-shard lists (in PROJECT_SHARDS order) without the rows
+    a shard holds for a project placed on another one: while a project
+    moves, it is on both shards until the move deletes it from the source.
+    Only projects found on more than one shard cost a (placement) query.
+    """
+    found = Counter(pk for rows in lists for pk in {project_id(row) for row in rows})
+    moving = [pk for pk, shards in found.items() if shards > 1]
+    if not moving:
+        return lists
+    placed = dict(ProjectPlacement.objects.filter(pk__in=moving).values_list('pk', 'shard'))
+    return [
+        [row for row in rows if placed.get(project_id(row), shard) == shard]
+        for shard, rows in zip(settings.PROJECT_SHARDS, lists)
+    ]
+
+
+def _activity_order(project):
+    return project.last_activity_at, project.pk
+
+
+def merge_by_activity(lists):
+    """
+    Merge lists of projects that are each most recently active first
+    (ProjectQuerySet.visible_to order) into one in the same order.
+    """
+    return list(heapq.merge(*lists, key=_activity_order, reverse=True))
+
+
+def visible_page(user, number=1, per_page=None):
+    """
+    Project.objects.visible_to(user).page() across the shards: each one
+    returns its rows up to the end of the page and the first rows of the
+    merge are the page. Deep pages cost every shard the rows before them.
+    """
+    if per_page is None:
+        per_page = settings.PROJECT_LIST_PAGE_SIZE
+    if not settings.PROJECT_SHARDS:
+        return Project.objects.visible_to(user).page(number, per_page)
+
+    start = (max(number, 1) - 1) * per_page
+    end = start + per_page + 1
+    lists = placed_rows(fan_out(lambda: list(Project.objects.visible_to(user)[:end])))
+    projects = merge_by_activity(lists)[start:end]
+    return projects[:per_page], len(projects) > per_page
+
+
+def projects_in_bulk(ids):
+    """
+    {id: project} like Project.objects.in_bulk(ids), for projects on any
+    shard: one query per shard holding some of them.
+    """
+    if not settings.PROJECT_SHARDS:
+        return Project.objects.in_bulk(ids)
+    by_shard = defaultdict(list)
+    for pk, shard in ProjectPlacement.objects.filter(pk__in=ids).values_list('pk', 'shard'):
+        by_shard[shard].append(pk)
+    projects = {}
+    for shard, pks in by_shard.items():
+        projects.update(Project.objects.using(shard).in_bulk(pks))
+    return projects
+
+
+_USER_FIELDS = [field.name for field in User._meta.concrete_fields if not field.primary_key]
+
+
+def mirror_users(users, shards=None):
+    """
+    Insert or update copies of the users on every shard.
+    """
+    copies = [User(pk=user.pk, **{name: getattr(user, name) for name in _USER_FIELDS}) for user in users]
+    for alias in shards or settings.PROJECT_SHARDS:
+        User.objects.using(alias).bulk_create(
+            copies, update_conflicts=True, unique_fields=['id'], update_fields=_USER_FIELDS,
+        )
+
+
+def sync_users(batch_size=1000):
+    """
+    Copy every user to every shard, e.g. to a new shard or after changes
+    that bypassed the signals. Users deleted meanwhile aren't removed.
+    Returns the number of users copied.
+    """
+    users = User.objects.order_by('pk').iterator(chunk_size=batch_size)
+    copied = 0
+    while batch := list(islice(users, batch_size)):
+        mirror_users(batch)
+        copied += len(batch)
+    return copied
+
+
+class ProjectShardMiddleware:
+    """
+    Selects the shard of the project that a view of apps.projects.views
+    is about (its `pk` argument) for the rest of the request: a 404 if
+    there is no such project, a 503 for writes while it is being moved.
+    Views not about one project ask every shard themselves (fan_out).
+    Streaming response bodies are read after it returns: they must use
+    the database of the objects they stream.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.PROJECT_SHARDS:
+            return self.get_response(request)
+        with use_shard() as request._shard_selection:
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not settings.PROJECT_SHARDS:
+            return await self.get_response(request)
+        with use_shard() as request._shard_selection:
+            return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        selection = getattr(request, '_shard_selection', None)
+        if selection is None or 'pk' not in view_kwargs or view_func.__module__ != 'apps.projects.views':
+            return None
+        try:
+            placement = ProjectPlacement.objects.filter(pk=int(view_kwargs['pk'])).first()
+        except ValueError:
+            raise Http404
+        if placement is None:
+            raise Http404
+        if placement.locked and request.method in _UNSAFE_METHODS:
+            response = HttpResponse("This project is being moved. Try again in a moment.", status=503)
+            response['Retry-After'] = '2'
+            return response
+        selection.alias = placement.shard
+        return None
@@ -0,0 +1,107 @@
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from project_management.routers import use_shard
+
+from .models import Project, ProjectMembership, Comment, ProjectPlacement
+from .roles import invalidate_roles
+from .fragments import bump_feed_version, bump_project_list
+from .counters import record_comments, record_members
+from .search import get_search_backend
+from .sharding import mirror_users
+from .streams import publish_comment
+from apps.jobs.queue import enqueue
+
+
+@receiver([post_save, post_delete], sender=ProjectMembership)
+def membership_changed(sender, instance, using, **kwargs):
+    invalidate_roles(instance.user_id)
+    bump_project_list([instance.user_id])
+    # The project's members and member count, in its pages and in every
+    # member's project list. The fragment cache is the web process's own,
+    # so this can't wait for a job; a rolled back change keeps the caches
+    transaction.on_commit(partial(bump_feed_version, instance.project_id), using=using)
+
+
+@receiver(post_save, sender=ProjectMembership)
+def membership_saved(sender, instance, created, **kwargs):
+    if created:
+        record_members(instance.project_id, 1, timezone.now())
+        enqueue('projects.members_added', project_id=instance.project_id, user_ids=[instance.user_id])
+
+
+@receiver(post_delete, sender=ProjectMembership)
+def membership_deleted(sender, instance, **kwargs):
+    record_members(instance.project_id, -1)
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, **kwargs):
+    if created:
+        bump_project_list([instance.owner_id])
+    else:
+        # Members see the change through the project's version
+        bump_feed_version(instance.pk)
+    get_search_backend().index_project(instance)
+    if not created:
+        # Views set _actor_id: the editor doesn't get an entry for their own edit
+        enqueue('projects.project_updated', project_id=instance.pk, actor_id=getattr(instance, '_actor_id', None))
+
+
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    # Members are bumped by their own (cascaded) membership deletes
+    bump_project_list([instance.owner_id])
+    bump_feed_version(instance.pk)
+    get_search_backend().remove_project(instance.pk)
+    if settings.PROJECT_SHARDS:
+        ProjectPlacement.objects.filter(pk=instance.pk).delete()
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, using, **kwargs):
+    # The feed and the members' project lists; edits change them too
+    bump_feed_version(instance.project_id)
+    if created:
+        record_comments(instance.project_id, 1, instance.created_at)
+        # Live feeds are served by this process (its broker), so they are
+        # pushed to here, once the comment is committed: listeners must
+        # never see one rolled back. Activity entries are written by a job
+        transaction.on_commit(partial(publish_comment, instance), using=using)
+        enqueue('projects.comment_created', comment_id=instance.pk, project_id=instance.project_id)
+    get_search_backend().index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    bump_feed_version(instance.project_id)
+    record_comments(instance.project_id, -1)
+    get_search_backend().remove_comment(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, using, update_fields=None, **kwargs):
+    # Shards keep copies of the users their rows refer to; logins don't
+    # change anything shown from them
+    if not settings.PROJECT_SHARDS or using != DEFAULT_DB_ALIAS:
+        return
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    mirror_users([instance])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, using, **kwargs):
+    if not settings.PROJECT_SHARDS or using != DEFAULT_DB_ALIAS:
+        return
+    for alias in settings.PROJECT_SHARDS:
+        # Takes the user's projects, memberships and comments on the shard
+        # with it, through the signals above
+        with use_shard(alias):
+            User.objects.using(alias).filter(pk=instance.pk).delete()
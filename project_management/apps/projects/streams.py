@@ -0,0 +1,51 @@
+import asyncio
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from .broker import get_broker
+
+
+def comment_channel(project_id):
+    return f"project:{project_id}:comments"
+
+
+def publish_comment(comment):
+    """
+    Push the rendered comment to everyone watching the project's feed.
+    Call after the transaction commits so listeners never see a comment
+    that was rolled back.
+    """
+    html = render_to_string('projects/partials/_comment_item.html', {'comment': comment})
+    get_broker().publish(comment_channel(comment.project_id), {
+        'author_id': comment.user_id,
+        'html': html,
+    })
+
+
+def sse_event(event, data):
+    lines = ''.join(f"data: {line}\n" for line in data.splitlines())
+    return f"event: {event}\n{lines}\n"
+
+
+async def comment_events(project_id, user_id):
+    """
+    Server-Sent Events for one connection. Idle connections only cost a
+    parked coroutine and an empty queue, plus a keepalive comment now and
+    then so proxies don't drop them.
+    """
+    subscription = get_broker().subscribe(comment_channel(project_id))
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), settings.SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            # The author already got the comment in their POST response
+            if message['author_id'] == user_id:
+                continue
+            yield sse_event('comment', message['html'])
+    finally:
+        subscription.close()
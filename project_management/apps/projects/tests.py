@@ -1,8 +1,59 @@
-from django.test import TestCase, Client
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from .models import Project, ProjectMembership
+from .models import (
+    ActivityEntry,
+    ArchivedComment,
+    Comment,
+    ImportRun,
+    Project,
+    ProjectDeletion,
+    ProjectMembership,
+    ProjectPlacement,
+)
+from .roles import role_for
+from .broker import BaseBroker, InMemoryBroker, get_broker
+from .streams import comment_channel
+from .memberships import apply_membership_changes, member_candidates
+from .search import get_search_backend
+from .counters import rebuild_counters
+from .activity import activity_page, fan_out, trim_activity
+from .archive import archive_comments
+from .deletion import purge_project, tombstone_project
+from .imports import Importer
+from .sharding import jump_hash, shard_for
+from apps.jobs.queue import run_pending
+from project_management.db import atomic_retry
+from project_management.middleware import PIN_COOKIE, ReplicaPinningMiddleware
+from project_management.routers import (
+    NoShardSelected,
+    ReplicaRouter,
+    ShardRouter,
+    begin_request,
+    end_request,
+    primary_reads,
+    use_shard,
+)
 
 
 class ProjectTest(TestCase):
@@ -44,6 +95,26 @@ class ProjectTest(TestCase):
         # The code sets role='owner'
         self.assertEqual(membership.role, 'owner')
 
+    def test_create_project_returns_only_new_row(self):
+        for i in range(5):
+            Project.objects.create(name=f'Old {i}', owner=self.owner)
+
+        def create(name):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('project_create'), data={'name': name})
+            return response, len(queries)
+
+        response, few = create('First')
+        self.assertEqual(response.content.decode().count('class="project-row"'), 1)
+        self.assertContains(response, 'First')
+        self.assertContains(response, '1 member')
+        self.assertNotContains(response, 'Old 0')
+
+        for i in range(20):
+            Project.objects.create(name=f'Older {i}', owner=self.owner)
+        _, many = create('Second')
+        self.assertEqual(few, many)
+
     def test_add_member(self):
         """Owner can add a user as editor, etc."""
         # First create a project
@@ -129,3 +200,1456 @@ class ProjectTest(TestCase):
         self.assertEqual(response.status_code, 200)
         # The project should still exist because editor can't actually remove it
         self.assertTrue(Project.objects.filter(name='SecondOne').exists())
+
+
+@override_settings(COMMENTS_PAGE_SIZE=3)
+class CommentFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Busy', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        self.comments = [
+            Comment.objects.create(project=self.project, user=self.owner, text=f'comment {i}')
+            for i in range(7)
+        ]
+        self.client.login(username='owner', password='ownerpass')
+
+    def test_first_window_is_newest_comments(self):
+        response = self.client.get(reverse('project_detail_comments', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [c.pk for c in response.context['comments']],
+            [c.pk for c in reversed(self.comments[-3:])]
+        )
+        self.assertIsNotNone(response.context['next_cursor'])
+
+    def test_load_older_walks_whole_feed(self):
+        url = reverse('project_comments_partial', args=[self.project.pk])
+        response = self.client.get(url)
+        seen = [c.pk for c in response.context['comments']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(url, {'before': cursor})
+            self.assertTemplateUsed(response, 'projects/partials/_comment_items.html')
+            seen += [c.pk for c in response.context['comments']]
+            cursor = response.context['next_cursor']
+        self.assertEqual(seen, [c.pk for c in reversed(self.comments)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse('project_comments_partial', args=[self.project.pk]), {'before': 'nope'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_comment_add_returns_only_new_comment(self):
+        response = self.client.post(
+            reverse('project_comment_add', args=[self.project.pk]),
+            data={'text': 'fresh'},
+            HTTP_HX_REQUEST='true'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'projects/partials/_comment_item.html')
+        self.assertContains(response, 'fresh')
+        self.assertNotContains(response, 'comment 0')
+
+
+class RoleResolverTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.projects = [Project.objects.create(name=f'P{i}', owner=self.owner) for i in range(3)]
+        for project in self.projects:
+            ProjectMembership.objects.create(user=self.owner, project=project, role='owner')
+        ProjectMembership.objects.create(user=self.reader, project=self.projects[0], role='reader')
+
+    def test_memberships_loaded_once(self):
+        user = User.objects.get(pk=self.reader.pk)
+        with self.assertNumQueries(1):
+            roles = [role_for(user, project) for project in self.projects * 2]
+        self.assertEqual(roles[:3], ['reader', None, None])
+
+    def test_reader_cannot_comment(self):
+        self.client.login(username='reader', password='readerpass')
+        response = self.client.post(
+            reverse('project_comment_add', args=[self.projects[0].pk]), data={'text': 'hi'}
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            reverse('project_comment_add', args=[self.projects[1].pk]), data={'text': 'hi'}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Comment.objects.exists())
+
+    @override_settings(ROLE_CACHE_TIMEOUT=60)
+    def test_cached_roles_invalidated_on_membership_change(self):
+        # Each request gets a fresh user object; only the first one queries
+        with self.assertNumQueries(1):
+            self.assertIsNone(role_for(User(pk=self.reader.pk), self.projects[1]))
+        with self.assertNumQueries(0):
+            self.assertIsNone(role_for(User(pk=self.reader.pk), self.projects[1]))
+
+        ProjectMembership.objects.create(user=self.reader, project=self.projects[1], role='editor')
+        self.assertEqual(role_for(User(pk=self.reader.pk), self.projects[1]), 'editor')
+
+    @override_settings(ROLE_CACHE_TIMEOUT=60)
+    def test_evicted_version_does_not_revive_old_roles(self):
+        self.assertIsNone(role_for(User(pk=self.reader.pk), self.projects[1]))
+        ProjectMembership.objects.create(user=self.reader, project=self.projects[1], role='editor')
+        # The version is evicted; the roles cached under the first one aren't
+        cache.delete(f'projects:roles:version:{self.reader.pk}')
+        self.assertEqual(role_for(User(pk=self.reader.pk), self.projects[1]), 'editor')
+
+
+@override_settings(PROJECT_RECENT_COMMENTS=2)
+class ProjectApiTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.others = [User.objects.create_user(username=f'u{i}', password='x') for i in range(3)]
+        self.client.login(username='owner', password='ownerpass')
+
+    def _make_project(self, i):
+        project = Project.objects.create(name=f'API {i}', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=project, role='owner')
+        for user in self.others:
+            ProjectMembership.objects.create(user=user, project=project, role='reader')
+            Comment.objects.create(project=project, user=user, text=f'{user.username} on {i}')
+        return project
+
+    def _list(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('project-list'))
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx)
+
+    def test_list_query_count_is_constant(self):
+        self._make_project(0)
+        data, baseline = self._list()
+        self.assertEqual(len(data), 1)
+
+        for i in range(1, 6):
+            self._make_project(i)
+        data, queries = self._list()
+        self.assertEqual(len(data), 6)
+        self.assertEqual(queries, baseline)
+
+    def test_list_is_lightweight(self):
+        self._make_project(0)
+        data, _ = self._list()
+        project = data[0]
+        self.assertEqual(project['member_count'], 4)
+        self.assertEqual(project['comment_count'], 3)
+        self.assertEqual(len(project['recent_comments']), 2)
+        self.assertNotIn('members', project)
+
+    def test_list_only_shows_member_projects(self):
+        self._make_project(0)
+        Project.objects.create(name='Not mine', owner=self.others[0])
+        data, _ = self._list()
+        self.assertEqual([p['name'] for p in data], ['API 0'])
+
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Cached', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        Comment.objects.create(project=self.project, user=self.owner, text='first')
+        self.client.login(username='owner', password='ownerpass')
+        self.url = reverse('project_detail_comments', args=[self.project.pk])
+
+    def _get(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        # Queries loading comment rows (not the cheap validator aggregate)
+        comment_queries = [q for q in ctx.captured_queries if '"projects_comment"."text"' in q['sql']]
+        return response, comment_queries
+
+    def test_repeat_view_skips_comment_queries(self):
+        response, queries = self._get()
+        self.assertContains(response, 'first')
+        self.assertTrue(queries)
+
+        response, queries = self._get()
+        self.assertContains(response, 'first')
+        self.assertEqual(queries, [])
+
+    def test_new_comment_invalidates_feed(self):
+        self._get()
+        Comment.objects.create(project=self.project, user=self.owner, text='second')
+        response, _ = self._get()
+        self.assertContains(response, 'second')
+
+    def test_edit_and_older_delete_invalidate_feed(self):
+        older = Comment.objects.create(project=self.project, user=self.owner, text='removed later')
+        Comment.objects.create(project=self.project, user=self.owner, text='newest')
+        self._get()
+        first = Comment.objects.get(text='first')
+        first.text = 'edited'
+        first.save()
+        older.delete()
+        response, _ = self._get()
+        self.assertContains(response, 'edited')
+        self.assertNotContains(response, 'removed later')
+
+    def test_members_project_lists_follow_the_project(self):
+        reader = User.objects.create_user(username='reader', password='readerpass')
+        ProjectMembership.objects.create(user=reader, project=self.project, role='reader')
+        reader_client = Client()
+        reader_client.force_login(reader)
+        self.assertContains(reader_client.get(reverse('project_list_partial')), '1 comment ')
+
+        Comment.objects.create(project=self.project, user=self.owner, text='second')
+        self.assertContains(reader_client.get(reverse('project_list_partial')), '2 comments')
+        self.project.name = 'Renamed'
+        self.project.save()
+        self.assertContains(reader_client.get(reverse('project_list_partial')), 'Renamed')
+
+    def test_project_list_invalidated_on_create(self):
+        self.client.get(reverse('project_list_partial'))
+        self.client.post(reverse('project_create'), data={'name': 'Brand new'})
+        response = self.client.get(reverse('project_list_partial'))
+        self.assertContains(response, 'Brand new')
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Polled', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        Comment.objects.create(project=self.project, user=self.owner, text='hello')
+        self.client.login(username='owner', password='ownerpass')
+
+    def _revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header('ETag'))
+        return self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_unchanged_comments_not_modified(self):
+        for name in ['project_detail_comments', 'project_comments_partial']:
+            response = self._revalidate(reverse(name, args=[self.project.pk]))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+    def test_new_comment_changes_etag(self):
+        url = reverse('project_detail_comments', args=[self.project.pk])
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(project=self.project, user=self.owner, text='again')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'again')
+
+    def test_comment_edit_and_role_change_change_etag(self):
+        url = reverse('project_detail_comments', args=[self.project.pk])
+        etag = self.client.get(url)['ETag']
+        comment = Comment.objects.get()
+        comment.text = 'edited'
+        comment.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'edited')
+
+        other = User.objects.create_user(username='other', password='x')
+        membership = ProjectMembership.objects.create(user=other, project=self.project, role='reader')
+        url = reverse('project-detail', args=[self.project.pk])
+        etag = self.client.get(url)['ETag']
+        membership.role = 'editor'
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_rolled_back_membership_change_keeps_etag(self):
+        url = reverse('project-detail', args=[self.project.pk])
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                ProjectMembership.objects.filter(project=self.project).delete()
+                raise ValueError
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_api_list_and_retrieve_not_modified(self):
+        self.assertEqual(self._revalidate(reverse('project-list')).status_code, 304)
+        self.assertEqual(self._revalidate(reverse('project-detail', args=[self.project.pk])).status_code, 304)
+
+    def test_api_list_changes_with_membership(self):
+        url = reverse('project-list')
+        etag = self.client.get(url)['ETag']
+        other = User.objects.create_user(username='other', password='x')
+        ProjectMembership.objects.create(user=other, project=self.project, role='reader')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_non_member_gets_404_not_304(self):
+        User.objects.create_user(username='stranger', password='strangerpass')
+        self.client.login(username='stranger', password='strangerpass')
+        response = self.client.get(reverse('project_detail_comments', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ProjectCountersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.project = Project.objects.create(name='Counted', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+
+    def test_counters_follow_creates_and_deletes(self):
+        membership = ProjectMembership.objects.create(user=self.reader, project=self.project, role='reader')
+        comments = [Comment.objects.create(project=self.project, user=self.owner, text=str(i)) for i in range(3)]
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.comment_count, self.project.member_count), (3, 2))
+        self.assertEqual(self.project.last_activity_at, comments[-1].created_at)
+
+        comments[0].delete()
+        membership.delete()
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.comment_count, self.project.member_count), (2, 1))
+
+    def test_bulk_membership_changes_update_member_count(self):
+        users = User.objects.bulk_create([User(username=f'bulk{i}') for i in range(3)])
+        apply_membership_changes(self.project, [{'user_id': u.pk, 'role': 'reader'} for u in users])
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.member_count, 4)
+
+    def test_project_list_shows_counters_without_aggregates(self):
+        Comment.objects.create(project=self.project, user=self.owner, text='hi')
+        self.client.login(username='owner', password='ownerpass')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('project_list_partial'))
+        self.assertContains(response, '1 comment ·')
+        self.assertContains(response, '1 member ·')
+        project_queries = [q['sql'] for q in ctx.captured_queries if 'projects_project' in q['sql']]
+        self.assertTrue(project_queries)
+        self.assertFalse(any('COUNT(' in sql or 'projects_comment' in sql for sql in project_queries))
+
+    def test_rebuild_command_fixes_drift(self):
+        Comment.objects.create(project=self.project, user=self.owner, text='hi')
+        Project.objects.filter(pk=self.project.pk).update(comment_count=42, member_count=0)
+        call_command('rebuild_project_counters', stdout=StringIO())
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.comment_count, self.project.member_count), (1, 1))
+
+
+class VisibleProjectsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.projects = []
+        for i in range(3):
+            project = Project.objects.create(name=f'Visible {i}', owner=self.owner)
+            ProjectMembership.objects.create(user=self.owner, project=project, role='owner')
+            self.projects.append(project)
+        ProjectMembership.objects.create(user=self.reader, project=self.projects[1], role='reader')
+        Project.objects.create(name='Hidden', owner=self.reader)
+
+    def test_visible_to_lists_memberships_most_active_first(self):
+        Comment.objects.create(project=self.projects[0], user=self.owner, text='bump')
+        visible = Project.objects.visible_to(self.owner)
+        # The new reader made project 1 active after project 2
+        self.assertEqual(list(visible), [self.projects[0], self.projects[1], self.projects[2]])
+        self.assertEqual(list(Project.objects.visible_to(self.reader)), [self.projects[1]])
+        self.assertNotIn('DISTINCT', str(visible.query))
+
+    def test_page_is_one_query(self):
+        with self.assertNumQueries(1):
+            first, has_next = Project.objects.visible_to(self.owner).page(1, per_page=2)
+        self.assertEqual(len(first), 2)
+        self.assertTrue(has_next)
+        second, has_next = Project.objects.visible_to(self.owner).page(2, per_page=2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(has_next)
+
+    @override_settings(PROJECT_LIST_PAGE_SIZE=2)
+    def test_index_and_partial_show_member_projects(self):
+        self.client.login(username='reader', password='readerpass')
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Visible 1')
+        self.assertNotContains(response, 'Visible 0')
+
+        self.client.login(username='owner', password='ownerpass')
+        response = self.client.get(reverse('project_list_partial'), {'page': 2})
+        self.assertContains(response, 'Previous')
+        self.assertNotContains(response, '>Next<')
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.outsider = User.objects.create_user(username='outsider', password='outsiderpass')
+        self.project = Project.objects.create(name='Rocket engine', description='Liquid fuel tests', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        self.comment = Comment.objects.create(project=self.project, user=self.owner, text='The <b>turbopump</b> failed')
+        hidden = Project.objects.create(name='Secret rocket', owner=self.outsider)
+        ProjectMembership.objects.create(user=self.outsider, project=hidden, role='owner')
+
+    def test_results_are_scoped_ranked_and_highlighted(self):
+        hits, has_next = get_search_backend().search(self.owner, 'rocket')
+        self.assertEqual([(h['kind'], h['id']) for h in hits], [('project', self.project.pk)])
+        self.assertFalse(has_next)
+        self.assertIn('<mark>Rocket</mark>', hits[0]['snippet'])
+
+        hits, _ = get_search_backend().search(self.owner, 'liquid')
+        self.assertIn('<mark>Liquid</mark> fuel', hits[0]['snippet'])
+
+        hits, _ = get_search_backend().search(self.owner, 'turbo')
+        self.assertEqual([(h['kind'], h['id']) for h in hits], [('comment', self.comment.pk)])
+        # Stored text is escaped, only the highlight is markup
+        self.assertIn('&lt;b&gt;<mark>turbopump</mark>&lt;/b&gt;', hits[0]['snippet'])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.project.name = 'Glider'
+        self.project.save()
+        self.assertEqual(get_search_backend().search(self.owner, 'rocket')[0], [])
+        self.assertEqual(len(get_search_backend().search(self.owner, 'glider')[0]), 1)
+
+        self.comment.delete()
+        self.assertEqual(get_search_backend().search(self.owner, 'turbopump')[0], [])
+
+    def test_search_syntax_is_not_interpreted(self):
+        hits, _ = get_search_backend().search(self.owner, 'rocket" OR NEAR(* AND')
+        self.assertEqual(hits, [])
+        self.assertEqual(get_search_backend().search(self.owner, '"*()')[0], [])
+
+    def test_search_partial_pages(self):
+        for i in range(3):
+            Comment.objects.create(project=self.project, user=self.owner, text=f'rocket note {i}')
+        self.client.login(username='owner', password='ownerpass')
+        with override_settings(SEARCH_PAGE_SIZE=2):
+            response = self.client.get(reverse('project_search'), {'q': 'rocket'})
+            self.assertContains(response, 'class="search-hit"', count=2)
+            self.assertContains(response, 'page=2')
+            response = self.client.get(reverse('project_search'), {'q': 'rocket', 'page': 2})
+            self.assertContains(response, 'class="search-hit"', count=2)
+            self.assertNotContains(response, 'search-more')
+        self.assertNotContains(response, 'Secret rocket')
+
+    def test_rebuild_command(self):
+        Comment.objects.bulk_create([Comment(project=self.project, user=self.owner, text='bulk loaded nozzle')])
+        self.assertEqual(get_search_backend().search(self.owner, 'nozzle')[0], [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(get_search_backend().search(self.owner, 'nozzle')[0]), 1)
+
+
+class ActivityFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.editor = User.objects.create_user(username='editor', password='editorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.project = Project.objects.create(name='Feed', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        ProjectMembership.objects.create(user=self.editor, project=self.project, role='editor')
+        ProjectMembership.objects.create(user=self.reader, project=self.project, role='reader')
+        run_pending()
+        ActivityEntry.objects.all().delete()
+
+    def test_project_edit_skips_the_editor(self):
+        self.client.login(username='editor', password='editorpass')
+        self.client.post(reverse('project_update', args=[self.project.pk]), {'name': 'Renamed'})
+        self.client.patch(reverse('project-detail', args=[self.project.pk]), {'description': 'new'},
+                          content_type='application/json')
+        run_pending()
+        self.assertEqual(
+            sorted(ActivityEntry.objects.filter(verb=ActivityEntry.PROJECT).values_list('user__username', flat=True)),
+            ['owner', 'owner', 'reader', 'reader'],
+        )
+
+    def test_comment_fans_out_to_other_members(self):
+        self.client.login(username='editor', password='editorpass')
+        self.client.post(reverse('project_comment_add', args=[self.project.pk]), data={'text': 'news'})
+        self.assertFalse(ActivityEntry.objects.exists())
+        run_pending()
+
+        recipients = set(ActivityEntry.objects.values_list('user__username', flat=True))
+        self.assertEqual(recipients, {'owner', 'reader'})
+        self.client.login(username='owner', password='ownerpass')
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'class="activity-entry"')
+        self.assertContains(response, 'news')
+
+    def test_bulk_member_add_is_one_entry_per_member(self):
+        users = [User.objects.create_user(username=f'new{i}') for i in range(3)]
+        apply_membership_changes(self.project, [{'user_id': u.pk, 'role': 'reader'} for u in users])
+        run_pending()
+        entry = ActivityEntry.objects.get(user=self.owner)
+        self.assertEqual((entry.verb, entry.text), (ActivityEntry.MEMBER, 'new0 and 2 others'))
+        # The new members got the entry too, the whole project had 6 members
+        self.assertEqual(ActivityEntry.objects.count(), 6)
+
+    @override_settings(ACTIVITY_FANOUT_BATCH_SIZE=2)
+    def test_fan_out_inserts_in_batches(self):
+        for i in range(3):
+            ProjectMembership.objects.create(user=User.objects.create_user(username=f'm{i}'),
+                                             project=self.project, role='reader')
+        cache.set('projects:activity_trim', 1)
+        with CaptureQueriesContext(connection) as queries:
+            written = fan_out(self.project.pk, ActivityEntry.PROJECT)
+        self.assertEqual(written, 6)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+
+    @override_settings(ACTIVITY_PAGE_SIZE=2)
+    def test_feed_pages_with_a_cursor_in_one_query(self):
+        for _ in range(5):
+            fan_out(self.project.pk, ActivityEntry.PROJECT, self.editor.pk)
+        with self.assertNumQueries(1):
+            entries, cursor = activity_page(self.owner)
+            [entry.project.name for entry in entries]
+
+        self.client.login(username='owner', password='ownerpass')
+        seen = len(entries)
+        while cursor:
+            response = self.client.get(reverse('activity_feed'), {'before': cursor})
+            seen += response.content.count(b'class="activity-entry"')
+            cursor = response.context['next_cursor']
+        self.assertEqual(seen, 5)
+        self.assertEqual(self.client.get(reverse('activity_feed'), {'before': 'x'}).status_code, 400)
+
+    @override_settings(ACTIVITY_FEED_MAX_ENTRIES=3, ACTIVITY_RETENTION_DAYS=30)
+    def test_trim_drops_old_and_overflowing_entries(self):
+        fan_out(self.project.pk, ActivityEntry.PROJECT, created_at=timezone.now() - timedelta(days=31))
+        for _ in range(4):
+            fan_out(self.project.pk, ActivityEntry.PROJECT)
+        self.assertEqual(trim_activity(), 3 + 3)
+        self.assertEqual(ActivityEntry.objects.filter(user=self.owner).count(), 3)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.outsider = User.objects.create_user(username='outsider', password='outsiderpass')
+        self.project = Project.objects.create(name='Export', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        ProjectMembership.objects.create(user=self.reader, project=self.project, role='reader')
+        for i in range(5):
+            Comment.objects.create(project=self.project, user=self.owner, text=f'line {i}, "quoted"')
+        self.url = reverse('project_export', args=[self.project.pk])
+
+    def test_csv_streams_memberships_then_comments(self):
+        self.client.login(username='reader', password='readerpass')
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        # One query per table (archived comments too), however many rows and chunks
+        with self.assertNumQueries(3):
+            content = b''.join(response.streaming_content).decode()
+
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual([row['type'] for row in rows], ['membership'] * 2 + ['comment'] * 5)
+        self.assertEqual(rows[1]['username'], 'reader')
+        self.assertEqual(rows[2]['text'], 'line 0, "quoted"')
+
+    async def test_jsonl_over_asgi(self):
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.get(self.url, {'format': 'jsonl'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[-1]['text'], 'line 4, "quoted"')
+
+    def test_non_members_and_bad_formats(self):
+        self.client.login(username='outsider', password='outsiderpass')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.login(username='owner', password='ownerpass')
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 400)
+
+
+class ImportTest(TestCase):
+    ROWS = [
+        {'type': 'project', 'project': 'P1', 'name': 'Imported', 'description': 'old tool', 'username': 'alice',
+         'created_at': '2020-01-02T03:04:05Z'},
+        {'type': 'membership', 'project': 'P1', 'username': 'bob', 'role': 'editor'},
+        {'type': 'comment', 'project': 'P1', 'username': 'bob', 'text': 'first', 'created_at': '2021-05-06 07:08:09'},
+        {'type': 'comment', 'project': 'P1', 'username': 'carol', 'text': 'who?'},
+        {'type': 'membership', 'project': 'P2', 'username': 'bob', 'role': 'reader'},
+        {'type': 'membership', 'project': 'P1', 'username': 'alice', 'role': 'admin'},
+        {'type': 'task', 'project': 'P1'},
+        {'type': 'comment', 'project': 'P1', 'username': 'alice', 'text': 'second'},
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='alicepass')
+        self.bob = User.objects.create_user(username='bob', password='bobpass')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, rows=None, extra=''):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', newline='') as f:
+            if name.endswith('.csv'):
+                writer = csv.DictWriter(f, ['type', 'project', 'name', 'description', 'username', 'role', 'text',
+                                            'created_at'])
+                writer.writeheader()
+                writer.writerows(rows or self.ROWS)
+            else:
+                f.writelines(json.dumps(row) + '\n' for row in rows or self.ROWS)
+                f.write(extra)
+        return path
+
+    def test_import_writes_rows_and_reports_errors(self):
+        run = Importer(batch_size=3).run(self.write('data.jsonl', extra='{not json\n'))
+        self.assertEqual((run.status, run.rows_done), (ImportRun.DONE, 9))
+        self.assertEqual((run.projects, run.members, run.comments, run.errors), (1, 1, 2, 5))
+        for expected in ("row 4: unknown user 'carol'", "row 5: unknown project 'P2'", "row 6: role must be",
+                         "row 7: unknown type 'task'", "row 9: invalid JSON"):
+            self.assertIn(expected, run.error_log)
+
+        project = Project.objects.get(name='Imported')
+        self.assertEqual(project.created_at.year, 2020)
+        self.assertEqual((project.comment_count, project.member_count), (2, 2))
+        self.assertEqual(role_for(self.alice, project), 'owner')
+        self.assertEqual(project.comments.get(text='first').created_at.year, 2021)
+        [hit], _ = get_search_backend().search(self.bob, 'imported')
+        self.assertEqual(hit['id'], project.pk)
+
+    def test_interrupted_import_resumes(self):
+        path = self.write('data.csv')
+        run = Importer(batch_size=2).run(path, max_batches=1)
+        self.assertEqual((run.status, run.rows_done), (ImportRun.RUNNING, 2))
+
+        out = StringIO()
+        call_command('import_projects', path, batch_size=2, stdout=out, stderr=StringIO())
+        self.assertIn('Import of data.csv done: 8 rows, 1 projects, 1 members, 2 comments, 4 errors.', out.getvalue())
+        self.assertEqual(Comment.objects.count(), 2)
+
+        # A finished file isn't imported twice
+        call_command('import_projects', path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Project.objects.count(), 1)
+        self.assertEqual(ImportRun.objects.count(), 1)
+
+    def test_batches_add_to_the_counters(self):
+        Importer().run(self.write('projects.jsonl', self.ROWS[:2]))
+        rows = [{'type': 'comment', 'project': 'P1', 'username': 'bob', 'text': f'note {i}',
+                 'created_at': f'2022-01-0{i + 1}T00:00:00Z'} for i in range(4)]
+        with CaptureQueriesContext(connection) as ctx:
+            Importer(batch_size=1).run(self.write('comments.jsonl', rows))
+        # Every batch adds its own rows instead of counting the project's
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+
+        project = Project.objects.get(name='Imported')
+        self.assertEqual((project.comment_count, project.member_count), (4, 2))
+        self.assertEqual(project.last_activity_at.isoformat(), '2022-01-04T00:00:00+00:00')
+        rebuild_counters()
+        project.refresh_from_db()
+        self.assertEqual((project.comment_count, project.member_count), (4, 2))
+        self.assertEqual(project.last_activity_at.isoformat(), '2022-01-04T00:00:00+00:00')
+
+    def test_comments_can_follow_in_a_later_file(self):
+        Importer().run(self.write('projects.jsonl', self.ROWS[:1]))
+        run = Importer().run(self.write('comments.jsonl', self.ROWS[7:]))
+        self.assertEqual((run.comments, run.errors), (1, 0))
+
+    def test_admin_upload_is_imported_by_a_job(self):
+        User.objects.create_superuser(username='admin', password='adminpass')
+        self.client.login(username='admin', password='adminpass')
+        with override_settings(IMPORT_UPLOAD_DIR=self.tmp.name):
+            upload = SimpleUploadedFile('old.jsonl', ''.join(json.dumps(row) + '\n' for row in self.ROWS).encode())
+            response = self.client.post(reverse('admin:projects_importrun_upload'), {'file': upload})
+            self.assertRedirects(response, reverse('admin:projects_importrun_changelist'))
+            with self.captureOnCommitCallbacks(execute=True):
+                run_pending()
+        self.assertEqual(ImportRun.objects.get().source, 'old.jsonl')
+        self.assertTrue(Project.objects.filter(name='Imported').exists())
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_admin_upload_needs_add_project_permission(self):
+        staff = User.objects.create_user(username='staff', password='staffpass', is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename='view_importrun'))
+        self.client.login(username='staff', password='staffpass')
+        url = reverse('admin:projects_importrun_upload')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertNotContains(self.client.get(reverse('admin:projects_importrun_changelist')), url)
+
+        staff.user_permissions.add(*Permission.objects.filter(codename__in=['change_importrun', 'add_project']))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class DeletionTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Doomed rocket', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        reader = User.objects.create_user(username='reader')
+        ProjectMembership.objects.create(user=reader, project=self.project, role='reader')
+        for i in range(5):
+            Comment.objects.create(project=self.project, user=self.owner, text=f'rocket note {i}')
+        self.client.login(username='owner', password='ownerpass')
+
+    def test_tombstone_hides_project_at_once(self):
+        self.client.get(reverse('project_list_partial'))
+        response = self.client.delete(reverse('project-detail', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(Project.objects.filter(pk=self.project.pk).exists())
+        self.assertTrue(Project.all_objects.filter(pk=self.project.pk).exists())
+        self.assertEqual(Comment.objects.filter(project_id=self.project.pk).count(), 5)
+        self.assertNotContains(self.client.get(reverse('project_list_partial')), 'Doomed rocket')
+        self.assertEqual(self.client.get(reverse('project-list')).json(), [])
+        self.assertEqual(self.client.get(reverse('project_detail_comments', args=[self.project.pk])).status_code, 404)
+        self.assertEqual(get_search_backend().search(self.owner, 'rocket')[0], [])
+        # Deleting again does nothing
+        self.assertIsNone(tombstone_project(self.project))
+
+    def test_api_delete_does_not_load_the_rows(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.delete(reverse('project-detail', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 204)
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries)
+        self.assertNotIn('"projects_comment"."text"', sql)
+        self.assertNotIn('projects_archivedcomment', sql)
+
+    def test_purge_job_deletes_in_batches(self):
+        run_pending()
+        tombstone_project(self.project, self.owner)
+        deletion = ProjectDeletion.objects.get(project_id=self.project.pk)
+        self.assertEqual((deletion.comments, deletion.members, deletion.deleted_by), (5, 2, self.owner))
+
+        with override_settings(PROJECT_PURGE_BATCH_SIZE=2, PROJECT_PURGE_BATCHES_PER_JOB=1):
+            run_pending(limit=1)
+            deletion.refresh_from_db()
+            self.assertEqual((deletion.status, deletion.comments_deleted), (ProjectDeletion.RUNNING, 2))
+            self.assertEqual(Comment.objects.filter(project_id=self.project.pk).count(), 3)
+            run_pending()
+
+        deletion.refresh_from_db()
+        self.assertEqual(deletion.status, ProjectDeletion.DONE)
+        self.assertEqual((deletion.comments_deleted, deletion.members_deleted), (5, 2))
+        self.assertGreater(deletion.activity_deleted, 0)
+        self.assertFalse(Project.all_objects.filter(pk=self.project.pk).exists())
+        self.assertFalse(Comment.objects.filter(project_id=self.project.pk).exists())
+        self.assertFalse(ActivityEntry.objects.filter(project_id=self.project.pk).exists())
+
+    def test_purge_command(self):
+        tombstone_project(self.project)
+        self.assertEqual(purge_project(self.project.pk, max_batches=1, batch_size=2).comments_deleted, 2)
+        out = StringIO()
+        call_command('purge_projects', batch_size=2, stdout=out)
+        self.assertIn('Purged Doomed rocket', out.getvalue())
+        self.assertEqual(ProjectDeletion.objects.get().status, ProjectDeletion.DONE)
+        self.assertFalse(Project.all_objects.exists())
+
+
+@override_settings(COMMENTS_PAGE_SIZE=3, COMMENT_ARCHIVE_AFTER_DAYS=35)
+class CommentArchiveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Old', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        now = timezone.now()
+        self.comments = [
+            Comment.objects.create(project=self.project, user=self.owner, text=f'comment {i}',
+                                   created_at=now - timedelta(days=100 - i * 10))
+            for i in range(10)
+        ]
+        self.client.login(username='owner', password='ownerpass')
+        self.url = reverse('project_comments_partial', args=[self.project.pk])
+
+    def test_old_comments_move_to_archive(self):
+        self.assertEqual(archive_comments(batch_size=2), 7)
+        self.assertEqual(Comment.objects.count(), 3)
+        self.assertEqual(
+            list(ArchivedComment.objects.order_by('pk').values_list('pk', 'text')),
+            [(c.pk, c.text) for c in self.comments[:7]],
+        )
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.comment_count, 10)
+        self.assertEqual(len(get_search_backend().search(self.owner, 'comment', per_page=20)[0]), 10)
+
+        call_command('rebuild_project_counters', stdout=StringIO())
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.comment_count, 10)
+        self.assertEqual(len(get_search_backend().search(self.owner, 'comment', per_page=20)[0]), 10)
+
+    def test_oldest_archived_first_by_time_not_id(self):
+        imported = Comment.objects.create(project=self.project, user=self.owner, text='imported',
+                                          created_at=timezone.now() - timedelta(days=1000))
+        self.assertEqual(archive_comments(batch_size=1, max_batches=1), 1)
+        self.assertEqual(ArchivedComment.objects.get().pk, imported.pk)
+        plan = Comment.objects.filter(created_at__lt=timezone.now()).order_by('created_at', 'id')[:1].explain()
+        self.assertIn('comment_created_at_idx', plan)
+
+    def test_feed_pages_into_archive(self):
+        archive_comments()
+        Comment.objects.create(project=self.project, user=self.owner, text='fresh')
+
+        # The first window is filled from the live table alone
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertFalse([q for q in ctx.captured_queries if 'projects_archivedcomment' in q['sql']])
+        seen = [c.pk for c in response.context['comments']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(self.url, {'before': cursor})
+            seen += [c.pk for c in response.context['comments']]
+            cursor = response.context['next_cursor']
+        self.assertEqual(seen, [c.pk for c in reversed(self.comments + [Comment.objects.get(text='fresh')])])
+        self.assertContains(response, 'comment 0')
+
+        response = self.client.get(reverse('project-detail', args=[self.project.pk]))
+        self.assertEqual(len(response.json()['comments']), 11)
+
+    def test_job_and_command(self):
+        # Comment jobs queue the archive job
+        run_pending()
+        self.assertEqual(ArchivedComment.objects.count(), 7)
+
+        out = StringIO()
+        call_command('archive_comments', days=0, stdout=out)
+        self.assertIn('Archived 3 comment(s)', out.getvalue())
+        self.assertFalse(Comment.objects.exists())
+
+        response = self.client.get(reverse('project_export', args=[self.project.pk]))
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([row['text'] for row in rows if row['type'] == 'comment'], [c.text for c in self.comments])
+
+    def test_purge_deletes_archive(self):
+        archive_comments()
+        tombstone_project(self.project)
+        run_pending()
+        self.assertEqual(ProjectDeletion.objects.get().comments_deleted, 10)
+        self.assertFalse(ArchivedComment.objects.exists())
+        self.assertEqual(get_search_backend().search(self.owner, 'comment')[0], [])
+
+
+class RecordingBroker(BaseBroker):
+    published = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class CommentStreamTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.editor = User.objects.create_user(username='editor', password='editorpass')
+        self.project = Project.objects.create(name='Live', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        ProjectMembership.objects.create(user=self.editor, project=self.project, role='editor')
+
+    async def test_broker_delivers_across_threads(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe('chan')
+        await sync_to_async(broker.publish, thread_sensitive=False)('chan', {'n': 1})
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 1), {'n': 1})
+        subscription.close()
+        self.assertEqual(broker._channels, {})
+
+    @override_settings(COMMENT_BROKER='apps.projects.tests.RecordingBroker')
+    def test_comment_add_publishes_after_commit(self):
+        RecordingBroker.published = []
+        self.client.login(username='owner', password='ownerpass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('project_comment_add', args=[self.project.pk]), data={'text': 'live!'})
+        [(channel, message)] = RecordingBroker.published
+        self.assertEqual(channel, comment_channel(self.project.pk))
+        self.assertEqual(message['author_id'], self.owner.pk)
+        self.assertIn('live!', message['html'])
+
+    async def test_stream_pushes_other_users_comments(self):
+        await self.async_client.aforce_login(self.editor)
+        response = await self.async_client.get(reverse('project_comment_stream', args=[self.project.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.streaming_content
+        self.assertTrue((await anext(events)).startswith(b'retry:'))
+
+        # The subscription is registered once the generator is running
+        broker = get_broker()
+        broker.publish(comment_channel(self.project.pk), {'author_id': self.editor.pk, 'html': 'own'})
+        broker.publish(comment_channel(self.project.pk), {'author_id': self.owner.pk, 'html': '<li>hi</li>'})
+        self.assertEqual(await asyncio.wait_for(anext(events), 1), b'event: comment\ndata: <li>hi</li>\n\n')
+        await events.aclose()
+
+    def test_stream_not_served_under_wsgi(self):
+        self.client.login(username='owner', password='ownerpass')
+        response = self.client.get(reverse('project_comment_stream', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 204)
+
+
+class BulkMembershipTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Team', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        self.users = User.objects.bulk_create([User(username=f'member{i}') for i in range(20)])
+        ProjectMembership.objects.create(user=self.users[0], project=self.project, role='reader')
+        ProjectMembership.objects.create(user=self.users[1], project=self.project, role='editor')
+        self.client.login(username='owner', password='ownerpass')
+
+    def test_api_bulk_changes_in_constant_queries(self):
+        members = [{'user_id': u.pk, 'role': 'editor'} for u in self.users]
+        members[1]['role'] = 'none'
+        members.append({'user_id': self.owner.pk, 'role': 'reader'})
+        members.append({'user_id': self.users[5].pk, 'role': 'admin'})
+
+        response = self.client.post(
+            reverse('project-bulk-members', args=[self.project.pk]),
+            data={'members': members}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['summary'], {'updated': 1, 'removed': 1, 'added': 18, 'error': 2})
+        self.assertEqual(
+            dict(self.project.members.values_list('user_id', 'role'))[self.users[0].pk], 'editor'
+        )
+        self.assertFalse(self.project.members.filter(user=self.users[1]).exists())
+        self.assertEqual(self.project.members.get(user=self.owner).role, 'owner')
+
+    def test_query_count_independent_of_batch_size(self):
+        def run(users):
+            with CaptureQueriesContext(connection) as ctx:
+                apply_membership_changes(self.project, [{'user_id': u.pk, 'role': 'reader'} for u in users])
+            return len(ctx)
+        self.assertEqual(run(self.users[2:4]), run(self.users[4:20]))
+
+    def test_htmx_bulk_by_username(self):
+        response = self.client.post(
+            reverse('project_bulk_members', args=[self.project.pk]),
+            data={'members': 'member5 editor\nmember6\nnobody reader', 'default_role': 'reader'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['summary'], {'added': 2, 'error': 1})
+        self.assertEqual(self.project.members.get(user=self.users[6]).role, 'reader')
+
+    def test_only_owner_can_bulk_edit(self):
+        User.objects.filter(pk=self.users[1].pk).update(password=self.owner.password)
+        self.client.login(username='member1', password='ownerpass')
+        response = self.client.post(
+            reverse('project-bulk-members', args=[self.project.pk]),
+            data={'members': []}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(USER_SEARCH_LIMIT=3)
+class MemberSearchTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Search', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        User.objects.bulk_create(
+            [User(username=f'alice{i}', email=f'a{i}@example.com') for i in range(5)]
+            + [User(username='bob', email='alice@example.org')]
+        )
+        ProjectMembership.objects.create(user=User.objects.get(username='alice0'), project=self.project, role='reader')
+        self.client.login(username='owner', password='ownerpass')
+
+    def test_form_does_not_load_users(self):
+        response = self.client.get(reverse('project_add_member', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'alice1')
+
+    def test_prefix_search_excludes_members_and_is_limited(self):
+        response = self.client.get(reverse('project_member_search', args=[self.project.pk]), {'q': 'ali'})
+        self.assertEqual([u['username'] for u in response.context['users']], ['alice1', 'alice2', 'alice3'])
+
+    def test_prefix_ignores_case(self):
+        users = member_candidates(self.project, 'Al')
+        self.assertEqual([u['username'] for u in users], ['alice1', 'alice2', 'alice3'])
+
+    def test_matches_email_prefix(self):
+        with self.assertNumQueries(1):
+            users = list(member_candidates(self.project, 'ALICE@'))
+        self.assertEqual([u['username'] for u in users], ['bob'])
+
+    def test_prefix_search_uses_the_lower_indexes(self):
+        plan = member_candidates(self.project, 'Al').explain()
+        self.assertIn('accounts_user_username_lower_idx', plan)
+        self.assertIn('accounts_user_email_lower_idx', plan)
+        self.assertNotIn('SCAN auth_user', plan)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True)
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.project = Project.objects.create(name='Measured', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        self.client.login(username='owner', password='ownerpass')
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('project_detail_comments', args=[self.project.pk]))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries, \d+ duplicate"')
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_metrics_logged(self):
+        with self.assertLogs('project_management.requests', 'INFO') as logs:
+            self.client.get(reverse('project_list_partial'))
+        record = logs.records[0]
+        self.assertEqual(record.status, 200)
+        self.assertGreater(record.metrics['queries'], 0)
+
+    def test_metrics_keep_no_query_parameters(self):
+        from django.template import Template
+        from project_management import middleware
+
+        metrics = middleware.RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            Comment.objects.create(project=self.project, user=self.owner, text='secret plans')
+        self.assertTrue(metrics.statements)
+        self.assertFalse([sql for sql in metrics.statements if 'secret plans' in sql])
+        self.assertNotIn('secret plans', repr(vars(metrics)))
+        # Render times come from the template backend, not a patched Template
+        self.assertEqual(Template.render.__module__, 'django.template.base')
+
+    def test_templates_are_timed(self):
+        with self.assertLogs('project_management.requests', 'INFO') as logs:
+            self.client.get(reverse('project_list_partial'))
+        self.assertGreater(logs.records[0].metrics['template_ms'], 0)
+
+    @override_settings(REQUEST_METRICS_PANEL=True)
+    def test_panel_injected(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'id="debug-panel"')
+        self.assertNotContains(response, 'hx-swap-oob')
+
+        response = self.client.get(reverse('project_list_partial'), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'hx-swap-oob="true"')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_benchmark_reports_every_endpoint(self):
+        out = StringIO()
+        call_command(
+            'benchmark', in_place=True, users=6, projects=2, members=2, comments=5,
+            iterations=2, warmup=0, stdout=out
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {
+            'project_index', 'login_htmx', 'api_project_list', 'project_search', 'project_detail_comments',
+            'project_comment_add', 'project_add_member_form', 'project_add_member', 'api_project_retrieve',
+        })
+        for result in report['results'].values():
+            self.assertEqual(result['status'], [200])
+            self.assertIn('p95', result['latency_ms'])
+
+    def test_baseline_regression_fails(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, 'baseline.json')
+            call_command(
+                'benchmark', in_place=True, users=3, projects=1, members=1, comments=1,
+                iterations=1, warmup=0, output=baseline
+            )
+            with open(baseline) as f:
+                report = json.load(f)
+            for result in report['results'].values():
+                result['queries']['max'] = 0
+            with open(baseline, 'w') as f:
+                json.dump(report, f)
+
+            with self.assertRaisesMessage(CommandError, 'Regressions'):
+                call_command(
+                    'benchmark', in_place=True, users=3, projects=1, members=1, comments=1,
+                    iterations=1, warmup=0, baseline=baseline, stdout=StringIO(), stderr=StringIO()
+                )
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.project = Project.objects.create(name='Async', owner=self.owner)
+        ProjectMembership.objects.create(user=self.owner, project=self.project, role='owner')
+        ProjectMembership.objects.create(user=self.reader, project=self.project, role='reader')
+        Comment.objects.create(project=self.project, user=self.owner, text='first')
+
+    @override_settings(REQUEST_METRICS_ENABLED=True)
+    async def test_detail_is_served_async_with_validators(self):
+        await self.async_client.aforce_login(self.owner)
+        url = reverse('project_detail_comments', args=[self.project.pk])
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'first')
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries')
+
+        response = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_index_lists_projects(self):
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.get(reverse('home'))
+        self.assertContains(response, 'Async')
+
+    async def test_comment_add_and_reader_denied(self):
+        url = reverse('project_comment_add', args=[self.project.pk])
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.post(url, {'text': 'from the loop'})
+        self.assertContains(response, 'from the loop')
+        self.assertEqual(await Comment.objects.filter(project=self.project).acount(), 2)
+
+        await self.async_client.aforce_login(self.reader)
+        response = await self.async_client.post(url, {'text': 'nope'})
+        self.assertEqual(response.status_code, 403)
+
+    async def test_anonymous_redirected_to_login(self):
+        response = await self.async_client.get(reverse('project_comments_partial', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 302)
+
+
+class LoadTestCommandTest(TransactionTestCase):
+    # Requests may read through replica aliases (SQLITE_REPLICAS)
+    databases = '__all__'
+
+    def test_both_stacks_reported(self):
+        out = StringIO()
+        call_command(
+            'loadtest', in_place=True, users=4, projects=1, members=1, comments=3,
+            requests=8, concurrency=2, wsgi_threads=2, no_writes=True, stdout=out
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {'asgi', 'wsgi'})
+        for result in report['results'].values():
+            self.assertEqual(result['status'], {'200': 8})
+            self.assertIn('p95', result['latency_ms'])
+
+
+class AtomicRetryTest(TransactionTestCase):
+    def test_retries_lock_errors_only(self):
+        calls = []
+
+        @atomic_retry
+        def write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        with override_settings(SQLITE_LOCK_BACKOFF=0):
+            self.assertEqual(write(), 'done')
+        self.assertEqual(len(calls), 3)
+
+        @atomic_retry
+        def broken():
+            raise OperationalError('no such table: nope')
+
+        with self.assertRaises(OperationalError):
+            broken()
+
+    @override_settings(SQLITE_LOCK_BACKOFF=0, SQLITE_LOCK_RETRIES=1)
+    def test_gives_up(self):
+        @atomic_retry
+        def write():
+            raise OperationalError('database is locked')
+
+        with self.assertRaises(OperationalError):
+            write()
+
+    def test_outer_transaction_not_retried(self):
+        calls = []
+
+        @atomic_retry
+        def write():
+            calls.append(1)
+            raise OperationalError('database is locked')
+
+        with self.assertRaises(OperationalError), transaction.atomic():
+            write()
+        self.assertEqual(len(calls), 1)
+
+
+class SQLiteStressCommandTest(TransactionTestCase):
+    # Requests may read through replica aliases (SQLITE_REPLICAS)
+    databases = '__all__'
+
+    def test_report(self):
+        # One thread: the in-memory test database locks whole tables
+        # between connections, which no profile can help with
+        out = StringIO()
+        call_command(
+            'sqlite_stress', in_place=True, users=4, projects=1, members=1, comments=3,
+            writers=1, readers=0, requests=3, stdout=out
+        )
+        results = json.loads(out.getvalue())['results']
+        self.assertEqual(set(results), {'default', 'production'})
+        for result in results.values():
+            self.assertEqual(result['failed'], 0)
+            self.assertEqual(result['comments_written'], 3)
+            self.assertEqual(result['write']['status'], {'200': 3})
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def _request(self, pinned=False):
+        state, token = begin_request(pinned)
+        self.addCleanup(end_request, state, token)
+        return state
+
+    def test_reads_go_to_one_replica_per_request(self):
+        self._request()
+        replica = self.router.db_for_read(Comment)
+        self.assertIn(replica, ['replica1', 'replica2'])
+        self.assertEqual(self.router.db_for_read(Project), replica)
+        # Other models, and reads outside requests, stay on the primary
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_round_robin(self):
+        chosen = []
+        for _ in range(2):
+            state, token = begin_request()
+            chosen.append(self.router.db_for_read(Project))
+            end_request(state, token)
+        self.assertEqual(sorted(chosen), ['replica1', 'replica2'])
+
+    @override_settings(REPLICA_SELECTION='least_loaded')
+    def test_least_loaded(self):
+        busy, token = begin_request()
+        first = self.router.db_for_read(Project)
+        for _ in range(3):
+            state, inner = begin_request()
+            self.assertNotEqual(self.router.db_for_read(Project), first)
+            end_request(state, inner)
+        end_request(busy, token)
+
+    def test_write_pins_request_to_primary(self):
+        state = self._request()
+        self.assertEqual(self.router.db_for_write(Comment), 'default')
+        self.assertTrue(state.wrote)
+        self.assertIsNone(self.router.db_for_read(Comment))
+
+    def test_primary_reads_block(self):
+        state = self._request()
+        with primary_reads():
+            self.assertIsNone(self.router.db_for_read(Comment))
+        self.assertIsNotNone(self.router.db_for_read(Comment))
+        self.assertFalse(state.pinned)
+
+    def test_outside_request(self):
+        self.assertIsNone(self.router.db_for_read(Comment))
+        self.assertEqual(self.router.db_for_write(Comment), 'default')
+
+    def test_replicas_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'projects'))
+        self.assertIsNone(self.router.allow_migrate('default', 'projects'))
+
+    def test_pinning_middleware(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Comment))
+            if request.method == 'POST':
+                self.router.db_for_write(Comment)
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+
+        response = middleware(factory.post('/'))
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        pinned = factory.get('/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        response = middleware(pinned)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertIsNone(reads[-1])
+
+        middleware(factory.get('/'))
+        self.assertIsNotNone(reads[-1])
+
+
+@override_settings(PROJECT_SHARDS=['shard1', 'shard2'])
+class ShardRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ShardRouter()
+
+    def test_jump_hash(self):
+        before = [jump_hash(key, 2) for key in range(1000)]
+        after = [jump_hash(key, 3) for key in range(1000)]
+        self.assertTrue(all(0 <= bucket < 2 for bucket in before))
+        # Growing only moves keys into the new bucket, about a third of them
+        moved = [a for b, a in zip(before, after) if a != b]
+        self.assertEqual(set(moved), {2})
+        self.assertAlmostEqual(len(moved) / 1000, 1 / 3, delta=0.05)
+        self.assertEqual(shard_for(7), ['shard1', 'shard2'][jump_hash(7, 2)])
+
+    def test_sharded_models_need_a_shard(self):
+        with self.assertRaises(NoShardSelected):
+            self.router.db_for_read(Comment)
+        with use_shard('shard2'):
+            self.assertEqual(self.router.db_for_read(Comment), 'shard2')
+            self.assertEqual(self.router.db_for_write(Project), 'shard2')
+            self.assertIsNone(self.router.db_for_read(User))
+
+    def test_instance_hint(self):
+        project = Project(pk=1)
+        project._state.db = 'shard1'
+        self.assertEqual(self.router.db_for_read(Comment, instance=project), 'shard1')
+        # The shard's users are copies: related users are read from the primary
+        self.assertEqual(self.router.db_for_read(User, instance=project), 'default')
+
+    @override_settings(PROJECT_SHARDS=[])
+    def test_unsharded(self):
+        self.assertIsNone(self.router.db_for_read(Comment))
+        self.assertIsNone(self.router.db_for_write(Comment))
+
+
+@unittest.skipUnless(
+    {'shard1', 'shard2'} <= set(settings.DATABASES),
+    "needs the shard1 and shard2 databases (SQLITE_SHARDS=2 or project_management.test_settings)",
+)
+@override_settings(PROJECT_SHARDS=['shard1', 'shard2'], SHARD_MOVE_DRAIN_SECONDS=0)
+class ShardingTest(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='ownerpass')
+        self.member = User.objects.create_user(username='member', password='memberpass')
+        self.client = Client()
+        self.client.force_login(self.owner)
+
+        for i in range(6):
+            self.client.post(reverse('project_create'), {'name': f'Rocket {i}', 'description': 'fuel'})
+        self.projects = dict(ProjectPlacement.objects.values_list('pk', 'shard'))
+
+    def test_projects_spread_over_shards(self):
+        self.assertEqual(set(self.projects.values()), set(settings.PROJECT_SHARDS))
+        for pk, shard in self.projects.items():
+            self.assertTrue(Project.objects.using(shard).filter(pk=pk, owner=self.owner).exists())
+            self.assertTrue(ProjectMembership.objects.using(shard).filter(project_id=pk, role='owner').exists())
+        self.assertFalse(Project.objects.using('default').exists())
+
+    def test_views_fan_out(self):
+        response = self.client.get(reverse('project_list_partial'))
+        for i in range(6):
+            self.assertContains(response, f'Rocket {i}')
+
+        response = self.client.get(reverse('project_search'), {'q': 'rocket'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.count(b'<mark>'), 6)
+
+        response = self.client.get('/projects/api/projects/')
+        self.assertEqual(len(response.json()), 6)
+
+    def test_project_views_use_its_shard(self):
+        pk = next(iter(self.projects))
+        response = self.client.post(reverse('project_comment_add', args=[pk]), {'text': 'liftoff'},
+                                    HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        run_pending()
+        shard = self.projects[pk]
+        self.assertEqual(Comment.objects.using(shard).get().text, 'liftoff')
+        self.assertEqual(Project.objects.using(shard).get(pk=pk).comment_count, 1)
+
+        response = self.client.get(reverse('project_comments_partial', args=[pk]))
+        self.assertContains(response, 'liftoff')
+        self.assertEqual(self.client.get(reverse('project_comments_partial', args=[10 ** 6])).status_code, 404)
+
+    def test_member_sees_project_and_activity(self):
+        pk = next(iter(self.projects))
+        self.client.post(reverse('project_add_member', args=[pk]), {'user_id': self.member.pk, 'role': 'editor'})
+        self.client.post(reverse('project_comment_add', args=[pk]), {'text': 'hello'})
+        run_pending()
+
+        self.client.force_login(self.member)
+        response = self.client.get(reverse('project_list_partial'))
+        self.assertContains(response, Project.objects.using(self.projects[pk]).get(pk=pk).name)
+        self.assertEqual(activity_page(self.member)[0][0].project.pk, pk)
+
+    def test_rebalance(self):
+        pk = next(pk for pk, shard in self.projects.items() if shard == 'shard2')
+        self.client.post(reverse('project_comment_add', args=[pk]), {'text': 'moving day'})
+        run_pending()
+
+        with override_settings(PROJECT_SHARDS=['shard1']):
+            call_command('rebalance_shards', stdout=StringIO())
+        self.assertEqual(set(ProjectPlacement.objects.values_list('shard', flat=True)), {'shard1'})
+        self.assertFalse(Project.objects.using('shard2').exists())
+        self.assertFalse(Comment.objects.using('shard2').exists())
+        self.assertEqual(Comment.objects.using('shard1').get(project_id=pk).text, 'moving day')
+
+        response = self.client.get(reverse('project_comments_partial', args=[pk]))
+        self.assertContains(response, 'moving day')
+        response = self.client.get(reverse('project_search'), {'q': 'moving'})
+        self.assertEqual(response.content.count(b'<mark>'), 1)
+
+    def test_delete_purges_the_shard(self):
+        pk = next(iter(self.projects))
+        shard = self.projects[pk]
+        self.client.post(reverse('project_comment_add', args=[pk]), {'text': 'last words'})
+        response = self.client.post(reverse('project_delete', args=[pk]), HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        name = Project.all_objects.using(shard).get(pk=pk).name
+        self.assertNotContains(self.client.get(reverse('project_list_partial')), name)
+
+        run_pending()
+        self.assertEqual(ProjectDeletion.objects.get(project_id=pk).status, ProjectDeletion.DONE)
+        self.assertFalse(Project.all_objects.using(shard).filter(pk=pk).exists())
+        self.assertFalse(Comment.objects.using(shard).filter(project_id=pk).exists())
+        self.assertFalse(ProjectPlacement.objects.filter(pk=pk).exists())
+
+    def test_archive_follows_rebalance(self):
+        pk = next(pk for pk, shard in self.projects.items() if shard == 'shard2')
+        self.client.post(reverse('project_comment_add', args=[pk]), {'text': 'ancient history'})
+        run_pending()
+        call_command('archive_comments', days=0, stdout=StringIO())
+        self.assertEqual(ArchivedComment.objects.using('shard2').get().text, 'ancient history')
+
+        with override_settings(PROJECT_SHARDS=['shard1']):
+            call_command('rebalance_shards', stdout=StringIO())
+        self.assertFalse(ArchivedComment.objects.using('shard2').exists())
+        self.assertFalse(Comment.objects.using('shard1').filter(project_id=pk).exists())
+        self.assertEqual(ArchivedComment.objects.using('shard1').get(project_id=pk).text, 'ancient history')
+
+        response = self.client.get(reverse('project_comments_partial', args=[pk]))
+        self.assertContains(response, 'ancient history')
+        response = self.client.get(reverse('project_search'), {'q': 'ancient'})
+        self.assertEqual(response.content.count(b'<mark>'), 1)
+
+    def test_moving_project_listed_once(self):
+        from .rebalance import _copy_project
+        pk = next(pk for pk, shard in self.projects.items() if shard == 'shard2')
+        name = Project.objects.using('shard2').get(pk=pk).name
+        # Copied to shard1, not yet deleted from shard2
+        with use_shard('shard1'):
+            _copy_project(pk, 'shard2', 'shard1', 100)
+
+        response = self.client.get(reverse('project_list_partial'))
+        self.assertContains(response, 'class="project-row"', count=6)
+        self.assertEqual(len(self.client.get('/projects/api/projects/').json()), 6)
+        response = self.client.get(reverse('project_search'), {'q': name})
+        self.assertEqual(response.content.count(b'<mark>'), 2)
+
+    def test_import_places_projects(self):
+        rows = [{'type': 'project', 'project': f'P{i}', 'name': f'Satellite {i}', 'username': 'owner'}
+                for i in range(6)]
+        rows += [{'type': 'membership', 'project': f'P{i}', 'username': 'member', 'role': 'reader'} for i in range(6)]
+        rows += [{'type': 'comment', 'project': f'P{i}', 'username': 'member', 'text': 'orbit'} for i in range(6)]
+        rows.append({'type': 'comment', 'project': 'P9', 'username': 'member', 'text': 'lost'})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.jsonl')
+            with open(path, 'w') as f:
+                f.writelines(json.dumps(row) + '\n' for row in rows)
+            run = Importer(batch_size=4).run(path)
+        self.assertEqual((run.projects, run.members, run.comments, run.errors), (6, 6, 6, 1))
+
+        placed = dict(ProjectPlacement.objects.values_list('pk', 'shard'))
+        imported = [pk for pk in placed if pk not in self.projects]
+        self.assertEqual(set(placed[pk] for pk in imported), set(settings.PROJECT_SHARDS))
+        for pk in imported:
+            project = Project.objects.using(placed[pk]).get(pk=pk)
+            self.assertEqual((project.member_count, project.comment_count), (2, 1))
+            self.assertEqual(Comment.objects.using(placed[pk]).get(project_id=pk).text, 'orbit')
+
+        self.client.force_login(self.member)
+        self.assertContains(self.client.get(reverse('project_list_partial')), 'class="project-row"', count=6)
+        response = self.client.get(reverse('project_search'), {'q': 'orbit'})
+        self.assertEqual(response.content.count(b'<mark>'), 6)
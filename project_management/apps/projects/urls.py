@@ -1,5 +1,5 @@
 from rest_framework.routers import DefaultRouter
-from django.urls import path
+from django.urls import path, include
 from .views import (
     project_index,
     project_list_partial,
@@ -11,7 +11,13 @@ from .views import (
     project_comment_add,
 project_detail_comments,
 ProjectViewSet,
-project_add_member
+project_add_member,
+project_comment_stream,
+project_bulk_members,
+project_member_search,
+project_search,
+activity_feed,
+project_export
 )
 
 router = DefaultRouter()
@@ -21,6 +27,8 @@ router.register('projects', ProjectViewSet, basename='project')
 urlpatterns = [
     path('', project_index, name='home'),
     path('list/', project_list_partial, name='project_list_partial'),
+    path('search/', project_search, name='project_search'),
+    path('activity/', activity_feed, name='activity_feed'),
     path('projects/details/<int:pk>/', project_detail_comments, name='project_detail_comments'),
     path('create/', project_create, name='project_create'),
     path('create/form/', project_create_form, name='project_create_form'),
@@ -29,6 +37,12 @@ urlpatterns = [
     # Comment endpoints
     path('<int:pk>/comments/', project_comments_partial, name='project_comments_partial'),
     path('<int:pk>/comment/add/', project_comment_add, name='project_comment_add'),
+    path('<int:pk>/comments/stream/', project_comment_stream, name='project_comment_stream'),
 path('<int:pk>/add_member/', project_add_member, name='project_add_member'),
+    path('<int:pk>/members/bulk/', project_bulk_members, name='project_bulk_members'),
+    path('<int:pk>/members/search/', project_member_search, name='project_member_search'),
+    path('<int:pk>/export/', project_export, name='project_export'),
+    # DRF API: /projects/api/projects/
+    path('api/', include(router.urls)),
 
 ]
\ No newline at end of file
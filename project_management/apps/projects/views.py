@@ -3,21 +3,43 @@ from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
-from .models import Project, ProjectMembership, Comment
+from .models import Project, ProjectMembership, Comment, ArchivedComment
 from .serializers import (
     ProjectSerializer,
+    ProjectListSerializer,
     ProjectMembershipSerializer,
     CommentSerializer
 )
 from .permissions import IsProjectOwnerOrReadOnly, CanCommentOnProject
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseBadRequest, HttpResponse, HttpResponseForbidden
+from .pagination import acomment_page, InvalidCursor
+from .roles import role_for, arole_for, EDIT_ROLES
+from .memberships import apply_membership_changes, member_candidates, summarize, TooManyChanges, ROLES, REMOVE
+from .fragments import acomment_feed_html, project_list_html, aproject_list_html
+from .search import get_search_backend
+from .deletion import tombstone_project
+from .sharding import place_new_project, projects_in_bulk, fan_out, merge_by_activity, placed_rows
+from .activity import activity_page, aactivity_page
+from .exports import CONTENT_TYPES, export_stream, aexport_stream
+from .conditional import (
+    project_etag,
+    project_last_modified,
+    project_list_validators,
+    conditional_response,
+    async_project_condition
+)
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
+from django.http import HttpResponseBadRequest, HttpResponse, HttpResponseForbidden, Http404, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth.decorators import login_required
 from .models import Project
-from django.contrib.auth.models import User
-from django.db.models import Q
+from .streams import comment_events
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from django.db.models import Prefetch
+from asgiref.sync import sync_to_async
+from project_management.db import atomic_retry
 
 class ProjectViewSet(viewsets.ModelViewSet):
     """
@@ -31,17 +53,100 @@ class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = [IsAuthenticated, IsProjectOwnerOrReadOnly]
-'''
+
     def perform_create(self, serializer):
-        project = serializer.save(owner=self.request.user)
-        ProjectMembership.objects.create(
-            user=self.request.user, project=project, role='owner'
-        )
+        with place_new_project() as project_id:
+            project = serializer.save(owner=self.request.user, id=project_id)
+            ProjectMembership.objects.create(
+                user=self.request.user, project=project, role='owner'
+            )
+
+    def perform_update(self, serializer):
+        serializer.instance._actor_id = self.request.user.pk
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        # Hidden at once; the rows are purged by a job
+        tombstone_project(instance, self.request.user)
 
     def get_queryset(self):
-        # Return only projects where the user is a member (any role)
-        return Project.objects.filter(members__user=self.request.user)
+        # Return only projects where the user is a member (any role).
+        queryset = Project.objects.visible_to(self.request.user).select_related('owner')
+
+        if self.action == 'list':
+            # Counts are the project's own counters; only the latest few
+            # comments are fetched, in one query for the whole page.
+            recent = Comment.objects.select_related('user').order_by('-created_at', '-id')
+            return queryset.prefetch_related(
+                Prefetch('comments', queryset=recent[:settings.PROJECT_RECENT_COMMENTS],
+                         to_attr='recent_comments'),
+            )
+
+        if self.action != 'retrieve':
+            # Writes (update, destroy, members) load only the project row
+            return queryset
+
+        return queryset.prefetch_related(
+            Prefetch('members', queryset=ProjectMembership.objects.select_related('user')),
+            Prefetch('comments', queryset=Comment.objects.select_related('user').order_by('-created_at', '-id')),
+            Prefetch('archived_comments',
+                     queryset=ArchivedComment.objects.select_related('user').order_by('-created_at', '-id')),
+        )
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list' and settings.PROJECT_SHARDS:
+            # The user's projects from every shard, each with its prefetches
+            return merge_by_activity(placed_rows(fan_out(lambda: list(queryset.all()))))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProjectListSerializer
+        return ProjectSerializer
+
+    def list(self, request, *args, **kwargs):
+        # Answer 304 from one aggregate query before serializing anything
+        etag, last_modified = project_list_validators(
+            request, Project.objects.visible_to(request.user)
+        )
+        return conditional_response(
+            request, etag, last_modified, lambda: super(ProjectViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            pk = int(kwargs[self.lookup_field])
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+        return conditional_response(
+            request, project_etag(request, pk), project_last_modified(request, pk),
+            lambda: super(ProjectViewSet, self).retrieve(request, *args, **kwargs)
+        )
 
+    @action(detail=True, methods=['post'], url_path='members/bulk')
+    def bulk_members(self, request, pk=None):
+        """
+        Endpoint: /projects/{project_id}/members/bulk/
+        Body: { "members": [{"user_id": <int>, "role": "editor"}, ...] }
+        A role of "none" removes the member. Only owners can do this.
+        """
+        project = self.get_object()
+        if role_for(request.user, project) != 'owner':
+            return Response({"detail": "Only owners can manage members."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        members = request.data.get('members')
+        if not isinstance(members, list) or not all(isinstance(m, dict) for m in members):
+            return Response({"detail": "members must be a list of {user_id, role} objects."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            results = apply_membership_changes(project, [dict(m) for m in members])
+        except TooManyChanges as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"summary": summarize(results), "results": results})
+'''
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def add_member(self, request, pk=None):
         """
@@ -97,49 +202,74 @@ class ProjectViewSet(viewsets.ModelViewSet):
 #htmx views
 
 
+def _page_number(request):
+    try:
+        return max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
+
 @login_required
 @ensure_csrf_cookie
-def project_index(request):
+async def project_index(request):
     """
     Render the main page that includes:
       - A container for the list of projects
       - A container for the create form
     """
-    #projects = Project.objects.filter(owner=request.user)
-    projects = Project.objects.filter(
-        Q(owner=request.user)|(
-        Q(members__user=request.user) &
-        Q(members__role__in=['owner', 'editor', 'reader']))
-    ).distinct()
-
-    print('projects',projects)
-    print('owner',request.user)
-    pms = ProjectMembership.objects.all()
-    print('projects',pms)
-
-
-    # Load the first project's details & comments initially
-    first_project = projects.first() if projects.exists() else None
-    if first_project:
-        first_comments = first_project.comments.select_related('user').order_by('-created_at')
-    else:
-        first_comments = []
-
+    user = await request.auser()
+    entries, next_cursor = await aactivity_page(user)
     return render(request, 'projects/index.html', {
-        'projects': projects,
-        'first_project': first_project,
-        'first_comments': first_comments
+        'project_list': await aproject_list_html(user, _page_number(request)),
+        'entries': entries,
+        'next_cursor': next_cursor,
     })
 
 @login_required
 def project_list_partial(request):
     """
-    Returns the partial template with all of the user's projects.
+    Returns the partial template with one page of the user's projects.
     This is used by HTMX to update #project-list-container.
     """
-    projects = Project.objects.filter(owner=request.user)
-    return render(request, 'projects/partials/_project_list.html', {
-        'projects': projects
+    return HttpResponse(project_list_html(request.user, _page_number(request)))
+
+@login_required
+def activity_feed(request):
+    """
+    The next older window of the user's activity feed (?before=<cursor>)
+    as <li> items, for the "load older" sentinel.
+    """
+    cursor = request.GET.get('before')
+    try:
+        entries, next_cursor = activity_page(request.user, cursor)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    return render(request, 'projects/partials/_activity_items.html', {
+        'entries': entries,
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+def project_search(request):
+    """
+    Ranked, highlighted full-text matches of ?q= in the names and
+    descriptions of the user's projects and in their comments.
+    ?page=N returns the next page of <li> items for the "more" sentinel.
+    """
+    q = request.GET.get('q', '').strip()
+    page = _page_number(request)
+    hits, has_next = [], False
+    if len(q) >= settings.SEARCH_MIN_LENGTH:
+        hits, has_next = get_search_backend().search(request.user, q, page)
+        projects = projects_in_bulk({hit['project_id'] for hit in hits})
+        for hit in hits:
+            hit['project'] = projects.get(hit['project_id'])
+    return render(request, 'projects/partials/_search_results.html', {
+        'hits': hits,
+        'has_next': has_next,
+        'page': page,
+        'q': q,
     })
 
 @login_required
@@ -147,7 +277,8 @@ def project_list_partial(request):
 def project_create(request):
     """
     Handle project creation via HTMX POST.
-    On success, return the updated list of projects as a partial.
+    On success, return only the new project's row, which HTMX prepends to
+    the list (it is the most recently active project).
     On error, return the create form partial with errors.
     """
     name = request.POST.get('name')
@@ -161,21 +292,20 @@ def project_create(request):
             'description': description
         }, status=400)
 
-    # Create the project
-    Project.objects.create(
-        name=name,
-        description=description,
-        owner=request.user
-    )
-    project = Project.objects.filter(name=name,owner=request.user).first()
+    with place_new_project() as project_id:
+        project = _create_project(request.user, name, description, project_id)
+    # counters.record_members counted the owner in the row, not in this instance
+    project.member_count = 1
 
-    ProjectMembership.objects.create(user_id=request.user.id, project=project, role='owner')
+    return render(request, 'projects/partials/_project_row.html', {'project': project})
 
-    # Return the updated list partial
-    projects = Project.objects.filter(owner=request.user)
-    return render(request, 'projects/partials/_project_list.html', {
-        'projects': projects
-    })
+
+@atomic_retry
+def _create_project(owner, name, description, pk=None):
+    # The project never exists without its owner membership
+    project = Project.objects.create(pk=pk, name=name, description=description, owner=owner)
+    ProjectMembership.objects.create(user=owner, project=project, role='owner')
+    return project
 
 @login_required
 def project_create_form(request):
@@ -189,14 +319,14 @@ def project_delete(request, pk):
     """
     Delete the specified project. Return updated project list partial.
     """
-    project = Project.objects.filter(pk=pk, owner=request.user)
-    if(project.count()==0):
-        print('cannnnt')
+    project = Project.objects.filter(pk=pk, owner=request.user).first()
+    if project is None:
         messages.info(request, 'You cannot delete this project.You do not have the right privilege')
         response = HttpResponse()
         response["HX-Redirect"] = request.META.get("HTTP_REFERER", "/projects/")  # Redirect back
         return response
-    project.delete()
+    # Hidden at once; its comments and members are purged by a job
+    tombstone_project(project, request.user)
 
     response = HttpResponse()
     response["HX-Redirect"] = request.META.get("HTTP_REFERER", "/projects/")  # Redirect back
@@ -211,15 +341,10 @@ def project_update(request, pk):
     If POST: updates the project and returns the updated project list partial
              OR just the updated row partial.
     """
-
-
-    membership = ProjectMembership.objects.all()
-    '''#print('membership', membership)
-    if  membership[0] or membership.role not in ['owner', 'editor']:
-        return HttpResponseForbidden("You are not allowed to edit this project.")
-   '''
-    #project = Project.object.filter(pk=pk, members__role__in=['editor'])
-    project = get_object_or_404(Project,members__user=request.user.id ,pk=pk, members__role__in=['owner','editor'])
+    project = get_object_or_404(Project, pk=pk)
+    # Readers and non-members don't get to know the project exists
+    if role_for(request.user, project) not in EDIT_ROLES:
+        raise Http404
 
     if request.method == 'GET':
         # Return partial with the edit form
@@ -241,6 +366,7 @@ def project_update(request, pk):
 
         project.name = name
         project.description = description
+        project._actor_id = request.user.pk
         project.save()
 
         response = HttpResponse()
@@ -260,15 +386,17 @@ def project_update(request, pk):
 @login_required
 @require_http_methods(["GET", "POST"])
 def project_add_member(request, pk):
-    project = get_object_or_404(Project, pk=pk, owner=request.user)
+    project = get_object_or_404(Project, pk=pk)
+
+    # Only owners can add members
+    if role_for(request.user, project) != 'owner':
+        return HttpResponseForbidden("Only owners can add members.")
 
     if request.method == "GET":
-        # Return a partial that includes the form for adding a member
-        # e.g., we might pass all users except current ones
-        all_users = User.objects.exclude(id=request.user.id)
+        # Return a partial that includes the form for adding a member.
+        # Users are looked up as the owner types (project_member_search).
         return render(request, "projects/partials/_add_member_form.html", {
             "project": project,
-            "all_users": all_users
         })
 
     # POST logic
@@ -278,12 +406,6 @@ def project_add_member(request, pk):
     if not user_idx or not role:
         return HttpResponseBadRequest("Please select both user and role.")
 
-    # You can add checks, e.g. only owners can add members:
-    membership = ProjectMembership.objects.filter(user=request.user, project=project, role='owner').first()
-
-    if not membership:
-        return HttpResponseForbidden("Only owners can add members.")
-
     if ProjectMembership.objects.filter(user_id=user_idx, project=project).exists():
         return HttpResponseBadRequest("User is already a member of this project.")
 
@@ -303,63 +425,197 @@ def project_add_member(request, pk):
 
 
 @login_required
-def project_comments_partial(request, pk):
+def project_member_search(request, pk):
     """
-    Returns a partial showing all comments for a given project.
+    Typeahead for the add member form: the first few users matching
+    ?q= by username/email prefix who aren't members yet.
     """
     project = get_object_or_404(Project, pk=pk)
-    comments = project.comments.select_related('user').order_by('-created_at')
-    return render(request, 'projects/partials/_comment_list.html', {
-        'project': project,
-        'comments': comments,
+
+    if role_for(request.user, project) != 'owner':
+        return HttpResponseForbidden("Only owners can add members.")
+
+    q = request.GET.get('q', '').strip()
+    users = member_candidates(project, q) if len(q) >= settings.USER_SEARCH_MIN_LENGTH else []
+    return render(request, "projects/partials/_user_search_results.html", {
+        "users": users,
+        "q": q,
     })
 
+
 @login_required
-def project_detail_comments(request, pk):
+@require_http_methods(["GET", "POST"])
+def project_bulk_members(request, pk):
+    """
+    If GET: returns the bulk membership form.
+    If POST: applies one "username role" pair per line of the 'members'
+             field and returns a per-user result table.
+    """
     project = get_object_or_404(Project, pk=pk)
 
-    # You might load comments, membership checks, etc.
-    comments = project.comments.select_related('user').order_by('-created_at')
+    if role_for(request.user, project) != 'owner':
+        return HttpResponseForbidden("Only owners can manage members.")
+
+    if request.method == "GET":
+        return render(request, "projects/partials/_bulk_member_form.html", {
+            "project": project,
+            "roles": ROLES + [REMOVE],
+        })
+
+    changes = []
+    for line in request.POST.get("members", "").splitlines():
+        parts = line.replace(',', ' ').split()
+        if parts:
+            changes.append({
+                "username": parts[0],
+                "role": parts[1] if len(parts) > 1 else request.POST.get("default_role"),
+            })
+
+    if not changes:
+        return HttpResponseBadRequest("Please enter at least one member.")
+    try:
+        results = apply_membership_changes(project, changes)
+    except TooManyChanges as e:
+        return HttpResponseBadRequest(str(e))
+
+    return render(request, "projects/partials/_bulk_member_results.html", {
+        "project": project,
+        "results": results,
+        "summary": summarize(results),
+    })
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@async_project_condition
+async def project_comments_partial(request, pk):
+    """
+    Returns a partial showing the newest window of comments for a project.
+    With ?before=<cursor> only the next older window of <li> items is
+    returned, which the "load older" sentinel swaps in for itself.
+    """
+    project = await aget_object_or_404(Project, pk=pk)
+    role = await arole_for(await request.auser(), project)
+    if role is None:
+        raise Http404
+
+    cursor = request.GET.get('before')
+    if not cursor:
+        return render(request, 'projects/partials/_comment_list.html', {
+            'project': project,
+            'comment_feed': await acomment_feed_html(project, role),
+        })
 
-    # We'll render a single template that has the two OOB divs
+    try:
+        comments, next_cursor = await acomment_page(project, cursor)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    return render(request, 'projects/partials/_comment_items.html', {
+        'project': project,
+        'comments': comments,
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@async_project_condition
+async def project_detail_comments(request, pk):
+    # Templates can't lazy-load relations from the event loop
+    project = await aget_object_or_404(Project.objects.select_related('owner'), pk=pk)
+    role = await arole_for(await request.auser(), project)
+    if role is None:
+        raise Http404
+
+    # We'll render a single template that has the two OOB divs.
+    # Only the newest window of comments is rendered (from the fragment
+    # cache when nothing changed); older ones load on scroll.
     return render(request, 'projects/partials/_detail_comments_oob.html', {
         'project': project,
-        'comments': comments
+        'comment_feed': await acomment_feed_html(project, role),
     })
 
 @login_required
 @require_http_methods(["POST"])
-def project_comment_add(request, pk):
+async def project_comment_add(request, pk):
     """
-    Adds a new comment to the project and returns the updated comment list.
+    Adds a new comment to the project and returns only the new comment,
+    which HTMX prepends to the comment feed.
     """
-    print('here in project_comment_add')
-
-    project = get_object_or_404(Project, pk=pk)
+    project = await aget_object_or_404(Project, pk=pk)
 
     text = request.POST.get('text', '').strip()
 
-
-
-    membership = ProjectMembership.objects.filter(user=request.user, project=project).first()
-    '''print('here in project_comment_add', membership)
-    if not membership or membership.role not in ['owner', 'editor']:
-        return HttpResponseForbidden("You are not allowed to edit this project.")'''
+    # Owners and editors can comment; readers can only view
+    user = await request.auser()
+    role = await arole_for(user, project)
+    if role is None:
+        raise Http404
+    if role not in EDIT_ROLES:
+        return HttpResponseForbidden("You are not allowed to comment on this project.")
     if not text:
-        # Return some partial with an error or the same form
-        # Here we can re-render the comment list with an error message
-        comments = project.comments.select_related('user').order_by('-created_at')
+        # Re-render the newest window of the comment list with an error message
         return render(request, 'projects/partials/_comment_list.html', {
             'project': project,
-            'comments': comments,
+            'comment_feed': await acomment_feed_html(project, role),
             'error': 'Comment text cannot be empty.',
         }, status=400)
 
-    Comment.objects.create(project=project, user=request.user, text=text)
+    # Live viewers get it over their SSE stream, from the comment_created job
+    comment = await sync_to_async(_create_comment)(project, user, text)
 
-    # Return the updated list partial
-    comments = project.comments.select_related('user').order_by('-created_at')
-    return render(request, 'projects/partials/_comment_list.html', {
+    return render(request, 'projects/partials/_comment_item.html', {
         'project': project,
-        'comments': comments
+        'comment': comment,
     })
+
+
+@atomic_retry
+def _create_comment(project, user, text):
+    # The comment, its counters and its job commit together (see signals)
+    return Comment.objects.create(project=project, user=user, text=text)
+
+
+@login_required
+async def project_comment_stream(request, pk):
+    """
+    Server-Sent Events stream of new comments on a project, consumed by
+    HTMX's SSE extension. Needs the ASGI server: under WSGI every open
+    stream would hold a worker thread.
+    """
+    if not isinstance(request, ASGIRequest):
+        # 204 tells EventSource to stop reconnecting
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    project = await aget_object_or_404(Project, pk=pk)
+    if await arole_for(user, project) is None:
+        raise Http404
+
+    response = StreamingHttpResponse(comment_events(project.pk, user.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def project_export(request, pk):
+    """
+    Streams the project's memberships and comments as ?format=csv (default)
+    or jsonl. Every member can export what they can already read.
+    """
+    project = get_object_or_404(Project, pk=pk)
+    if role_for(request.user, project) is None:
+        raise Http404
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        return HttpResponseBadRequest("format must be csv or jsonl.")
+
+    # Each server gets an iterator it can stream without reading it all first
+    stream = aexport_stream if isinstance(request, ASGIRequest) else export_stream
+    response = StreamingHttpResponse(stream(project, export_format), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="project-{project.pk}.{export_format}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
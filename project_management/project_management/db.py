@@ -0,0 +1,70 @@
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from .routers import current_shard
+
+logger = logging.getLogger('project_management.db')
+
+
+def is_lock_error(exc):
+    """
+    SQLite's "database is locked": it gave up waiting for another
+    connection's lock, or couldn't wait at all because that would have
+    deadlocked.
+    """
+    return isinstance(exc, OperationalError) and 'locked' in str(exc).lower()
+
+
+@contextmanager
+def atomic(using=DEFAULT_DB_ALIAS):
+    """
+    transaction.atomic() that also covers the shard selected with
+    routers.use_shard(), when there is one: the project's rows are
+    written there, the jobs and activity they cause in `using`.
+    The shard commits first, so a job never runs before what it is about
+    exists; if `using` then fails to commit, the jobs are lost instead.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(transaction.atomic(using=using))
+        shard = current_shard()
+        if shard is not None and shard != using:
+            stack.enter_context(transaction.atomic(using=shard))
+        yield
+
+
+def atomic_retry(func=None, using=DEFAULT_DB_ALIAS):
+    """
+    Run the function in its own transaction and run it again, after an
+    exponentially growing random pause, if it fails on a database lock.
+    Up to SQLITE_LOCK_RETRIES retries; the function must do nothing
+    outside the database that can't be repeated.
+
+    Inside an outer transaction it just runs once: the lock error belongs
+    to the outer transaction, which is the one that would have to retry.
+    """
+    if func is None:
+        return lambda f: atomic_retry(f, using)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if any(connections[alias].in_atomic_block for alias in (using, current_shard() or using)):
+            return func(*args, **kwargs)
+        attempt = 0
+        while True:
+            try:
+                with atomic(using):
+                    return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or attempt >= settings.SQLITE_LOCK_RETRIES:
+                    raise
+                delay = settings.SQLITE_LOCK_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+                attempt += 1
+                logger.warning("%s: database locked, retry %d in %.3fs", func.__qualname__, attempt, delay)
+                time.sleep(delay)
+    return wrapper
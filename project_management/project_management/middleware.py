@@ -0,0 +1,252 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.loader import render_to_string
+
+from .routers import begin_request, end_request
+
+logger = logging.getLogger('project_management.requests')
+
+PIN_COOKIE = 'pin_primary'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Counters for one request. Also used as the database execute wrapper.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        # Runs of each SQL text. The parameters are user data (comment
+        # text, emails): only their hash is kept, to spot duplicates
+        self.statements = Counter()
+        self._runs = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+            self._runs[(sql, hash(repr(params)))] += 1
+
+    @property
+    def duplicates(self):
+        """
+        Queries run more than once with the same SQL and parameters.
+        """
+        return sum(n - 1 for n in self._runs.values() if n > 1)
+
+    @property
+    def similar(self):
+        """
+        SQL run more than once with different parameters (usually an N+1).
+        """
+        by_sql = Counter(sql for sql, _ in self._runs)
+        return {sql: n for sql, n in by_sql.items() if n > 1}
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'duplicate_queries': self.duplicates,
+            'similar_queries': sum(self.similar.values()),
+            'db_ms': round(self.db_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'total_ms': round(self.total_time * 1000, 2),
+        }
+
+    def server_timing(self):
+        m = self.as_dict()
+        return (
+            f'db;dur={m["db_ms"]};desc="{m["queries"]} queries, {m["duplicate_queries"]} duplicate", '
+            f'tpl;dur={m["template_ms"]}, '
+            f'total;dur={m["total_ms"]}'
+        )
+
+
+def _record_query(execute, sql, params, many, context):
+    # Installed on every connection once; a ContextVar (which follows the
+    # request into sync_to_async threads) says which request to charge
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _install_wrapper(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _install_wrappers(**kwargs):
+    # request_started runs sync receivers on the thread the ORM uses for the
+    # request (also under ASGI), which may hold connections opened earlier
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+
+
+def current_metrics():
+    """
+    The RequestMetrics of the request being served, if it is measured.
+    """
+    return _current.get()
+
+
+class RequestMetricsMiddleware:
+    """
+    Records query count, DB time, duplicate queries, template render time
+    and total latency of each request, when REQUEST_METRICS_ENABLED. They
+    are sent as a Server-Timing header and logged to
+    'project_management.requests'. Render times come from the template
+    backend (project_management.templating.TimedDjangoTemplates). With
+    REQUEST_METRICS_PANEL on, HTML responses also get a small debug panel
+    (as an out-of-band swap for HTMX requests).
+    Keep it first in MIDDLEWARE so the total covers the whole stack.
+    Works under both WSGI and ASGI, so async views stay async.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Queries may run on any thread's connection (sync_to_async)
+        connection_created.connect(_install_wrapper, dispatch_uid='request_metrics')
+        request_started.connect(_install_wrappers, dispatch_uid='request_metrics')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REQUEST_METRICS_ENABLED:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_METRICS_ENABLED:
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    def finish(self, request, response, metrics, start):
+        metrics.total_time = time.perf_counter() - start
+
+        response['Server-Timing'] = metrics.server_timing()
+        record = metrics.as_dict()
+        logger.info(
+            '%s %s %s %d queries (%d duplicate) db=%.1fms tpl=%.1fms total=%.1fms',
+            request.method, request.path, response.status_code, record['queries'],
+            record['duplicate_queries'], record['db_ms'], record['template_ms'], record['total_ms'],
+            extra={'path': request.path, 'method': request.method,
+                   'status': response.status_code, 'metrics': record},
+        )
+        for sql, count in metrics.similar.items():
+            logger.debug('Query ran %d times on %s: %s', count, request.path, sql)
+
+        if settings.REQUEST_METRICS_PANEL:
+            self.add_panel(request, response, metrics)
+        return response
+
+    def add_panel(self, request, response, metrics):
+        if (
+            response.streaming
+            or not response.get('Content-Type', '').startswith('text/html')
+            or not 200 <= response.status_code < 300
+        ):
+            return
+
+        htmx = request.headers.get('HX-Request') == 'true'
+        panel = render_to_string('projects/partials/_debug_panel.html', {
+            'metrics': metrics.as_dict(),
+            'similar': metrics.similar,
+            'path': request.path,
+            'oob': htmx,
+        }).encode(response.charset)
+
+        if htmx:
+            response.content += panel
+        elif b'</body>' in response.content:
+            response.content = response.content.replace(b'</body>', panel + b'</body>', 1)
+        else:
+            return
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes for ReplicaRouter. A request that writes reads from
+    the primary from then on, and its response sets a cookie that pins the
+    client's requests for REPLICA_PIN_SECONDS (how far replicas may lag
+    behind), so the HTMX requests following a POST see what it wrote.
+    Place it before the session middleware, whose writes count too.
+    Streaming response bodies are read after it returns and read from the
+    primary.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        state, token = begin_request(PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(state, token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        state, token = begin_request(PIN_COOKIE in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(state, token)
+        return self.finish(response, state)
+
+    def finish(self, response, state):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,209 @@
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set by ReplicaPinningMiddleware for the request being served
+_current = ContextVar('replica_state', default=None)
+# Set by use_shard(): the shard holding the project being worked on
+_shard = ContextVar('shard_selection', default=None)
+
+_lock = threading.Lock()
+_turns = itertools.count()
+# Requests currently reading from each replica
+_load = Counter()
+
+
+class ReplicaState:
+    """
+    Routing of one request: pinned to the primary, or reading from
+    `replica` (chosen on the first read, then kept so the request sees
+    one replica's consistent state).
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+        # Inside primary_reads()
+        self.primary = False
+
+
+def begin_request(pinned=False):
+    state = ReplicaState(pinned)
+    return state, _current.set(state)
+
+
+def end_request(state, token):
+    _current.reset(token)
+    if state.replica is not None:
+        with _lock:
+            _load[state.replica] -= 1
+
+
+@contextmanager
+def primary_reads():
+    """
+    Send the block's reads to the primary, e.g. to render something cached
+    under keys the primary's writes set: rendered from a lagging replica,
+    stale rows would be served to everyone under a fresh key.
+    """
+    state = _current.get()
+    if state is None:
+        yield
+        return
+    previous, state.primary = state.primary, True
+    try:
+        yield
+    finally:
+        state.primary = previous
+
+
+def choose_replica():
+    """
+    The next of DATABASE_REPLICAS in turn, or with REPLICA_SELECTION =
+    "least_loaded" the one serving the fewest requests (in this process;
+    ties go in turn).
+    """
+    replicas = settings.DATABASE_REPLICAS
+    with _lock:
+        start = next(_turns) % len(replicas)
+        ordered = replicas[start:] + replicas[:start]
+        if settings.REPLICA_SELECTION == 'least_loaded':
+            replica = min(ordered, key=_load.__getitem__)
+        else:
+            replica = ordered[0]
+        _load[replica] += 1
+    return replica
+
+
+class ReplicaRouter:
+    """
+    Sends reads of REPLICA_MODELS made while serving a request to one of
+    DATABASE_REPLICAS. Writes, and every read of a request that has
+    written or is pinned (see ReplicaPinningMiddleware), go to the
+    primary, as do reads inside a transaction and outside requests (jobs,
+    commands), which may depend on what they just wrote.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if (
+            state is None
+            or state.pinned
+            or state.primary
+            or not settings.DATABASE_REPLICAS
+            or model._meta.label_lower not in settings.REPLICA_MODELS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return None
+        if state.replica is None:
+            state.replica = choose_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        # Explicitly: an instance read from a replica is saved to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary, schema included
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class NoShardSelected(LookupError):
+    pass
+
+
+class ShardSelection:
+    """
+    The shard queries of SHARDED_MODELS go to. Mutable, so a selection
+    made inside a copy of the context (sync_to_async, process_view)
+    reaches the code that opened it.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias
+
+
+@contextmanager
+def use_shard(alias=None):
+    """
+    Send queries of SHARDED_MODELS to the shard `alias` until the block
+    ends. Yields the selection, whose alias may also be set later.
+    """
+    selection = ShardSelection(alias)
+    token = _shard.set(selection)
+    try:
+        yield selection
+    finally:
+        _shard.reset(token)
+
+
+def current_shard():
+    selection = _shard.get()
+    return selection.alias if selection is not None else None
+
+
+class ShardRouter:
+    """
+    Keeps each project and its memberships and comments on one of
+    PROJECT_SHARDS (see apps.projects.sharding for the placement): queries
+    of SHARDED_MODELS go to the database of the instance they're about,
+    else to the shard selected with use_shard(). Everything else stays on
+    the default database. Does nothing while PROJECT_SHARDS is empty.
+    """
+
+    def _shard_for(self, model, hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.PROJECT_SHARDS:
+            if model._meta.label_lower in settings.SHARDED_MODELS:
+                return instance._state.db
+            # e.g. the user of a comment: the primary copy
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower not in settings.SHARDED_MODELS:
+            return None
+        alias = current_shard()
+        if alias is None:
+            raise NoShardSelected(
+                f"{model._meta.label} is sharded; select the project's shard first (use_shard())."
+            )
+        return alias
+
+    def db_for_read(self, model, **hints):
+        if not settings.PROJECT_SHARDS:
+            return None
+        return self._shard_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        if not settings.PROJECT_SHARDS:
+            return None
+        return self._shard_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Shards hold copies of the users their rows refer to
+        databases = {DEFAULT_DB_ALIAS, *settings.PROJECT_SHARDS}
+        if settings.PROJECT_SHARDS and obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.PROJECT_SHARDS:
+            # The sharded tables and the ones they refer to, with the
+            # user indexes (accounts) for the member search
+            return app_label in ('projects', 'auth', 'contenttypes', 'accounts')
+        return None
@@ -43,23 +43,30 @@ INSTALLED_APPS = [
     'rest_framework',
     'apps.accounts',
     'apps.projects',
+    'apps.jobs',
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    "project_management.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # Before the session middleware: session writes pin the client too
+    "project_management.middleware.ReplicaPinningMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "apps.projects.sharding.ProjectShardMiddleware",
 ]
 
 ROOT_URLCONF = "project_management.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates, timing renders for RequestMetricsMiddleware
+        "BACKEND": "project_management.templating.TimedDjangoTemplates",
         "DIRS": [],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -86,6 +93,156 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile, applied to the default database when the
+# environment has SQLITE_PRODUCTION=1 (compare: manage.py sqlite_stress):
+# - WAL journal: readers no longer wait for the writer, nor it for them
+# - synchronous=NORMAL: safe against app crashes; a power loss can undo
+#   the last transactions, but never corrupts the file
+# - 256 MiB memory-mapped reads and a 64 MiB page cache per connection
+# - write transactions take the lock when they begin, instead of failing
+#   at once when two of them try to upgrade a read lock, and wait up to
+#   `timeout` seconds for it
+# - connections are kept for CONN_MAX_AGE seconds, checked before reuse
+
+SQLITE_PRODUCTION_PROFILE = {
+    "CONN_MAX_AGE": 600,
+    "CONN_HEALTH_CHECKS": True,
+    "OPTIONS": {
+        "init_command": (
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA mmap_size=268435456;"
+            "PRAGMA cache_size=-65536;"
+            "PRAGMA temp_store=MEMORY;"
+        ),
+        "transaction_mode": "IMMEDIATE",
+        "timeout": 10,
+    },
+}
+
+if os.environ.get("SQLITE_PRODUCTION") == "1":
+    DATABASES["default"].update(SQLITE_PRODUCTION_PROFILE)
+
+# Read replicas (project_management.routers.ReplicaRouter): reads of the
+# models below, made while serving a request that hasn't written, go to
+# one of DATABASE_REPLICAS, chosen per request in turn or, with
+# "least_loaded", the one serving the fewest requests. A client that
+# wrote reads from the primary for REPLICA_PIN_SECONDS, which should
+# exceed the replication lag.
+# SQLITE_REPLICAS=N in the environment adds N local SQLite copies of the
+# primary; refresh them with `manage.py sync_replicas`.
+
+DATABASE_ROUTERS = ["project_management.routers.ShardRouter", "project_management.routers.ReplicaRouter"]
+DATABASE_REPLICAS = []
+REPLICA_MODELS = ("projects.project", "projects.projectmembership", "projects.comment")
+REPLICA_SELECTION = "round_robin"
+REPLICA_PIN_SECONDS = 5
+
+for _i in range(1, int(os.environ.get("SQLITE_REPLICAS", "0")) + 1):
+    DATABASES[f"replica{_i}"] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / f"db.replica{_i}.sqlite3",
+        # Tests read the test database through the replica aliases
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{_i}")
+
+# Sharding (project_management.routers.ShardRouter, apps.projects.sharding):
+# each project lives with its memberships and comments on one of
+# PROJECT_SHARDS, chosen by a consistent hash of its id and recorded in
+# its ProjectPlacement in the default database, which keeps everything
+# else. Lists of a user's projects ask every shard, up to
+# SHARD_FANOUT_THREADS at once. After changing PROJECT_SHARDS (or turning
+# sharding on), run `manage.py rebalance_shards` before serving requests;
+# moves copy SHARD_MOVE_BATCH_SIZE rows per transaction.
+# SQLITE_SHARDS=N in the environment adds N local SQLite shards. The
+# sharding tests need two shard databases: run them with SQLITE_SHARDS=2
+# or --settings=project_management.test_settings.
+
+PROJECT_SHARDS = []
+SHARDED_MODELS = ("projects.project", "projects.projectmembership", "projects.comment", "projects.archivedcomment")
+SHARD_FANOUT_THREADS = 8
+SHARD_MOVE_BATCH_SIZE = 1000
+# Seconds a move waits after locking a project, for writes already past
+# the lock check to finish
+SHARD_MOVE_DRAIN_SECONDS = 2
+
+for _i in range(1, int(os.environ.get("SQLITE_SHARDS", "0")) + 1):
+    DATABASES[f"shard{_i}"] = {**DATABASES["default"], "NAME": BASE_DIR / f"db.shard{_i}.sqlite3"}
+    PROJECT_SHARDS.append(f"shard{_i}")
+
+# Writes wrapped in project_management.db.atomic_retry are retried this
+# many times when the lock wait still times out, pausing about
+# BACKOFF, 2 * BACKOFF, 4 * BACKOFF... seconds in between
+SQLITE_LOCK_RETRIES = 5
+SQLITE_LOCK_BACKOFF = 0.05
+
+
+# Request metrics (project_management.middleware.RequestMetricsMiddleware)
+# Adds a Server-Timing header and logs one record per request to the
+# 'project_management.requests' logger. The panel shows the same numbers
+# on HTML pages and refreshes on every HTMX request. Off by default: turn
+# it on to profile.
+
+REQUEST_METRICS_ENABLED = False
+REQUEST_METRICS_PANEL = False
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Local memory is per process: invalidation only reaches the worker that
+# made the write, so use a shared backend when running several workers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "project-management",
+    }
+}
+
+# Seconds a rendered HTMX fragment (project list, comment feed) is kept
+FRAGMENT_CACHE_TIMEOUT = 300
+
+
+# Login and signup throttling (apps.accounts.ratelimit): token buckets per
+# client IP and per username, checked before any password is hashed.
+# "N/m" allows bursts of N and N attempts a minute after that (s, m, h, d).
+# The local memory store is per process; in production use CacheStore with
+# a cache shared by all workers. Counters: /accounts/ratelimit/ (staff).
+
+RATELIMIT_ENABLED = True
+RATELIMIT_STORE = "apps.accounts.ratelimit.LocMemStore"
+RATELIMIT_CACHE = "default"
+RATELIMIT_LOCMEM_MAX_KEYS = 10000
+RATELIMIT_RATES = {
+    "login": {"ip": "20/m", "username": "5/m"},
+    "signup": {"ip": "10/h"},
+}
+
+
+# Live comment updates (Server-Sent Events, served by the ASGI app)
+# The in-memory broker only reaches clients connected to the same process.
+
+COMMENT_BROKER = "apps.projects.broker.InMemoryBroker"
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RETRY_MS = 5000
+# Events buffered per connection before a slow client starts missing some
+SSE_QUEUE_SIZE = 100
+
+
+# Background jobs (apps.jobs), run by `manage.py runjobs` workers
+# With JOBS_EAGER, jobs run inline when queued and no worker is needed
+# (tests, quick local setups); write requests then pay for their fan-out.
+
+JOBS_EAGER = False
+JOBS_MAX_ATTEMPTS = 5
+# Seconds before the first retry; doubles with every failed attempt
+JOBS_RETRY_DELAY = 10
+# Seconds after which a running job is assumed lost and claimed again
+JOBS_LOCK_TIMEOUT = 300
+JOBS_BATCH_SIZE = 100
+JOBS_POLL_INTERVAL = 1.0
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -133,3 +290,68 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Number of comments rendered per window of a project's comment feed
+COMMENTS_PAGE_SIZE = 20
+
+# Comments embedded per project in the API's project list
+PROJECT_RECENT_COMMENTS = 3
+# Projects per page of the project list
+PROJECT_LIST_PAGE_SIZE = 50
+
+# Rows fetched per query and sent per chunk by the streaming export
+EXPORT_CHUNK_SIZE = 2000
+
+# Bulk import (manage.py import_projects, or an upload in the admin):
+# rows written per transaction, invalid rows listed in the run's log, and
+# where uploads wait for the worker
+IMPORT_BATCH_SIZE = 1000
+# Batches per background job when importing an upload (one transaction)
+IMPORT_BATCHES_PER_JOB = 10
+IMPORT_ERRORS_KEPT = 100
+IMPORT_UPLOAD_DIR = BASE_DIR / "imports"
+
+# Most membership changes accepted by one bulk request
+BULK_MEMBERSHIP_MAX = 1000
+
+# Deleted projects are hidden at once and purged by jobs
+# (apps.projects.deletion): rows deleted per statement, and batches per
+# job (one transaction)
+PROJECT_PURGE_BATCH_SIZE = 1000
+PROJECT_PURGE_BATCHES_PER_JOB = 10
+
+# Full-text search over projects and comments (apps.projects.search).
+# Use "apps.projects.search.PostgresSearchBackend" on PostgreSQL.
+SEARCH_BACKEND = "apps.projects.search.SQLiteFTSBackend"
+SEARCH_MIN_LENGTH = 2
+SEARCH_PAGE_SIZE = 20
+# Newest matches per table that get ranked (SQLite backend); bounds the
+# cost of very common terms
+SEARCH_CANDIDATES = 1000
+
+# Per-user activity feed on the home page (apps.projects.activity)
+ACTIVITY_PAGE_SIZE = 20
+# Entries inserted per statement when fanning an event out to members
+ACTIVITY_FANOUT_BATCH_SIZE = 1000
+# Trimming (a job, queued at most once per interval): entries older than
+# the retention and past the newest MAX_ENTRIES of each user are deleted
+ACTIVITY_RETENTION_DAYS = 90
+ACTIVITY_FEED_MAX_ENTRIES = 500
+ACTIVITY_TRIM_INTERVAL = 3600
+
+# Comment archive (apps.projects.archive): comments older than
+# AFTER_DAYS move to the cold ArchivedComment table, BATCH_SIZE rows per
+# transaction, by a job queued at most once per INTERVAL seconds
+COMMENT_ARCHIVE_AFTER_DAYS = 365
+COMMENT_ARCHIVE_BATCH_SIZE = 1000
+COMMENT_ARCHIVE_BATCHES_PER_JOB = 10
+COMMENT_ARCHIVE_INTERVAL = 3600
+
+# Typeahead user search in the add member form
+USER_SEARCH_MIN_LENGTH = 1
+USER_SEARCH_LIMIT = 10
+
+# Seconds a user's {project: role} map is kept in the cache between requests.
+# 0 disables it (roles are still loaded only once per request). Only enable
+# with a cache shared by all workers, since invalidation is per cache.
+ROLE_CACHE_TIMEOUT = 0
@@ -0,0 +1,32 @@
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from .middleware import current_metrics
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_metrics()
+        if metrics is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, charging the time its templates take to
+    render to the request's RequestMetrics. Only templates rendered
+    through the backend (render(), TemplateResponse, render_to_string)
+    are timed, not the ones they include, so nothing is counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
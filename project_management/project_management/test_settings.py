@@ -0,0 +1,13 @@
+"""
+Settings for running the whole test suite, sharding tests included:
+
+    python manage.py test --settings=project_management.test_settings
+
+Adds two SQLite shard databases without turning sharding on: the sharding
+tests set PROJECT_SHARDS for themselves, everything else runs unsharded.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+for _i in (1, 2):
+    DATABASES.setdefault(f"shard{_i}", {**DATABASES["default"], "NAME": BASE_DIR / f"db.shard{_i}.sqlite3"})